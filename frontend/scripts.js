@@ -122,7 +122,11 @@ async function uploadFiles (files) {
 
       if (response.ok) {
         const result = await response.json()
-        showNotification(`${file.name} uploaded successfully`, 'success')
+        if (result.duplicate) {
+          showNotification(`${file.name}: ${result.message}`, 'info')
+        } else {
+          showNotification(`${file.name} uploaded successfully`, 'success')
+        }
         loadDocuments()
       } else {
         const error = await response.json()
@@ -270,8 +274,16 @@ async function startIndexing () {
     })
 
     if (response.ok) {
-      const result = await response.json()
-      showNotification(result.message, 'success')
+      const queued = await response.json()
+      loadDocuments()
+      const job = await waitForIndexJob(queued.job_id, button)
+
+      if (job.status !== 'completed') {
+        showNotification(`Indexing ${job.status}: ${job.error}`, 'error')
+        loadDocuments()
+        return
+      }
+      showNotification(job.message, 'success')
 
       // Update current parameters
       currentIndexParameters = {
@@ -293,6 +305,21 @@ async function startIndexing () {
   }
 }
 
+async function waitForIndexJob (jobId, button) {
+  // Poll the background job until it finishes, showing progress on the button
+  while (true) {
+    const response = await fetch(`${API_BASE}/index/jobs/${jobId}`)
+    const job = await response.json()
+    if (!response.ok) throw new Error(job.detail)
+
+    if (['completed', 'failed', 'cancelled'].includes(job.status)) return job
+
+    const rate = job.chunks_per_sec ? ` (${job.chunks_per_sec} chunks/s)` : ''
+    button.innerHTML = `<span class="loading"></span>${job.status === 'queued' ? 'Queued' : `${Math.round(job.progress)}%`}${rate}`
+    await new Promise(resolve => setTimeout(resolve, 1000))
+  }
+}
+
 async function submitQuery () {
   const query = document.getElementById('queryInput').value.trim()
   if (!query) {
@@ -303,6 +330,7 @@ async function submitQuery () {
   const button = document.getElementById('submitQueryBtn')
   const k = parseInt(document.getElementById('kValue').value)
   const expandQuery = document.getElementById('expandQuery').checked
+  const retrievalMode = document.getElementById('retrievalMode').value
 
   // Validate k value
   if (k < 1 || k > 20) {
@@ -320,19 +348,40 @@ async function submitQuery () {
   showNotification(`Searching for answers ${queryType} (k=${k})...`, 'info')
 
   try {
-    const response = await fetch(`${API_BASE}/query`, {
+    const response = await fetch(`${API_BASE}/query/stream`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({
         query: query,
         k: k,
-        expand_query: expandQuery
+        expand_query: expandQuery,
+        retrieval_mode: retrievalMode
       })
     })
 
     if (response.ok) {
-      const result = await response.json()
-      displayQueryResult(result, { k, expandQuery })
+      const result = { expanded_queries: [], answer: '' }
+      let rendered = false
+
+      await readEventStream(response, event => {
+        if (event.event === 'stage') {
+          button.innerHTML = `<span class="loading"></span>${event.message}`
+          return
+        } else if (event.event === 'expanded_queries') {
+          result.expanded_queries = event.expanded_queries
+        } else if (event.event === 'token') {
+          result.answer += event.text
+        } else if (event.event === 'done') {
+          result.answer = event.answer
+        } else if (event.event === 'error') {
+          throw new Error(event.message)
+        } else {
+          return
+        }
+        // Only scroll on the first render so streaming tokens don't jump the page
+        displayQueryResult(result, { k, expandQuery }, !rendered)
+        rendered = true
+      })
       showNotification('Query processed successfully!', 'success')
     } else {
       const error = await response.json()
@@ -346,7 +395,32 @@ async function submitQuery () {
   }
 }
 
-function displayQueryResult (result, queryParams) {
+async function readEventStream (response, onEvent) {
+  // Minimal Server-Sent Events parser for a fetch() response body
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      const data = frame
+        .split('\n')
+        .filter(line => line.startsWith('data: '))
+        .map(line => line.slice(6))
+        .join('\n')
+      if (data) onEvent(JSON.parse(data))
+    }
+  }
+}
+
+function displayQueryResult (result, queryParams, scroll = true) {
   const resultsSection = document.getElementById('queryResults')
   const resultsContent = document.getElementById('resultsContent')
 
@@ -392,5 +466,7 @@ function displayQueryResult (result, queryParams) {
     `
 
   resultsSection.style.display = 'block'
-  resultsSection.scrollIntoView({ behavior: 'smooth' })
+  if (scroll) {
+    resultsSection.scrollIntoView({ behavior: 'smooth' })
+  }
 }
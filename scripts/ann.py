@@ -0,0 +1,131 @@
+"""Approximate nearest-neighbour FAISS index types (IVF / PQ / HNSW) for large corpora"""
+import os
+import math
+import faiss
+import numpy as np
+from .config import ANN_MIN_VECTORS, ANN_NPROBE, ANN_HNSW_M, ANN_EF_SEARCH
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Exact vectors kept next to ANN indexes, so updates retrain from the originals
+# rather than from lossy PQ reconstructions
+VECTORS_NAME = "vectors.npy"
+
+def choose_nlist(n: int) -> int:
+    """About 4*sqrt(n) inverted lists, with at least 39 training points per list"""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+def pq_subquantizers(d: int) -> int:
+    """Largest divisor of d that is at most d/8 (768-dim vectors -> 96 one-byte codes)"""
+    for m in range(max(1, d // 8), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+def factory_string(index_type: str, d: int, n: int) -> str:
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{choose_nlist(n)},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{choose_nlist(n)},PQ{pq_subquantizers(d)}"
+    if index_type == "hnsw":
+        return f"HNSW{ANN_HNSW_M}"
+    raise ValueError(f"Unknown index type: {index_type}")
+
+def index_type_of(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def build_index(vectors: np.ndarray, index_type: str, metric=faiss.METRIC_L2):
+    """Train (when needed) and fill an index of the given type. Returns (index, factory string)."""
+    n, d = vectors.shape
+    spec = factory_string(index_type, d, n)
+    index = faiss.index_factory(d, spec, metric)
+    if not index.is_trained:
+        index.train(vectors)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # Keeps reconstruct() working for MMR re-ranking
+        ivf.make_direct_map()
+        ivf.nprobe = ANN_NPROBE
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ANN_EF_SEARCH
+    index.add(vectors)
+    return index, spec
+
+def exact_vectors(index, index_path=None) -> np.ndarray:
+    """All vectors in position order: saved originals for ANN indexes, else reconstructed"""
+    if index_path and index_type_of(index) != "flat":
+        vectors_path = os.path.join(index_path, VECTORS_NAME)
+        if os.path.exists(vectors_path):
+            vectors = np.load(vectors_path, mmap_mode="r")
+            if vectors.shape[0] == index.ntotal:
+                return np.ascontiguousarray(vectors, dtype=np.float32)
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+def to_flat(vectorstore, index_path=None):
+    """Swap an ANN index for an exact flat one so LangChain's add/delete keep positions contiguous"""
+    index = vectorstore.index
+    if index_type_of(index) == "flat":
+        return
+    flat = faiss.IndexFlat(index.d, index.metric_type)
+    flat.add(exact_vectors(index, index_path))
+    vectorstore.index = flat
+
+def apply_index_type(vectorstore, index_type: str, index_path) -> dict:
+    """
+    Convert a flat vector store to index_type and save the exact vectors it needs.
+
+    Corpora under ANN_MIN_VECTORS stay flat: an exact scan is as fast there and
+    IVF/PQ training needs enough points. Returns the manifest's "index" entry.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    vectors_path = os.path.join(index_path, VECTORS_NAME)
+    n = vectorstore.index.ntotal
+    effective = index_type if n >= ANN_MIN_VECTORS else "flat"
+    if effective != index_type:
+        print(f"Keeping a flat index: {n} vectors is below ANN_MIN_VECTORS ({ANN_MIN_VECTORS})")
+
+    if effective == "flat":
+        if os.path.exists(vectors_path):
+            os.remove(vectors_path)
+        spec = "Flat"
+    else:
+        vectors = exact_vectors(vectorstore.index)
+        vectorstore.index, spec = build_index(vectors, effective, vectorstore.index.metric_type)
+        os.makedirs(index_path, exist_ok=True)
+        tmp_path = vectors_path + ".tmp.npy"
+        np.save(tmp_path, vectors)
+        os.replace(tmp_path, vectors_path)
+    return {"requested": index_type, "type": effective, "factory": spec, "vectors": n}
+
+def search_parameters(index, nprobe: int = None, ef_search: int = None):
+    """Per-query FAISS search parameters for the index type, or None for its defaults"""
+    index_type = index_type_of(index)
+    if nprobe and index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if ef_search and index_type == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+def estimate_index_bytes(index) -> int:
+    """Approximate resident size of a FAISS index"""
+    downcast = faiss.downcast_index(index)
+    n, d = index.ntotal, index.d
+    if isinstance(downcast, faiss.IndexIVF):
+        # Codes plus stored ids, the coarse centroids and the direct map
+        return n * (downcast.code_size + 16) + downcast.nlist * d * 4
+    if isinstance(downcast, faiss.IndexHNSW):
+        # Flat storage plus roughly 2*M neighbour links per vector on level 0
+        return n * (d * 4 + downcast.hnsw.nb_neighbors(0) * 4)
+    return n * d * 4
@@ -0,0 +1,113 @@
+"""
+Recall-vs-latency report for the FAISS index types, to pick settings per corpus size.
+
+    python -m scripts.ann_report                          # synthetic corpora
+    python -m scripts.ann_report --index-path <index_dir>  # vectors of an existing index
+
+--index-path takes a session index (its shards' vectors are pooled), a single
+shard directory, or an index from before shards.
+
+Recall@k is measured against an exact flat search over the same vectors. No
+embedding or LLM calls are made.
+"""
+import os
+import argparse
+import time
+import faiss
+import numpy as np
+from .ann import INDEX_TYPES, build_index, exact_vectors, estimate_index_bytes
+from .docstore import INDEX_NAME
+from .manifest import load_manifest
+from .shards import shard_store, is_sharded
+
+NPROBE_SWEEP = (1, 4, 8, 16, 32, 64)
+EF_SEARCH_SWEEP = (16, 32, 64, 128, 256)
+
+def synthetic_corpus(n: int, d: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 100), d)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, d)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def sample_queries(vectors: np.ndarray, n_queries: int, seed: int = 1) -> np.ndarray:
+    """Perturbed copies of stored vectors, so queries land near real neighbourhoods"""
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.integers(0, len(vectors), n_queries)]
+    noise = rng.standard_normal(picks.shape).astype(np.float32) * picks.std()
+    return np.ascontiguousarray(picks + noise, dtype=np.float32)
+
+def measure(index, queries, truth, k, params=None) -> tuple[float, float]:
+    """(recall@k, mean milliseconds per single-query search)"""
+    found = []
+    start = time.perf_counter()
+    for query in queries:
+        _, indices = index.search(query[None, :], k, params=params)
+        found.append(indices[0])
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    hits = sum(len(set(row) & set(expected)) for row, expected in zip(found, truth))
+    return hits / truth.size, elapsed_ms
+
+def index_vectors(index_path) -> np.ndarray:
+    """Exact vectors of an index directory; a sharded session index pools its shards'"""
+    manifest = load_manifest(index_path)
+    if is_sharded(manifest):
+        paths = sorted({shard_store.path(entry["shard"]) for entry in manifest["documents"].values()})
+    else:
+        paths = [index_path]
+    vectors = []
+    for path in paths:
+        file_path = os.path.join(path, INDEX_NAME)
+        if not os.path.exists(file_path):
+            raise SystemExit(f"No FAISS index at {file_path}")
+        vectors.append(exact_vectors(faiss.read_index(file_path), path))
+    if not vectors or not sum(len(v) for v in vectors):
+        raise SystemExit(f"No vectors in {index_path}")
+    print(f"Read {sum(len(v) for v in vectors)} vectors from {len(paths)} index files")
+    return np.vstack(vectors)
+
+def report(vectors: np.ndarray, n_queries: int, k: int, index_types=INDEX_TYPES):
+    n, d = vectors.shape
+    queries = sample_queries(vectors, n_queries)
+    flat = faiss.IndexFlatL2(d)
+    flat.add(vectors)
+    _, truth = flat.search(queries, k)
+
+    print(f"\n{n} vectors x {d} dims, {n_queries} queries, recall@{k}")
+    print(f"{'index':<22}{'setting':<16}{'recall':>8}{'ms/query':>10}{'build s':>9}{'MB':>9}")
+    for index_type in index_types:
+        start = time.perf_counter()
+        index, spec = build_index(vectors, index_type)
+        build_s = time.perf_counter() - start
+        mb = estimate_index_bytes(index) / 1e6
+        if index_type in ("ivf_flat", "ivf_pq"):
+            nlist = faiss.extract_index_ivf(index).nlist
+            sweep = [(f"nprobe={p}", faiss.SearchParametersIVF(nprobe=p)) for p in NPROBE_SWEEP if p <= nlist]
+        elif index_type == "hnsw":
+            sweep = [(f"efSearch={ef}", faiss.SearchParametersHNSW(efSearch=ef)) for ef in EF_SEARCH_SWEEP]
+        else:
+            sweep = [("exact", None)]
+        for setting, params in sweep:
+            recall, ms = measure(index, queries, truth, k, params)
+            print(f"{spec:<22}{setting:<16}{recall:>8.3f}{ms:>10.3f}{build_s:>9.2f}{mb:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-path", help="Report on the vectors of an existing index directory")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 200_000],
+                        help="Synthetic corpus sizes (ignored with --index-path)")
+    parser.add_argument("--dim", type=int, default=768, help="Synthetic vector dimension (embedding-001 is 768)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    args = parser.parse_args()
+
+    if args.index_path:
+        report(index_vectors(args.index_path), args.queries, args.k, args.types)
+    else:
+        for n in args.sizes:
+            report(synthetic_corpus(n, args.dim), args.queries, args.k, args.types)
+
+if __name__ == "__main__":
+    main()
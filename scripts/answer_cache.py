@@ -0,0 +1,120 @@
+"""Answer cache keyed by index version, with an optional semantic-match mode"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from .config import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_SEMANTIC_THRESHOLD
+from .manifest import index_version
+from .query_expansion import normalize_query
+
+class AnswerCache:
+    """
+    Caches final answers per (index path, index version, normalized query, k, expand,
+    retrieval settings and document filter).
+
+    Entries for an older index version can never match, and are dropped on the next
+    lookup or store for that index. With semantic_threshold > 0, a query whose embedding
+    has cosine similarity >= threshold with a cached query (same index version, k and
+    expand) reuses that answer.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, semantic_threshold: float = ANSWER_CACHE_SEMANTIC_THRESHOLD):
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self._entries = OrderedDict()  # key -> {"answer", "expanded_queries", "vector", "created_at"}
+        self._versions = {}  # index path -> newest version seen
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold > 0
+
+    def _scope(self, index_path, k: int, expand: bool, mode: str, search_params, document_ids):
+        path = os.path.abspath(index_path)
+        version = index_version(index_path)
+        if self._versions.get(path) != version:
+            self._drop_path(path)
+            self._versions[path] = version
+        documents = tuple(sorted(set(document_ids))) if document_ids else None
+        return (path, version, k, expand, mode, tuple(sorted((search_params or {}).items())), documents)
+
+    def _drop_path(self, path):
+        for key in [key for key in self._entries if key[0] == path]:
+            del self._entries[key]
+
+    def lookup(self, index_path, query: str, k: int, expand: bool, query_vector=None, mode: str = "dense",
+               search_params=None, document_ids=None, count_miss: bool = True) -> Optional[dict]:
+        """
+        Return the cached entry (with a "cache" field of "exact" or "semantic") or None.
+        count_miss=False is for an exact-only check that is followed by a semantic lookup.
+        """
+        with self._lock:
+            scope = self._scope(index_path, k, expand, mode, search_params, document_ids)
+            key = scope + (normalize_query(query),)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return dict(entry, cache="exact")
+
+            if self.semantic_enabled and query_vector is not None:
+                candidates = [(key, e) for key, e in self._entries.items() if key[:-1] == scope and e["vector"] is not None]
+                if candidates:
+                    matrix = np.vstack([e["vector"] for _, e in candidates])
+                    similarities = matrix @ _unit(query_vector)
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.semantic_threshold:
+                        best_key, best_entry = candidates[best]
+                        self._entries.move_to_end(best_key)
+                        self.semantic_hits += 1
+                        return dict(best_entry, cache="semantic", similarity=float(similarities[best]))
+
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def store(self, index_path, query: str, k: int, expand: bool, answer: str, expanded_queries: list, query_vector=None,
+              mode: str = "dense", search_params=None, document_ids=None):
+        with self._lock:
+            key = self._scope(index_path, k, expand, mode, search_params, document_ids) + (normalize_query(query),)
+            self._entries[key] = {
+                "answer": answer,
+                "expanded_queries": expanded_queries,
+                "vector": _unit(query_vector) if query_vector is not None else None,
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, index_path):
+        """Drop every answer for an index (called on re-index and delete)"""
+        with self._lock:
+            path = os.path.abspath(index_path)
+            self._drop_path(path)
+            self._versions.pop(path, None)
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "semantic_threshold": self.semantic_threshold,
+        }
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+answer_cache = AnswerCache()
@@ -0,0 +1,101 @@
+"""Answer many questions at once: shared expansion, embedding and retrieval, bounded generation"""
+import asyncio
+from typing import Dict, List, Optional
+from .config import BATCH_MAX_CONCURRENCY
+from .retrieval import retrieve_hits, fuse_hits
+from .query_expansion import aexpand_query, normalize_query
+from .generation import build_prompt, describe_sources, NO_DOCUMENTS_ANSWER
+from .llm import get_llm, record_usage, athrottle
+from .metrics import timed, RETRIEVED_DOCUMENTS
+
+async def abatch_answer(
+    queries: List[str],
+    retriever,
+    expand: bool = True,
+    k: int = 5,
+    retrieval_mode: str = "dense",
+    search_params: Optional[Dict] = None,
+    max_concurrency: int = BATCH_MAX_CONCURRENCY
+):
+    """
+    Answer a list of questions, yielding (position in queries, result) as each
+    answer is ready; result has "answer", "expanded_queries" and "sources".
+
+    Questions that normalize to the same text are answered once. Expansions run
+    concurrently, then every distinct query string of the batch (questions and
+    expansions) is embedded in one batched call and searched once, so questions
+    with overlapping expansions share retrieval. At most max_concurrency LLM calls
+    are in flight, within LLM_REQUESTS_PER_MINUTE.
+    """
+    groups = {}  # normalized question -> positions in queries
+    for position, query in enumerate(queries):
+        groups.setdefault(normalize_query(query), []).append(position)
+    questions = [queries[positions[0]] for positions in groups.values()]
+    slots = asyncio.Semaphore(max_concurrency)
+
+    async def expand_question(question):
+        if not expand:
+            return []
+        async with slots:
+            try:
+                return await aexpand_query(question)
+            except Exception as e:
+                print(f"Warning: Query expansion failed: {e}")
+                return []
+
+    expansions = await asyncio.gather(*(expand_question(question) for question in questions))
+
+    search_queries = list(dict.fromkeys(
+        query for question, expanded in zip(questions, expansions) for query in [question, *expanded]
+    ))
+    try:
+        hit_lists = await asyncio.to_thread(retrieve_hits, search_queries, retriever, k, retrieval_mode, search_params)
+    except Exception as e:
+        for positions, expanded in zip(groups.values(), expansions):
+            result = {"answer": f"Error during document retrieval: {str(e)}", "expanded_queries": expanded, "sources": []}
+            for position in positions:
+                yield position, result
+        return
+    # Hybrid search returns the dense lists followed by the lexical lists
+    n = len(search_queries)
+    hits_by_query = {
+        query: [hit_lists[i]] + ([hit_lists[n + i]] if retrieval_mode == "hybrid" else [])
+        for i, query in enumerate(search_queries)
+    }
+
+    async def answer(question, expanded):
+        question_hits = [hits for query in [question, *expanded] for hits in hits_by_query[query]]
+        try:
+            docs = await asyncio.to_thread(fuse_hits, retriever, question_hits, k)
+        except Exception as e:
+            return {"answer": f"Error during document retrieval: {str(e)}", "expanded_queries": expanded, "sources": []}
+        RETRIEVED_DOCUMENTS.inc(len(docs), mode=retrieval_mode)
+        if not docs:
+            return {"answer": NO_DOCUMENTS_ANSWER, "expanded_queries": expanded, "sources": []}
+
+        prompt = build_prompt(question, docs)
+        async with slots:
+            try:
+                await athrottle()
+                with timed("generation"):
+                    response = await get_llm().ainvoke(prompt)
+                text = response.content.strip()
+                record_usage("generation", prompt, text, getattr(response, "usage_metadata", None))
+            except Exception as e:
+                text = f"Error during answer generation: {str(e)}"
+        return {"answer": text, "expanded_queries": expanded, "sources": describe_sources(docs)}
+
+    async def answer_group(positions, question, expanded):
+        return positions, await answer(question, expanded)
+
+    tasks = [asyncio.create_task(answer_group(positions, question, expanded))
+             for positions, question, expanded in zip(groups.values(), questions, expansions)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            positions, result = await finished
+            for position in positions:
+                yield position, result
+    finally:
+        # The consumer stopped early (e.g. the client disconnected)
+        for task in tasks:
+            task.cancel()
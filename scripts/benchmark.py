@@ -0,0 +1,337 @@
+"""
+Offline performance benchmark. Gemini is replaced by the local fakes in
+fake_gemini.py with fixed latencies, so runs are repeatable and need no API key.
+
+    python -m scripts.benchmark run --replicate 4 --output before.json
+    python -m scripts.benchmark compare before.json after.json
+
+Measures PDF load, chunk and embed throughput, index build and load time,
+p50/p95/p99 retrieval and query latency in-process, and concurrent /query
+throughput against scripts/server.py served from this process. All state lives
+in a temporary DATA_DIR / UPLOAD_DIR, so caches from earlier runs don't skew it.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import asyncio
+import datetime
+import platform
+import tempfile
+import threading
+import subprocess
+import contextlib
+import concurrent.futures
+from pathlib import Path
+import numpy as np
+
+SAMPLE_DIR = Path(__file__).parent.parent / "sample_research_papers"
+# Metric name suffixes: larger is better for throughput, smaller for everything timed or sized
+HIGHER_IS_BETTER = ("_per_sec",)
+LOWER_IS_BETTER = ("_ms", "_seconds", "_bytes")
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the pipeline's progress prints while a stage is timed"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def latency_metrics(prefix: str, samples_ms: list[float]) -> dict:
+    return {
+        f"{prefix}_mean_ms": float(np.mean(samples_ms)),
+        **{f"{prefix}_p{p}_ms": float(np.percentile(samples_ms, p)) for p in (50, 95, 99)},
+    }
+
+def replicate_corpus(source_dir, target_dir, replicas: int) -> list[Path]:
+    """
+    Copy every PDF replicas times as r<n>_<name>.pdf. Copies after the first end
+    with a comment naming the replica, so the server doesn't deduplicate them.
+    """
+    target_dir.mkdir(parents=True, exist_ok=True)
+    sources = sorted(Path(source_dir).glob("*.pdf"))
+    if not sources:
+        raise FileNotFoundError(f"No PDFs in {source_dir}")
+    paths = []
+    for replica in range(replicas):
+        for source in sources:
+            path = target_dir / f"r{replica}_{source.name}"
+            shutil.copyfile(source, path)
+            if replica:
+                # Bytes after %%EOF are ignored by PDF readers but change the content hash
+                with open(path, "ab") as f:
+                    f.write(f"\n% replica r{replica}\n".encode())
+            paths.append(path)
+    return paths
+
+def make_queries(chunks, n: int, seed: int) -> list[str]:
+    """Distinct queries cut from random chunks, so retrieval has real matches and caches miss"""
+    rng = np.random.default_rng(seed)
+    queries = {}
+    for _ in range(n * 20):
+        if len(queries) == n:
+            break
+        words = chunks[rng.integers(len(chunks))].page_content.split()
+        start = rng.integers(max(1, len(words) - 10))
+        query = " ".join(words[start:start + 10])
+        if query:
+            queries[query] = None
+    return list(queries)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def bench_server(paths, queries, args) -> dict:
+    """Upload and index the corpus through the API, then send queries from concurrent clients"""
+    import uvicorn
+    import requests
+    from .server import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=free_port(), log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{server.config.port}"
+
+    try:
+        http = requests.Session()
+        doc_ids = []
+        duplicates = []
+        for path in paths:
+            with open(path, "rb") as f:
+                response = http.post(f"{base_url}/upload", files={"file": (path.name, f, "application/pdf")})
+            response.raise_for_status()
+            uploaded = response.json()
+            if uploaded["duplicate"]:
+                duplicates.append(path.name)
+            else:
+                doc_ids.append(uploaded["id"])
+        if duplicates:
+            # Deduplicated uploads aren't indexed again, so the stage covers less than the corpus
+            print(f"Warning: the server deduplicated {len(duplicates)} of {len(paths)} uploads: "
+                  f"{', '.join(duplicates)}", file=sys.stderr)
+        job = http.post(f"{base_url}/index", json={"document_ids": doc_ids, "index_type": args.index_type}).json()
+        job_url = f"{base_url}/index/jobs/{job['job_id']}"
+        while job["status"] not in ("completed", "failed", "cancelled"):
+            time.sleep(0.2)
+            job = http.get(job_url).json()
+        if job["status"] != "completed":
+            raise RuntimeError(f"Server indexing job {job['status']}: {job.get('error')}")
+
+        cookies = {"session_id": http.cookies["session_id"]}
+        body = {"expand_query": True, "k": args.k, "use_cache": False, "retrieval_mode": args.retrieval_mode}
+
+        def send(query: str) -> float:
+            start = time.perf_counter()
+            response = requests.post(f"{base_url}/query", json={**body, "query": query}, cookies=cookies)
+            response.raise_for_status()
+            return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = list(pool.map(send, queries))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    failed = (job.get("result") or {}).get("failed", [])
+    return {
+        "server_documents_indexed": len(doc_ids) - len(failed),
+        "server_requests_per_sec": len(queries) / elapsed,
+        **latency_metrics("server_query", latencies),
+    }
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="thynk-benchmark-"))
+    # Must be set before scripts.config is imported
+    os.environ["DATA_DIR"] = str(workdir / "data")
+    os.environ["UPLOAD_DIR"] = str(workdir / "uploads")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+    from .fake_gemini import install
+    install(args.embed_latency / 1000, args.llm_latency / 1000, args.token_latency / 1000, args.dim)
+    from . import config
+    from .indexing import load_files, chunk_documents, embed_documents
+    from .retrieval import load_faiss_index, get_retriever, retrieve_hits
+    from .generation import agenerate_answer
+    from .eviction import dir_bytes
+
+    metrics = {}
+    server_documents = None
+    try:
+        paths = replicate_corpus(args.corpus, workdir / "corpus", args.replicate)
+        corpus_bytes = sum(path.stat().st_size for path in paths)
+        print(f"Corpus: {len(paths)} PDFs ({corpus_bytes / 1e6:.1f} MB), workdir {workdir}")
+
+        start = time.perf_counter()
+        with quiet():
+            docs = load_files([str(path) for path in paths])
+        elapsed = time.perf_counter() - start
+        metrics["load_pages_per_sec"] = len(docs) / elapsed
+        metrics["load_mb_per_sec"] = corpus_bytes / 1e6 / elapsed
+
+        start = time.perf_counter()
+        chunks = chunk_documents(docs, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+        metrics["chunk_chunks_per_sec"] = len(chunks) / (time.perf_counter() - start)
+        # Replicas get a tag so they miss the embedding cache like new documents would
+        for chunk in chunks:
+            replica = Path(chunk.metadata["source"]).name.split("_", 1)[0]
+            if replica != "r0":
+                chunk.page_content += f" [{replica}]"
+        print(f"Loaded {len(docs)} pages into {len(chunks)} chunks")
+
+        index_dir = workdir / "data" / "benchmark" / "faiss_index"
+        embedded_at = {}
+
+        def on_progress(stage, progress, message, details=None):
+            if stage == "embedding" and progress >= 100:
+                embedded_at["time"] = time.perf_counter()
+
+        start = time.perf_counter()
+        with quiet():
+            embed_documents(chunks, save_path=index_dir, progress_callback=on_progress, index_type=args.index_type)
+        finished = time.perf_counter()
+        # Embedding includes adding vectors to the flat index; building covers ANN training, BM25 and saving
+        metrics["embed_chunks_per_sec"] = len(chunks) / (embedded_at["time"] - start)
+        metrics["index_build_seconds"] = finished - embedded_at["time"]
+        metrics["index_bytes"] = dir_bytes(index_dir)
+
+        load_times = []
+        for _ in range(args.load_repeats):
+            start = time.perf_counter()
+            load_faiss_index(index_dir)
+            load_times.append(time.perf_counter() - start)
+        metrics["index_load_seconds"] = float(np.median(load_times))
+        print(f"Indexed in {metrics['index_build_seconds']:.2f}s after embedding, "
+              f"loads in {metrics['index_load_seconds']:.3f}s")
+
+        retriever = get_retriever(index_dir, k=args.k)
+        latencies = []
+        for query in make_queries(chunks, args.queries, seed=0):
+            start = time.perf_counter()
+            retrieve_hits([query], retriever, args.k, mode=args.retrieval_mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+        metrics.update(latency_metrics("retrieval", latencies))
+
+        async def time_queries(queries):
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                await agenerate_answer(query, retriever=retriever, expand=True, k=args.k,
+                                       retrieval_mode=args.retrieval_mode)
+                latencies.append((time.perf_counter() - start) * 1000)
+            return latencies
+
+        with quiet():
+            latencies = asyncio.run(time_queries(make_queries(chunks, args.queries, seed=1)))
+        metrics.update(latency_metrics("query", latencies))
+        print(f"Query p50 {metrics['query_p50_ms']:.0f} ms, p99 {metrics['query_p99_ms']:.0f} ms")
+
+        if not args.skip_server:
+            with quiet():
+                server_metrics = bench_server(paths, make_queries(chunks, args.requests, seed=2), args)
+            server_documents = server_metrics.pop("server_documents_indexed")
+            metrics.update(server_metrics)
+            print(f"Server: {metrics['server_requests_per_sec']:.1f} requests/sec "
+                  f"at concurrency {args.concurrency}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "embedding_batch_size": config.EMBEDDING_BATCH_SIZE,
+            "embedding_max_in_flight": config.EMBEDDING_MAX_IN_FLIGHT,
+        },
+        "settings": {key: value for key, value in vars(args).items() if key not in ("command", "output")},
+        "corpus": {"files": len(paths), "bytes": corpus_bytes, "pages": len(docs), "chunks": len(chunks),
+                   "server_documents_indexed": server_documents},
+        "metrics": metrics,
+    }
+
+def compare(old: dict, new: dict, threshold: float) -> int:
+    """Print both runs side by side; returns how many metrics regressed by more than threshold percent"""
+    regressions = 0
+    print(f"{'metric':<28}{'old':>14}{'new':>14}{'change':>10}")
+    for name in sorted(set(old["metrics"]) | set(new["metrics"])):
+        before, after = old["metrics"].get(name), new["metrics"].get(name)
+        if before is None or after is None:
+            before, after = (f"{value:.3f}" if value is not None else "-" for value in (before, after))
+            print(f"{name:<28}{before:>14}{after:>14}")
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        if name.endswith(HIGHER_IS_BETTER):
+            regressed = change < -threshold
+        elif name.endswith(LOWER_IS_BETTER):
+            regressed = change > threshold
+        else:
+            regressed = False
+        regressions += regressed
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<28}{before:>14.3f}{after:>14.3f}{change:>+9.1f}%{flag}")
+    if old["settings"] != new["settings"] or old["corpus"] != new["corpus"]:
+        print("\nNote: the runs used different settings or corpora")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark and write a results file")
+    run_parser.add_argument("--corpus", default=str(SAMPLE_DIR), help="Directory of PDFs to benchmark on")
+    run_parser.add_argument("--replicate", type=int, default=1, help="Copies of the corpus to index")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--embed-latency", type=float, default=50, help="Fake embedding request latency (ms)")
+    run_parser.add_argument("--llm-latency", type=float, default=100, help="Fake LLM latency before the first token (ms)")
+    run_parser.add_argument("--token-latency", type=float, default=2, help="Fake LLM latency per answer token (ms)")
+    run_parser.add_argument("--dim", type=int, default=768, help="Fake embedding dimension")
+    run_parser.add_argument("--chunk-size", type=int, default=800)
+    run_parser.add_argument("--chunk-overlap", type=int, default=150)
+    run_parser.add_argument("--index-type", default="flat", choices=("flat", "ivf_flat", "ivf_pq", "hnsw"))
+    run_parser.add_argument("--retrieval-mode", default="hybrid", choices=("dense", "lexical", "hybrid"))
+    run_parser.add_argument("-k", type=int, default=5)
+    run_parser.add_argument("--queries", type=int, default=50, help="Sequential in-process queries")
+    run_parser.add_argument("--load-repeats", type=int, default=3)
+    run_parser.add_argument("--requests", type=int, default=100, help="Queries sent to the server")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="Concurrent server clients")
+    run_parser.add_argument("--skip-server", action="store_true", help="Skip the server throughput stage")
+    run_parser.add_argument("--keep", action="store_true", help="Keep the temporary working directory")
+
+    compare_parser = commands.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="Regression threshold (percent)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run(args)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        sys.exit(1 if compare(old, new, args.threshold) else 0)
+
+if __name__ == "__main__":
+    main()
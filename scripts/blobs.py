@@ -0,0 +1,109 @@
+"""Content-addressed upload storage: each distinct file is kept once, next to its parsed pages"""
+import os
+import json
+import time
+from pathlib import Path
+from uuid import uuid4
+from .config import BLOB_DIR
+
+class BlobStore:
+    """
+    Files stored as <root>/<sha[:2]>/<sha>.pdf. Sessions reference blobs by content
+    hash, so a paper uploaded many times is stored, parsed and embedded once.
+    Unreferenced blobs are removed by collect_garbage().
+    """
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = Path(root)
+        self.incoming = self.root / ".incoming"
+
+    def path(self, content_hash: str) -> Path:
+        return self.root / content_hash[:2] / f"{content_hash}.pdf"
+
+    def pages_path(self, content_hash: str) -> Path:
+        return self.root / content_hash[:2] / f"{content_hash}.pages.json"
+
+    def temp_path(self) -> Path:
+        """Where an upload is written before its hash is known"""
+        self.incoming.mkdir(parents=True, exist_ok=True)
+        return self.incoming / uuid4().hex
+
+    def commit(self, temp_path, content_hash: str) -> tuple[Path, bool]:
+        """Move a finished upload into place; returns (blob path, whether it was new)"""
+        path = self.path(content_hash)
+        if path.exists():
+            os.remove(temp_path)
+            # Fresh mtime keeps the blob out of garbage collection until it is referenced
+            os.utime(path)
+            return path, False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp_path, path)
+        return path, True
+
+    def load_pages(self, content_hash: str):
+        """Parsed (text, metadata) pages saved for this content, or None"""
+        try:
+            with open(self.pages_path(content_hash)) as f:
+                return [(text, metadata) for text, metadata in json.load(f)]
+        except (OSError, ValueError):
+            return None
+
+    def save_pages(self, content_hash: str, pages: list):
+        path = self.pages_path(content_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(pages, f)
+        os.replace(tmp_path, path)
+
+    def stored(self) -> dict:
+        """content hash -> bytes on disk (blob plus parsed pages)"""
+        sizes = {}
+        if not self.root.exists():
+            return sizes
+        for shard in self.root.iterdir():
+            if not shard.is_dir() or shard == self.incoming:
+                continue
+            for entry in shard.iterdir():
+                content_hash = entry.name.split(".", 1)[0]
+                try:
+                    sizes[content_hash] = sizes.get(content_hash, 0) + entry.stat().st_size
+                except OSError:
+                    pass  # removed while listing
+        return sizes
+
+    def collect_garbage(self, referenced: set, min_age_seconds: float) -> tuple[int, int]:
+        """
+        Remove blobs no document references, unless touched within min_age_seconds
+        (an upload may be about to reference them), and stale partial uploads.
+        Returns (blobs removed, bytes freed).
+        """
+        cutoff = time.time() - min_age_seconds
+        removed = freed = 0
+        for content_hash, nbytes in self.stored().items():
+            if content_hash in referenced:
+                continue
+            path = self.path(content_hash)
+            try:
+                if path.exists() and path.stat().st_mtime > cutoff:
+                    continue
+            except OSError:
+                continue
+            for stale in (path, self.pages_path(content_hash)):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+            removed += 1
+            freed += nbytes
+        if self.incoming.exists():
+            for partial in self.incoming.iterdir():
+                try:
+                    if partial.stat().st_mtime < cutoff:
+                        freed += partial.stat().st_size
+                        os.remove(partial)
+                except OSError:
+                    pass
+        return removed, freed
+
+blob_store = BlobStore()
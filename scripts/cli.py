@@ -1,5 +1,11 @@
 """Command-line interface for PsyRAG"""
+import sys
+import json
+import time
+import asyncio
+import argparse
 from .core import PsyRAGCore
+from .config import BATCH_MAX_CONCURRENCY
 
 def print_progress(stage, progress, message, details=None):
     print(f"[{progress:3.0f}%] {stage.upper()}: {message}")
@@ -7,7 +13,32 @@ def print_progress(stage, progress, message, details=None):
         for i, q in enumerate(details['expanded_queries'], 1):
             print(f"  {i}. {q}")
 
-def main():
+async def stream_answer(psyrag: PsyRAGCore, query: str):
+    """Print stage events as they happen, then the answer token by token"""
+    answering = False
+    async for event in psyrag.stream_query(query, expand=True):
+        kind = event["event"]
+        if kind == "stage" and not answering:
+            print_progress(event["stage"], event["progress"], event["message"], event["details"])
+        elif kind == "sources":
+            sources = sorted({f"{s['filename']} p.{s['page']}" for s in event["sources"]})
+            print(f"  Sources: {', '.join(sources)}")
+        elif kind == "token":
+            if not answering:
+                answering = True
+                print("\n" + "=" * 50)
+                print("🧠 PsyRAG ANSWER:")
+                print("=" * 50)
+            print(event["text"], end="", flush=True)
+        elif kind == "done":
+            if not answering:
+                print("\n" + "=" * 50)
+                print("🧠 PsyRAG ANSWER:")
+                print("=" * 50)
+                print(event["answer"], end="")
+            print("\n" + "=" * 50)
+
+async def interactive_loop():
     print("🧠 PsyRAG - Psychology RAG System")
     print("=" * 50)
     
@@ -18,7 +49,8 @@ def main():
         print("✅ Retriever loaded successfully!")
         
         while True:
-            query = input("\nAsk a question (or 'quit' to exit): ").strip()
+            # One event loop for the whole session: the async Gemini client is bound to it
+            query = (await asyncio.to_thread(input, "\nAsk a question (or 'quit' to exit): ")).strip()
             
             if query.lower() in ['quit', 'exit', 'q']:
                 print("👋 Goodbye!")
@@ -28,17 +60,7 @@ def main():
                 continue
             
             try:
-                answer, expanded = psyrag.process_query(
-                    query, 
-                    expand=True, 
-                    progress_callback=print_progress
-                )
-                
-                print("\n" + "=" * 50)
-                print("🧠 PsyRAG ANSWER:")
-                print("=" * 50)
-                print(answer)
-                print("=" * 50)
+                await stream_answer(psyrag, query)
                 
             except Exception as e:
                 print(f"Error: {e}")
@@ -46,5 +68,50 @@ def main():
     except Exception as e:
         print(f"Failed to initialize: {e}")
 
+def read_questions(path: str) -> list[str]:
+    """One question per line ("-" reads stdin); blank lines and lines starting with # are skipped"""
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+async def batch_mode(args):
+    """Answer every question in args.batch, writing one JSON line per answer as it finishes"""
+    questions = read_questions(args.batch)
+    # Results go to stdout by default, so status messages go to stderr
+    print(f"Answering {len(questions)} questions (concurrency {args.concurrency})...", file=sys.stderr)
+    psyrag = PsyRAGCore(k=args.k)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    started = time.perf_counter()
+    done = 0
+    try:
+        async for position, result in psyrag.batch_query(
+            questions, expand=not args.no_expand, retrieval_mode=args.mode, max_concurrency=args.concurrency
+        ):
+            out.write(json.dumps({"index": position, "query": questions[position], **result}) + "\n")
+            out.flush()
+            done += 1
+            if done % 10 == 0 or done == len(questions):
+                print(f"  {done}/{len(questions)} answered", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print(f"Answered {done} questions in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.2f}/s)", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="PsyRAG question answering")
+    parser.add_argument("--batch", metavar="FILE", help="answer the questions in FILE (one per line, - for stdin) as JSON lines")
+    parser.add_argument("--output", default="-", help="where batch results are written (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_MAX_CONCURRENCY, help="answers generated at once")
+    parser.add_argument("--k", type=int, default=5, help="chunks retrieved per question")
+    parser.add_argument("--mode", choices=("dense", "lexical", "hybrid"), default="dense", help="retrieval mode")
+    parser.add_argument("--no-expand", action="store_true", help="skip query expansion")
+    args = parser.parse_args()
+    
+    if args.batch:
+        asyncio.run(batch_mode(args))
+    else:
+        asyncio.run(interactive_loop())
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -7,36 +7,133 @@ from pathlib import Path
 gemini_api_key = os.getenv("GEMINI_API_KEY")
 
 # Handle Google credentials
-google_credentials_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
+# Local service-account file used in development when GOOGLE_APPLICATION_CREDENTIALS_JSON is unset
+LOCAL_CREDENTIALS_PATH = "/Users/ashaypatel/Documents/UI_RAG_25/keys/rag-25-1d93449ac55d.json"
+_google_credentials_loaded = False
 google_api_key = None
 
-if google_credentials_json:
-    try:
-        # Parse the JSON credentials
-        credentials_data = json.loads(google_credentials_json)
-        
-        # Create a temporary file with the credentials
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-            json.dump(credentials_data, temp_file)
-            google_api_key = temp_file.name
+def load_google_credentials():
+    """
+    Point GOOGLE_APPLICATION_CREDENTIALS at the service-account credentials and
+    return their file path (None if there are none). Runs when the first Gemini
+    client is created rather than at import, so startup writes no files.
+    """
+    global _google_credentials_loaded, google_api_key
+    if _google_credentials_loaded:
+        return google_api_key
+    _google_credentials_loaded = True
+
+    google_credentials_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
+    if google_credentials_json:
+        try:
+            # Parse the JSON credentials
+            credentials_data = json.loads(google_credentials_json)
             
-        # Set the environment variable for Google libraries to use
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = google_api_key
-    except json.JSONDecodeError as e:
-        print(f"Error parsing Google credentials JSON: {e}")
-        google_api_key = None
-else:
-    # Fallback to local file path for development
-    local_credentials_path = "/Users/ashaypatel/Documents/UI_RAG_25/keys/rag-25-1d93449ac55d.json"
-    if os.path.exists(local_credentials_path):
-        google_api_key = local_credentials_path
+            # Create a temporary file with the credentials
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
+                json.dump(credentials_data, temp_file)
+                google_api_key = temp_file.name
+                
+            # Set the environment variable for Google libraries to use
+            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = google_api_key
+        except json.JSONDecodeError as e:
+            print(f"Error parsing Google credentials JSON: {e}")
+            google_api_key = None
+    elif os.path.exists(LOCAL_CREDENTIALS_PATH):
+        # Fallback to local file path for development
+        google_api_key = LOCAL_CREDENTIALS_PATH
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = google_api_key
+    return google_api_key
 
 # File paths
 BASE_DIR = Path(__file__).parent
-DATA_DIR = BASE_DIR / "data"
+# Indexes, caches and session state (uploads go to UPLOAD_DIR); overridable to run isolated copies
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "data"))
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", BASE_DIR / "uploads"))
+# Content-addressed upload files shared by all sessions (see blobs.py)
+BLOB_DIR = UPLOAD_DIR / "blobs"
+# Per-document index shards shared by all sessions (see shards.py)
+SHARD_DIR = DATA_DIR / "shards"
 FAISS_INDEX_PATH = DATA_DIR / "faiss_index"
+EMBEDDING_CACHE_PATH = DATA_DIR / "embedding_cache.sqlite"
+
+# Embedding cache size (number of cached vectors before LRU eviction)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# Parallel PDF parsing (0 = one worker per CPU core; large PDFs are split into page ranges)
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", "0"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "100"))
+
+# Indexing embedding pipeline (batch size, batches in flight, rate limits, retries)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_MAX_IN_FLIGHT = int(os.getenv("EMBEDDING_MAX_IN_FLIGHT", "4"))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "1500"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "0"))  # 0 = unlimited
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+
+# Uploads: largest accepted file (bytes) and uploads written at once per worker (others wait)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_MAX_CONCURRENT = int(os.getenv("UPLOAD_MAX_CONCURRENT", "4"))
+
+# Background indexing jobs (worker threads, finished jobs kept for status lookups)
+INDEX_JOB_WORKERS = int(os.getenv("INDEX_JOB_WORKERS", "2"))
+INDEX_JOB_HISTORY = int(os.getenv("INDEX_JOB_HISTORY", "200"))
+
+# Session, document, history and job store shared by all server workers ("sqlite" or "module:Class")
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "sqlite")
+SESSION_STORE_PATH = DATA_DIR / "sessions.sqlite"
+
+# Query expansion cache (TTL in seconds, persisted across restarts)
+EXPANSION_CACHE_PATH = DATA_DIR / "expansion_cache.sqlite"
+EXPANSION_CACHE_TTL = int(os.getenv("EXPANSION_CACHE_TTL", str(7 * 24 * 3600)))
+EXPANSION_CACHE_MAX_ENTRIES = int(os.getenv("EXPANSION_CACHE_MAX_ENTRIES", "5000"))
+
+# Answer cache (semantic threshold is a cosine similarity; 0 disables semantic hits)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0"))
+
+# Multi-query result fusion (reciprocal rank fusion constant, MMR relevance/diversity trade-off)
+RRF_K = int(os.getenv("RRF_K", "60"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# RAM budget for loaded vector stores shared across sessions (bytes)
+VECTORSTORE_CACHE_MAX_BYTES = int(os.getenv("VECTORSTORE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Session eviction: loaded stores idle this long are dropped from RAM; session files are
+# removed after SESSION_MAX_IDLE_DAYS, or least recently used first while over the disk budget
+VECTORSTORE_MAX_IDLE_SECONDS = int(os.getenv("VECTORSTORE_MAX_IDLE_SECONDS", "1800"))
+SESSION_DISK_BUDGET_BYTES = int(os.getenv("SESSION_DISK_BUDGET_BYTES", str(2 * 1024 ** 3)))
+SESSION_MAX_IDLE_DAYS = int(os.getenv("SESSION_MAX_IDLE_DAYS", "7"))
+SESSION_MIN_IDLE_SECONDS = int(os.getenv("SESSION_MIN_IDLE_SECONDS", "3600"))  # never evict files of sessions used more recently
+EVICTION_INTERVAL_SECONDS = int(os.getenv("EVICTION_INTERVAL_SECONDS", "300"))
+
+# Vector index type: flat (exact), ivf_flat, ivf_pq or hnsw, per document shard. Shards under ANN_MIN_VECTORS stay flat.
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "1000"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))  # IVF lists searched per query
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "64"))  # HNSW candidate list size per query
+
+# Threads searching and loading a sharded index's per-document shards in parallel
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))
+
+# Batch queries: questions per request, answers generated at once; Gemini chat requests per minute
+# for expansion and generation calls (0 = no limit; set it to your quota)
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+
+# Prompt context size (estimated tokens) filled with merged chunks in relevance order
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# Cold start: defer LangChain / FAISS / Gemini imports until first use (0 imports them at startup),
+# then warm the indexes of the most recently active sessions in the background
+FAST_STARTUP = os.getenv("FAST_STARTUP", "1") == "1"
+PREWARM_SESSIONS = int(os.getenv("PREWARM_SESSIONS", "3"))
+
+# Memory-mapped read window for each index's SQLite docstore (bytes)
+DOCSTORE_MMAP_BYTES = int(os.getenv("DOCSTORE_MMAP_BYTES", str(256 * 1024 * 1024)))
 
 # Create directories if they don't exist
-DATA_DIR.mkdir(exist_ok=True)
+DATA_DIR.mkdir(parents=True, exist_ok=True)
 FAISS_INDEX_PATH.mkdir(exist_ok=True)
\ No newline at end of file
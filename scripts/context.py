@@ -0,0 +1,106 @@
+"""Assemble retrieved chunks into a compact, token-budgeted prompt context"""
+import os
+from .config import CONTEXT_TOKEN_BUDGET
+from .embeddings import estimate_tokens
+
+# Longest chunk overlap looked for when chunks carry no start_index (indexes built before it was recorded)
+MAX_TEXT_OVERLAP = 1000
+# Don't bother appending a truncated span smaller than this
+MIN_SPAN_TOKENS = 50
+
+class Span:
+    """Continuous text from one file and page, built from one or more chunks"""
+
+    def __init__(self, doc, rank: int):
+        self.source = doc.metadata.get("filename") or os.path.basename(doc.metadata.get("source", "")) or "unknown"
+        self.page = doc.metadata.get("page")
+        self.start = doc.metadata.get("start_index")
+        self.text = doc.page_content
+        self.rank = rank
+
+    @property
+    def end(self):
+        return self.start + len(self.text) if self.start is not None else None
+
+    def label(self, n: int) -> str:
+        page = f", p. {self.page + 1}" if isinstance(self.page, int) else ""
+        return f"[{n}] {self.source}{page}"
+
+def _text_overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of left that is a prefix of right"""
+    for size in range(min(len(left), len(right), MAX_TEXT_OVERLAP), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def _merge(span: Span, doc, rank: int) -> bool:
+    """Extend span with doc when they overlap or touch; returns False if they are disjoint"""
+    text = doc.page_content
+    start = doc.metadata.get("start_index")
+    if span.start is not None and start is not None:
+        if start > span.end or start + len(text) < span.start:
+            return False
+        if start < span.start:
+            span.text = text[:span.start - start] + span.text
+            span.start = start
+        if start + len(text) > span.end:
+            span.text += text[span.end - start:]
+    elif text in span.text:
+        pass
+    elif span.text in text:
+        span.text = text
+    else:
+        overlap = _text_overlap(span.text, text)
+        if overlap:
+            span.text += text[overlap:]
+        else:
+            overlap = _text_overlap(text, span.text)
+            if not overlap:
+                return False
+            span.text = text + span.text[overlap:]
+    span.rank = min(span.rank, rank)
+    return True
+
+def merge_chunks(docs) -> list[Span]:
+    """
+    Merge chunks from the same file and page into continuous spans, dropping
+    repeated overlap text and duplicate chunks. Spans keep their best chunk's rank.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    spans = []
+    for members in groups.values():
+        # Position order lets each chunk chain onto the span before it
+        members.sort(key=lambda item: item[1].metadata.get("start_index") or 0)
+        group_spans = []
+        for rank, doc in members:
+            if not any(_merge(span, doc, rank) for span in group_spans):
+                group_spans.append(Span(doc, rank))
+        spans.extend(group_spans)
+    return sorted(spans, key=lambda span: span.rank)
+
+def _truncate(text: str, max_tokens: int) -> str:
+    cut = text[:max_tokens * 4]
+    boundary = cut.rfind(" ")
+    return (cut[:boundary] if boundary > 0 else cut) + " ..."
+
+def pack_context(docs, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Merged spans in relevance order, each under a [n] source label, within token_budget"""
+    blocks = []
+    remaining = token_budget
+    for span in merge_chunks(docs):
+        label = span.label(len(blocks) + 1)
+        cost = estimate_tokens(label) + estimate_tokens(span.text)
+        if cost <= remaining:
+            blocks.append(f"{label}\n{span.text}")
+            remaining -= cost
+        else:
+            # Leave room for the separators and the trailing ellipsis
+            room = remaining - estimate_tokens(label) - 2
+            if room >= MIN_SPAN_TOKENS:
+                blocks.append(f"{label}\n{_truncate(span.text, room)}")
+            break
+    return "\n\n".join(blocks)
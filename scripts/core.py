@@ -1,7 +1,9 @@
 """Core PsyRAG functionality shared between CLI and API"""
-from typing import Optional, Tuple, List, Callable
+from typing import Optional, Tuple, List, Callable, AsyncIterator
 from .retrieval import get_retriever
-from .generation import generate_answer
+from .generation import generate_answer, astream_answer
+from .batch import abatch_answer
+from .config import BATCH_MAX_CONCURRENCY
 
 class PsyRAGCore:
     def __init__(self, k: int = 5):
@@ -19,15 +21,17 @@ class PsyRAGCore:
         query: str, 
         expand: bool = True, 
         k: Optional[int] = None,
-        progress_callback: Optional[Callable] = None
+        progress_callback: Optional[Callable] = None,
+        retrieval_mode: str = "dense",
+        search_params: Optional[dict] = None
     ) -> Tuple[str, List[str]]:
         """Process a query and return answer with expanded queries"""
-        if k is not None and k != self.k:
+        if k is not None:
             self.k = k
-            self.retriever = None  # Force re-initialization
         
-        if self.retriever is None:
-            self.initialize_retriever()
+        # Vector stores are cached process-wide, so this never reloads the index
+        # just because k changed; a re-index is picked up via the index version
+        self.initialize_retriever()
         
         return generate_answer(
             query=query,
@@ -35,5 +39,53 @@ class PsyRAGCore:
             expand=expand,
             return_expanded=True,
             k=self.k,
-            progress_callback=progress_callback
-        )
\ No newline at end of file
+            progress_callback=progress_callback,
+            retrieval_mode=retrieval_mode,
+            search_params=search_params
+        )
+    
+    def stream_query(
+        self,
+        query: str,
+        expand: bool = True,
+        k: Optional[int] = None,
+        retrieval_mode: str = "dense",
+        search_params: Optional[dict] = None
+    ) -> AsyncIterator[dict]:
+        """Stream pipeline events and answer tokens for a query (see astream_answer)"""
+        if k is not None:
+            self.k = k
+        self.initialize_retriever()
+        
+        return astream_answer(
+            query=query,
+            retriever=self.retriever,
+            expand=expand,
+            k=self.k,
+            retrieval_mode=retrieval_mode,
+            search_params=search_params
+        )
+    
+    def batch_query(
+        self,
+        queries: List[str],
+        expand: bool = True,
+        k: Optional[int] = None,
+        retrieval_mode: str = "dense",
+        search_params: Optional[dict] = None,
+        max_concurrency: int = BATCH_MAX_CONCURRENCY
+    ) -> AsyncIterator[Tuple[int, dict]]:
+        """Answer many questions, yielding (position, result) as each is ready (see abatch_answer)"""
+        if k is not None:
+            self.k = k
+        self.initialize_retriever()
+        
+        return abatch_answer(
+            queries,
+            retriever=self.retriever,
+            expand=expand,
+            k=self.k,
+            retrieval_mode=retrieval_mode,
+            search_params=search_params,
+            max_concurrency=max_concurrency
+        )
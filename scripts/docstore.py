@@ -0,0 +1,141 @@
+"""SQLite-backed chunk store that replaces the pickled LangChain docstore and id map"""
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+import faiss
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from .config import DOCSTORE_MMAP_BYTES
+
+DOCSTORE_NAME = "docstore.sqlite"
+INDEX_NAME = "index.faiss"
+LEGACY_PICKLE_NAME = "index.pkl"
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Chunk text and metadata in a memory-mapped SQLite file, read only for the hits
+    a query returns. Adds and deletes are buffered until commit(), so queries served
+    from the current version never see a half-written index.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA mmap_size={DOCSTORE_MMAP_BYTES}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS id_map (position INTEGER PRIMARY KEY, docstore_id TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._pending = {}  # docstore_id -> Document added since the last commit
+        self._deleted = set()
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        for docstore_id, doc in texts.items():
+            self._pending[docstore_id] = doc
+            self._deleted.discard(docstore_id)
+
+    def delete(self, ids: List) -> None:
+        for docstore_id in ids:
+            self._pending.pop(docstore_id, None)
+            self._deleted.add(docstore_id)
+
+    def search(self, search: str) -> str | Document:
+        doc = self.search_many([search])[0]
+        return doc if doc is not None else f"ID {search} not found."
+
+    def search_many(self, ids: List[str]) -> List[Optional[Document]]:
+        """Documents for ids in order (None where missing), in one query per 500 ids"""
+        stored = [docstore_id for docstore_id in ids
+                  if docstore_id not in self._pending and docstore_id not in self._deleted]
+        found = {}
+        with self._lock:
+            for start in range(0, len(stored), 500):
+                batch = stored[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT id, content, metadata FROM chunks WHERE id IN ({placeholders})", batch
+                ).fetchall()
+                for docstore_id, content, metadata in rows:
+                    found[docstore_id] = Document(page_content=content, metadata=json.loads(metadata))
+        return [self._pending.get(docstore_id) or found.get(docstore_id) for docstore_id in ids]
+
+    def load_id_map(self) -> dict:
+        """FAISS position -> docstore_id, the only per-chunk state kept in memory"""
+        with self._lock:
+            rows = self._conn.execute("SELECT docstore_id FROM id_map ORDER BY position").fetchall()
+        return {position: docstore_id for position, (docstore_id,) in enumerate(rows)}
+
+    def commit(self, index_to_docstore_id: dict, replace: bool = False):
+        """Apply buffered changes and the new id map in one transaction (replace drops all chunks first)"""
+        with self._lock, self._conn:
+            if replace:
+                self._conn.execute("DELETE FROM chunks")
+            elif self._deleted:
+                self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in self._deleted])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, content, metadata) VALUES (?, ?, ?)",
+                [(docstore_id, doc.page_content, json.dumps(doc.metadata))
+                 for docstore_id, doc in self._pending.items()]
+            )
+            self._conn.execute("DELETE FROM id_map")
+            self._conn.executemany(
+                "INSERT INTO id_map (position, docstore_id) VALUES (?, ?)",
+                sorted(index_to_docstore_id.items())
+            )
+        self._pending = {}
+        self._deleted = set()
+
+    def pending_bytes(self) -> int:
+        return sum(len(doc.page_content) + 200 for doc in self._pending.values())
+
+def fetch_documents(docstore, ids: List[str]) -> List[Document]:
+    """Materialize documents for ids in order; missing ids are skipped"""
+    if isinstance(docstore, SQLiteDocstore):
+        docs = docstore.search_many(ids)
+    else:
+        docs = [docstore.search(docstore_id) for docstore_id in ids]
+    return [doc for doc in docs if isinstance(doc, Document)]
+
+def save_vectorstore(vectorstore: FAISS, index_path):
+    """
+    Write the FAISS index and docstore to index_path.
+
+    A store loaded from index_path commits only its changes; a freshly built or
+    legacy in-memory docstore is copied into SQLite once and then read from disk.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    docstore_path = os.path.join(index_path, DOCSTORE_NAME)
+    docstore = vectorstore.docstore
+    if isinstance(docstore, SQLiteDocstore) and os.path.abspath(docstore.path) == os.path.abspath(docstore_path):
+        docstore.commit(vectorstore.index_to_docstore_id)
+    else:
+        ids = list(vectorstore.index_to_docstore_id.values())
+        target = SQLiteDocstore(docstore_path)
+        target.add(dict(zip(ids, fetch_documents(docstore, ids))))
+        target.commit(vectorstore.index_to_docstore_id, replace=True)
+        vectorstore.docstore = target
+
+    index_file = os.path.join(index_path, INDEX_NAME)
+    faiss.write_index(vectorstore.index, index_file + ".tmp")
+    os.replace(index_file + ".tmp", index_file)
+    legacy_path = os.path.join(index_path, LEGACY_PICKLE_NAME)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+def load_vectorstore(index_path, embeddings) -> FAISS:
+    """Load an index saved by save_vectorstore, or a legacy pickled one (migrated on its next save)"""
+    docstore_path = os.path.join(index_path, DOCSTORE_NAME)
+    if not os.path.exists(docstore_path):
+        return FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+    docstore = SQLiteDocstore(docstore_path)
+    index = faiss.read_index(os.path.join(index_path, INDEX_NAME))
+    return FAISS(embeddings, index, docstore, docstore.load_id_map())
@@ -0,0 +1,293 @@
+"""Embedding model setup with a persistent, content-addressed embedding cache"""
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+import concurrent.futures
+from typing import Callable, Iterator, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from .config import (
+    gemini_api_key,
+    load_google_credentials,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_IN_FLIGHT,
+    EMBEDDING_REQUESTS_PER_MINUTE,
+    EMBEDDING_TOKENS_PER_MINUTE,
+    EMBEDDING_MAX_RETRIES,
+)
+
+EMBEDDING_MODEL = "models/embedding-001"
+
+class EmbeddingCache:
+    """SQLite-backed vector cache with size-bounded LRU eviction"""
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Server workers share the file; wait for another worker's write instead of failing
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Return {key: vector} for the keys present in the cache"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                # Recency only guides eviction, so a busy database must not fail the lookup
+                try:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, key) for key in found]
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    self._conn.rollback()
+                    print(f"Embedding cache: could not update access times: {e}")
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items: dict):
+        """Store {key: vector} and evict least recently used entries over the bound"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+            )
+            # Counted in the database: other workers add and evict entries too
+            self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._size -= overflow
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+        }
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model so repeated texts are served from the cache.
+
+    Keys are (model, task, sha256(text)); documents and queries are embedded
+    with different task types by Gemini, so they are cached separately.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.model = model
+        self.cache = cache
+
+    def _key(self, task: str, text: str) -> str:
+        return f"{self.model}:{task}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _embed_cached(self, texts: List[str], task: str, embed_fn) -> List[List[float]]:
+        keys = [self._key(task, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        return [list(found[key]) for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(texts, "document", self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries with one batched request for the cache misses"""
+        return self._embed_cached(texts, "query", self._embed_queries_uncached)
+
+    def _embed_queries_uncached(self, texts: List[str]) -> List[List[float]]:
+        if isinstance(self.underlying, GoogleGenerativeAIEmbeddings):
+            # embed_query is a one-text batch with the query task type; batch them instead
+            return self.underlying.embed_documents(texts, task_type="retrieval_query")
+        return [self.underlying.embed_query(text) for text in texts]
+
+_embeddings: Optional[CachedEmbeddings] = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings() -> CachedEmbeddings:
+    """Return the process-wide cached embeddings model"""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            load_google_credentials()
+            underlying = GoogleGenerativeAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                google_api_key=gemini_api_key
+            )
+            _embeddings = CachedEmbeddings(underlying, EMBEDDING_MODEL, EmbeddingCache())
+        return _embeddings
+
+class RateLimiter:
+    """Token-bucket limiter on requests and (estimated) tokens per minute"""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens: int = 0):
+        """Block until one request carrying `tokens` tokens is allowed"""
+        if self.tokens_per_minute:
+            # A single oversized request may never fit the bucket; cap it
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                enough_tokens = not self.tokens_per_minute or self._tokens >= tokens
+                if self._requests >= 1 and enough_tokens:
+                    self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens
+                    return
+                wait = (1 - self._requests) * 60 / self.requests_per_minute if self._requests < 1 else 0
+                if not enough_tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+            time.sleep(max(wait, 0.01))
+
+_rate_limiter = RateLimiter(EMBEDDING_REQUESTS_PER_MINUTE, EMBEDDING_TOKENS_PER_MINUTE)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+def _embed_batch_with_retry(embeddings: Embeddings, texts: List[str], rate_limiter: RateLimiter, max_retries: int):
+    def send(embed_fn, texts):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        for attempt in range(max_retries + 1):
+            rate_limiter.acquire(tokens)
+            try:
+                return embed_fn(texts)
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                delay = min(2 ** attempt, 30) + random.uniform(0, 1)
+                print(f"Embedding batch failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    if isinstance(embeddings, CachedEmbeddings):
+        # Cache hits are served first; only the texts sent to the API count against the limits
+        return embeddings._embed_cached(texts, "document", lambda missing: send(embeddings.underlying.embed_documents, missing))
+    return send(embeddings.embed_documents, texts)
+
+def embed_in_batches(
+    texts: List[str],
+    embeddings: Optional[Embeddings] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT,
+    rate_limiter: Optional[RateLimiter] = None,
+    max_retries: int = EMBEDDING_MAX_RETRIES,
+    progress_callback: Optional[Callable] = None
+) -> Iterator[Tuple[int, List[List[float]]]]:
+    """
+    Embed texts in batches, keeping up to max_in_flight batches running.
+
+    Yields (start_offset, vectors) for each batch as soon as it finishes, so callers
+    can add vectors to the index incrementally. Batches may complete out of order.
+    Progress is reported as progress_callback("embedding", percent, message, details)
+    with chunks/sec throughput in details.
+    """
+    embeddings = embeddings or get_embeddings()
+    rate_limiter = rate_limiter or _rate_limiter
+    total = len(texts)
+    offsets = iter(range(0, total, batch_size))
+    done = 0
+    started = time.monotonic()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        pending = {}
+
+        def submit_next():
+            start = next(offsets, None)
+            if start is None:
+                return False
+            batch = texts[start:start + batch_size]
+            future = executor.submit(_embed_batch_with_retry, embeddings, batch, rate_limiter, max_retries)
+            pending[future] = start
+            return True
+
+        for _ in range(max_in_flight):
+            if not submit_next():
+                break
+
+        while pending:
+            finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                start = pending.pop(future)
+                vectors = future.result()
+                done += len(vectors)
+                yield start, vectors
+
+                elapsed = max(time.monotonic() - started, 1e-6)
+                rate = done / elapsed
+                if progress_callback:
+                    progress_callback(
+                        "embedding", 100 * done / total,
+                        f"Embedded {done}/{total} chunks ({rate:.1f} chunks/sec)",
+                        {"chunks_embedded": done, "total_chunks": total, "chunks_per_sec": rate}
+                    )
+                submit_next()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,253 @@
+"""Keeps loaded vector stores and session files within RAM and disk budgets"""
+import os
+import shutil
+import datetime
+import threading
+from pathlib import Path
+from typing import Optional
+from collections import Counter
+from . import vectorstore_cache
+from .answer_cache import answer_cache
+from .session_store import SessionStore, ACTIVE_JOB_STATES
+from .blobs import BlobStore
+from .shards import ShardStore
+from .manifest import load_manifest
+from .config import (
+    VECTORSTORE_MAX_IDLE_SECONDS,
+    SESSION_DISK_BUDGET_BYTES,
+    SESSION_MAX_IDLE_DAYS,
+    SESSION_MIN_IDLE_SECONDS,
+    FAISS_INDEX_PATH,
+)
+
+def dir_bytes(path) -> int:
+    """Total size of the files under path (0 if it doesn't exist)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # removed while walking
+    return total
+
+def process_rss_bytes() -> int:
+    """Resident memory of this worker process (0 where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+class EvictionManager:
+    """
+    Periodic sweep over every session:
+
+    1. Vector stores idle for max_idle_seconds are dropped from this worker's cache
+       (the cache itself also evicts least recently used stores over its RAM budget).
+    2. Sessions inactive for max_idle_days lose their uploads, index and stored state.
+    3. While session files exceed disk_budget_bytes, the least recently active
+       sessions are removed too, except those used within min_idle_seconds or
+       with an indexing job queued or running.
+    4. Stored uploads no document references any more are deleted, and so are
+       index shards no session index references.
+
+    The budget is measured against bytes actually on disk: each stored upload and
+    index shard counts once, however many sessions reference it. Per-session figures
+    attribute shared files to every session that references them; they order and
+    report sessions, and evicting a session is only taken to free its own files and
+    the shared ones nothing else references.
+    """
+
+    def __init__(self, store: SessionStore, upload_root, data_root, blobs: BlobStore = None,
+                 shards: ShardStore = None,
+                 disk_budget_bytes: int = SESSION_DISK_BUDGET_BYTES,
+                 max_idle_days: int = SESSION_MAX_IDLE_DAYS,
+                 min_idle_seconds: int = SESSION_MIN_IDLE_SECONDS,
+                 max_idle_seconds: int = VECTORSTORE_MAX_IDLE_SECONDS):
+        self.store = store
+        self.upload_root = Path(upload_root)
+        self.data_root = Path(data_root)
+        self.blobs = blobs
+        self.shards = shards
+        self.disk_budget_bytes = disk_budget_bytes
+        self.max_idle_days = max_idle_days
+        self.min_idle_seconds = min_idle_seconds
+        self.max_idle_seconds = max_idle_seconds
+        self._lock = threading.Lock()
+        self.last_sweep = None
+        self.sessions_evicted = 0
+        self.vectorstores_evicted = 0
+        self.blobs_removed = 0
+        self.shards_removed = 0
+
+    def upload_dir(self, session_id: str) -> Path:
+        return self.upload_root / session_id
+
+    def index_dir(self, session_id: str) -> Path:
+        return self.data_root / session_id / "faiss_index"
+
+    def _session_path(self, root: Path, session_id: str) -> Optional[Path]:
+        """root/session_id, or None if that is not a session's own directory (e.g. the shared shards)"""
+        path = (root / session_id).resolve()
+        shared = {store.root.resolve() for store in (self.blobs, self.shards) if store is not None}
+        shared.add(Path(FAISS_INDEX_PATH).resolve())
+        if path.parent != root.resolve() or path in shared:
+            return None
+        return path
+
+    def usage(self) -> list[dict]:
+        """Per-session disk usage and last activity, least recently active first"""
+        return self._usage()[0]
+
+    def _usage(self) -> tuple[list[dict], dict]:
+        """
+        usage() plus, per session, (bytes only it holds, content hashes of its stored
+        uploads, keys of its index shards)
+        """
+        now = datetime.datetime.now()
+        sessions = {session["id"]: session["last_active"] for session in self.store.list_sessions()}
+        # Session directories left behind without a stored session (e.g. from before the store existed)
+        for root in (self.upload_root, self.data_root):
+            if root.exists():
+                for entry in root.iterdir():
+                    if self.blobs is not None and entry == self.blobs.root:
+                        continue
+                    if entry.is_dir() and (root == self.upload_root or (entry / "faiss_index").is_dir()):
+                        mtime = datetime.datetime.fromtimestamp(entry.stat().st_mtime).isoformat()
+                        sessions.setdefault(entry.name, mtime)
+
+        usage, holdings = [], {}
+        for session_id, last_active in sessions.items():
+            stored_docs = [doc for doc in self.store.get_documents(session_id).values() if doc.get("content_hash")]
+            upload_dir = self._session_path(self.upload_root, session_id)
+            own_upload_bytes = dir_bytes(upload_dir) if upload_dir else 0
+            upload_bytes = own_upload_bytes + sum(doc.get("size") or 0 for doc in stored_docs)
+            index_dir = self.index_dir(session_id)
+            valid = self._session_path(self.data_root, session_id) is not None
+            entries = [entry for entry in load_manifest(index_dir)["documents"].values() if entry.get("shard")] if valid else []
+            own_index_bytes = dir_bytes(index_dir) if valid else 0
+            index_bytes = own_index_bytes + sum(entry.get("shard_bytes") or 0 for entry in entries)
+            holdings[session_id] = (
+                own_upload_bytes + own_index_bytes,
+                {doc["content_hash"] for doc in stored_docs},
+                {entry["shard"] for entry in entries},
+            )
+            usage.append({
+                "session_id": session_id,
+                "last_active": last_active,
+                "idle_seconds": int((now - datetime.datetime.fromisoformat(last_active)).total_seconds()),
+                "upload_bytes": upload_bytes,
+                "index_bytes": index_bytes,
+                "bytes": upload_bytes + index_bytes,
+            })
+        return sorted(usage, key=lambda session: session["last_active"]), holdings
+
+    def _stored(self) -> tuple[dict, dict]:
+        """(content hash -> bytes of stored uploads, shard key -> bytes of index shards)"""
+        return (self.blobs.stored() if self.blobs is not None else {},
+                self.shards.stored() if self.shards is not None else {})
+
+    @staticmethod
+    def _disk_bytes(holdings: dict, blob_sizes: dict, shard_sizes: dict) -> int:
+        """Session files plus every stored upload and shard, each counted once"""
+        own = sum(own_bytes for own_bytes, _, _ in holdings.values())
+        return own + sum(blob_sizes.values()) + sum(shard_sizes.values())
+
+    def remove_session(self, session_id: str):
+        index_dir = self.index_dir(session_id)
+        vectorstore_cache.invalidate(index_dir)
+        answer_cache.invalidate(index_dir)
+        if self.shards is not None:
+            self.shards.release_index(index_dir)
+        # Another worker may be sweeping too, so missing files are fine
+        for root in (self.upload_root, self.data_root):
+            path = self._session_path(root, session_id)
+            if path is None:
+                print(f"Not removing {root / session_id}: not a session directory")
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+        self.store.delete_session(session_id)
+
+    def _has_active_job(self, session_id: str) -> bool:
+        return any(job["status"] in ACTIVE_JOB_STATES for job in self.store.list_jobs(session_id))
+
+    def sweep(self) -> dict:
+        """Run one eviction pass; returns what was evicted"""
+        with self._lock:
+            evicted_stores = vectorstore_cache.evict_idle(self.max_idle_seconds)
+            usage, holdings = self._usage()
+            blob_sizes, shard_sizes = self._stored()
+            total = self._disk_bytes(holdings, blob_sizes, shard_sizes)
+            blob_refs = Counter(content_hash for _, hashes, _ in holdings.values() for content_hash in hashes)
+            shard_refs = Counter(key for _, _, keys in holdings.values() for key in keys)
+            evicted = []
+            for session in usage:
+                expired = session["idle_seconds"] > self.max_idle_days * 86400
+                over_budget = total > self.disk_budget_bytes and session["idle_seconds"] > self.min_idle_seconds
+                if not (expired or over_budget) or self._has_active_job(session["session_id"]):
+                    continue
+                try:
+                    self.remove_session(session["session_id"])
+                except Exception as e:
+                    print(f"Error evicting session {session['session_id']}: {e}")
+                    continue
+                # Shared files still referenced by other sessions stay on disk
+                own_bytes, hashes, keys = holdings[session["session_id"]]
+                freed = own_bytes
+                for refs, sizes, held in ((blob_refs, blob_sizes, hashes), (shard_refs, shard_sizes, keys)):
+                    for key in held:
+                        refs[key] -= 1
+                        if not refs[key]:
+                            freed += sizes.get(key, 0)
+                total -= freed
+                evicted.append(session["session_id"])
+                print(f"Evicted session {session['session_id']} ({session['bytes']} bytes, "
+                      f"idle {session['idle_seconds']}s)")
+
+            blobs_removed = 0
+            if self.blobs is not None:
+                blobs_removed, freed = self.blobs.collect_garbage(self.store.content_hashes(), self.min_idle_seconds)
+                if blobs_removed:
+                    print(f"Removed {blobs_removed} unreferenced uploads ({freed} bytes)")
+            shards_removed = 0
+            if self.shards is not None:
+                shards_removed, freed = self.shards.collect_garbage(self.min_idle_seconds, vectorstore_cache.invalidate)
+                if shards_removed:
+                    print(f"Removed {shards_removed} unreferenced index shards ({freed} bytes)")
+
+            self.vectorstores_evicted += evicted_stores
+            self.sessions_evicted += len(evicted)
+            self.blobs_removed += blobs_removed
+            self.shards_removed += shards_removed
+            self.last_sweep = datetime.datetime.now().isoformat()
+            return {"vectorstores_evicted": evicted_stores, "sessions_evicted": evicted,
+                    "blobs_removed": blobs_removed, "shards_removed": shards_removed, "disk_bytes": total}
+
+    def stats(self) -> dict:
+        usage, holdings = self._usage()
+        stored, shards = self._stored()
+        refs = self.shards.ref_counts() if self.shards is not None else {}
+        return {
+            "disk": {
+                "bytes": self._disk_bytes(holdings, stored, shards),
+                "budget_bytes": self.disk_budget_bytes,
+                "sessions": usage,
+                "blobs": {"files": len(stored), "bytes": sum(stored.values())},
+                "shards": {"shards": len(shards), "bytes": sum(shards.values()),
+                           "references": sum(refs.values())},
+            },
+            "memory": {
+                "process_rss_bytes": process_rss_bytes(),
+                "vectorstores": vectorstore_cache.stats(),
+                "loaded": vectorstore_cache.entries(),
+                "max_idle_seconds": self.max_idle_seconds,
+            },
+            "evictions": {
+                "last_sweep": self.last_sweep,
+                "sessions": self.sessions_evicted,
+                "vectorstores": self.vectorstores_evicted,
+                "blobs": self.blobs_removed,
+                "shards": self.shards_removed,
+            },
+        }
@@ -0,0 +1,101 @@
+"""
+Deterministic local stand-ins for the Gemini chat and embedding clients, for
+benchmarks and offline runs. install() must run before scripts.embeddings is
+imported, since it binds the embeddings class at import time (chat clients are
+looked up when the first one is created).
+"""
+import sys
+import time
+import asyncio
+import hashlib
+import numpy as np
+import langchain_google_genai
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# Latencies in seconds, set by install()
+EMBED_LATENCY = 0.05       # per embedding request
+LLM_LATENCY = 0.1          # per chat request, before the first token
+TOKEN_LATENCY = 0.002      # per streamed answer token
+EMBEDDING_DIM = 768        # embedding-001 dimension
+ANSWER_TOKENS = 64
+
+def _seed(text: str) -> int:
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+
+class FakeGeminiEmbeddings(Embeddings):
+    """Unit vectors seeded by the text hash: the same text always gets the same vector"""
+
+    def __init__(self, model: str = "models/embedding-001", google_api_key=None, **kwargs):
+        self.model = model
+        self.requests = 0
+        self.texts = 0
+
+    def _vector(self, text: str) -> list[float]:
+        vector = np.random.default_rng(_seed(text)).standard_normal(EMBEDDING_DIM).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: list[str], task_type=None, **kwargs) -> list[list[float]]:
+        # One request per call, as the real client sends a batch per call
+        time.sleep(EMBED_LATENCY)
+        self.requests += 1
+        self.texts += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str, task_type=None, **kwargs) -> list[float]:
+        return self.embed_documents([text], task_type=task_type)[0]
+
+class FakeGeminiChat:
+    """Chat client returning canned text derived from the prompt after a fixed delay"""
+
+    def __init__(self, model: str = "gemini-1.5-flash", google_api_key=None, temperature: float = 0, **kwargs):
+        self.model = model
+        self.temperature = temperature
+        self.requests = 0
+
+    def _reply(self, prompt) -> str:
+        prompt = str(prompt)
+        words = prompt.split() or ["answer"]
+        rng = np.random.default_rng(_seed(prompt))
+        if "different ways" in prompt:
+            # Query expansion: one reformulation per line
+            return "\n".join(
+                f"{i}. " + " ".join(rng.choice(words, 8)) for i in range(1, 6)
+            )
+        return " ".join(rng.choice(words, ANSWER_TOKENS))
+
+    def invoke(self, prompt, **kwargs) -> AIMessage:
+        self.requests += 1
+        reply = self._reply(prompt)
+        time.sleep(LLM_LATENCY + TOKEN_LATENCY * len(reply.split()))
+        return AIMessage(content=reply)
+
+    async def ainvoke(self, prompt, **kwargs) -> AIMessage:
+        self.requests += 1
+        reply = self._reply(prompt)
+        await asyncio.sleep(LLM_LATENCY + TOKEN_LATENCY * len(reply.split()))
+        return AIMessage(content=reply)
+
+    def stream(self, prompt, **kwargs):
+        self.requests += 1
+        time.sleep(LLM_LATENCY)
+        for token in self._reply(prompt).split():
+            time.sleep(TOKEN_LATENCY)
+            yield AIMessageChunk(content=token + " ")
+
+    async def astream(self, prompt, **kwargs):
+        self.requests += 1
+        await asyncio.sleep(LLM_LATENCY)
+        for token in self._reply(prompt).split():
+            await asyncio.sleep(TOKEN_LATENCY)
+            yield AIMessageChunk(content=token + " ")
+
+def install(embed_latency: float = EMBED_LATENCY, llm_latency: float = LLM_LATENCY,
+            token_latency: float = TOKEN_LATENCY, dim: int = EMBEDDING_DIM):
+    """Replace the Gemini classes in langchain_google_genai with the fakes (latencies in seconds)"""
+    global EMBED_LATENCY, LLM_LATENCY, TOKEN_LATENCY, EMBEDDING_DIM
+    if "scripts.embeddings" in sys.modules:
+        raise RuntimeError("install() must run before importing scripts.embeddings")
+    EMBED_LATENCY, LLM_LATENCY, TOKEN_LATENCY, EMBEDDING_DIM = embed_latency, llm_latency, token_latency, dim
+    langchain_google_genai.GoogleGenerativeAIEmbeddings = FakeGeminiEmbeddings
+    langchain_google_genai.ChatGoogleGenerativeAI = FakeGeminiChat
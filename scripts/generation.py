@@ -1,22 +1,36 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from .retrieval import retrieve_multiple_queries, get_retriever
-from .config import gemini_api_key
-from .query_expansion import expand_query
+from .retrieval import retrieve_multiple_queries, get_retriever, aretrieve_hits, fuse_hits
+from .query_expansion import expand_query, aexpand_query
+from .llm import get_llm, record_usage, throttle, athrottle
+from .context import pack_context
+from .metrics import timed, RETRIEVED_DOCUMENTS
 from typing import List, Dict, Optional, Tuple
 from langchain_core.documents import Document
+import asyncio
 import time
 
-# Set up the LLM
-llm = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash",
-    google_api_key=gemini_api_key,
-    temperature=0
-)
+NO_DOCUMENTS_ANSWER = "I couldn't find any relevant documents to answer your question. Please make sure documents are indexed."
+
+def is_error_answer(answer: str) -> bool:
+    """Whether an answer is a pipeline error message rather than a real answer"""
+    return answer.startswith("Error during")
 
 def format_context(docs):
-    """Format context from chunks into a prompt"""
-    context_text = "\n\n".join([doc.page_content for doc in docs])
-    return context_text
+    """Format context from chunks into a prompt: overlapping chunks merged, source-labelled, token-budgeted"""
+    return pack_context(docs)
+
+def build_prompt(query: str, docs) -> str:
+    """Create the grounded answer prompt from the retrieved documents"""
+    context = format_context(docs)
+    return f"""Use the following context to answer the question.
+
+Context:
+{context}
+
+Question:
+{query}
+
+Answer (detailed and grounded in the context):
+"""
 
 def generate_answer(
     query: str, 
@@ -24,7 +38,9 @@ def generate_answer(
     expand: bool = True, 
     return_expanded: bool = False,
     k: int = 5,
-    progress_callback=None
+    progress_callback=None,
+    retrieval_mode: str = "dense",
+    search_params: Optional[Dict] = None
 ) -> str | Tuple[str, List[str]]:
     """
     Generate an answer using RAG pipeline
@@ -36,6 +52,8 @@ def generate_answer(
         return_expanded: Whether to return expanded queries
         k: Number of documents to retrieve
         progress_callback: Optional callback for progress updates
+        retrieval_mode: "dense", "lexical" or "hybrid"
+        search_params: Optional ANN settings for this query ("nprobe", "ef_search")
     
     Returns:
         Either just the answer (str) or tuple of (answer, expanded_queries)
@@ -72,16 +90,19 @@ def generate_answer(
         if expanded_queries:
             # Use original query + expanded queries
             all_queries = [query] + expanded_queries
-            docs = retrieve_multiple_queries(all_queries, retriever)
+            docs = retrieve_multiple_queries(all_queries, retriever, mode=retrieval_mode, search_params=search_params)
+        elif retrieval_mode != "dense" or search_params:
+            docs = retrieve_multiple_queries([query], retriever, mode=retrieval_mode, search_params=search_params)
         else:
             # Use only original query - use invoke instead of get_relevant_documents
             docs = retriever.invoke(query)
         
         update_progress("retrieval", 60, f"Retrieved {len(docs)} documents")
+        RETRIEVED_DOCUMENTS.inc(len(docs), mode=retrieval_mode)
         
         if not docs:
             update_progress("retrieval", 70, "No relevant documents found")
-            answer = "I couldn't find any relevant documents to answer your question. Please make sure documents are indexed."
+            answer = NO_DOCUMENTS_ANSWER
             return (answer, expanded_queries) if return_expanded else answer
             
     except Exception as e:
@@ -93,24 +114,15 @@ def generate_answer(
     update_progress("generation", 70, "Generating answer...")
     
     try:
-        # Format context from retrieved documents
-        context = format_context(docs)
-        
-        # Create prompt
-        prompt = f"""Use the following context to answer the question.
-
-Context:
-{context}
-
-Question:
-{query}
-
-Answer (detailed and grounded in the context):
-"""
+        # Format context from retrieved documents and create prompt
+        prompt = build_prompt(query, docs)
         
         # Generate answer
-        response = llm.invoke(prompt)
+        throttle()
+        with timed("generation"):
+            response = get_llm().invoke(prompt)
         answer = response.content.strip()
+        record_usage("generation", prompt, answer, getattr(response, "usage_metadata", None))
         
         update_progress("generation", 90, "Answer generated successfully")
         
@@ -124,4 +136,140 @@ Answer (detailed and grounded in the context):
     if return_expanded:
         return answer, expanded_queries
     else:
-        return answer
\ No newline at end of file
+        return answer
+
+def describe_sources(docs) -> List[Dict]:
+    """Compact, JSON-serializable description of retrieved documents"""
+    return [
+        {
+            "filename": doc.metadata.get("filename"),
+            "page": doc.metadata.get("page"),
+            "doc_id": doc.metadata.get("doc_id"),
+            "preview": doc.page_content[:200]
+        }
+        for doc in docs
+    ]
+
+async def astream_answer(
+    query: str,
+    retriever=None,
+    expand: bool = True,
+    k: int = 5,
+    retrieval_mode: str = "dense",
+    search_params: Optional[Dict] = None
+):
+    """
+    Run the RAG pipeline, yielding events as it progresses.
+    
+    Event dicts have an "event" key:
+        stage: {"stage", "progress", "message", "details"} - same as progress_callback
+        expanded_queries: {"expanded_queries"}
+        sources: {"sources"} - see describe_sources
+        token: {"text"} - a piece of the answer as Gemini generates it
+        done: {"answer", "expanded_queries"} - always the last event
+    
+    Retrieval for the original query starts at the same time as query
+    expansion; results for the expanded queries are merged in afterwards.
+    retrieval_mode selects dense, lexical (BM25) or hybrid scoring; search_params
+    tune ANN indexes per query.
+    """
+    
+    def stage(stage, progress, message, details=None):
+        return {"event": "stage", "stage": stage, "progress": progress, "message": message, "details": details}
+    
+    if retriever is None:
+        yield stage("initialization", 10, "Loading retriever...")
+        retriever = await asyncio.to_thread(get_retriever, k=k)
+    else:
+        retriever.search_kwargs = {"k": k}
+    
+    # Start retrieval for the original query while the query is being expanded
+    yield stage("retrieval", 15, "Retrieving relevant documents...")
+    original_task = asyncio.create_task(aretrieve_hits([query], retriever, mode=retrieval_mode, search_params=search_params))
+    
+    expanded_queries = []
+    if expand:
+        yield stage("expansion", 20, "Expanding query...")
+        try:
+            expanded_queries = await aexpand_query(query)
+            yield stage("expansion", 30, f"Generated {len(expanded_queries)} query variations", 
+                        {"expanded_queries": expanded_queries})
+            yield {"event": "expanded_queries", "expanded_queries": expanded_queries}
+        except Exception as e:
+            print(f"Warning: Query expansion failed: {e}")
+            expanded_queries = []
+    
+    try:
+        # All expanded queries share one embedding call and one FAISS search;
+        # results are fused and diversified down to the top-k
+        expanded_hits = await aretrieve_hits(expanded_queries, retriever, mode=retrieval_mode, search_params=search_params)
+        # Fusion reconstructs vectors and runs MMR, so it stays off the event loop
+        docs = await asyncio.to_thread(fuse_hits, retriever, [*await original_task, *expanded_hits], k)
+    except Exception as e:
+        if not original_task.done():
+            original_task.cancel()
+        yield stage("retrieval", 60, f"Retrieval error: {str(e)}")
+        yield {"event": "done", "answer": f"Error during document retrieval: {str(e)}", "expanded_queries": expanded_queries}
+        return
+    
+    yield stage("retrieval", 60, f"Retrieved {len(docs)} documents")
+    yield {"event": "sources", "sources": describe_sources(docs)}
+    RETRIEVED_DOCUMENTS.inc(len(docs), mode=retrieval_mode)
+    
+    if not docs:
+        yield stage("retrieval", 70, "No relevant documents found")
+        yield {"event": "done", "answer": NO_DOCUMENTS_ANSWER, "expanded_queries": expanded_queries}
+        return
+    
+    yield stage("generation", 70, "Generating answer...")
+    
+    parts = []
+    prompt = build_prompt(query, docs)
+    try:
+        await athrottle()
+        with timed("generation"):
+            async for chunk in get_llm().astream(prompt):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {"event": "token", "text": chunk.content}
+        answer = "".join(parts).strip()
+        # Streamed chunks carry no usage totals, so tokens are estimated
+        record_usage("generation", prompt, answer)
+        yield stage("generation", 90, "Answer generated successfully")
+    except Exception as e:
+        yield stage("generation", 70, f"Generation error: {str(e)}")
+        answer = f"Error during answer generation: {str(e)}"
+    
+    yield stage("completion", 100, "Query processing completed")
+    yield {"event": "done", "answer": answer, "expanded_queries": expanded_queries}
+
+async def agenerate_answer(
+    query: str, 
+    retriever=None, 
+    expand: bool = True, 
+    return_expanded: bool = False,
+    k: int = 5,
+    progress_callback=None,
+    retrieval_mode: str = "dense",
+    search_params: Optional[Dict] = None
+) -> str | Tuple[str, List[str]]:
+    """
+    Async variant of generate_answer that never blocks the event loop.
+    
+    Consumes astream_answer; arguments and return value are the same as
+    generate_answer.
+    """
+    answer = ""
+    expanded_queries = []
+    async for event in astream_answer(query, retriever=retriever, expand=expand, k=k,
+                                      retrieval_mode=retrieval_mode, search_params=search_params):
+        if event["event"] == "stage" and progress_callback:
+            progress_callback(event["stage"], event["progress"], event["message"], event["details"])
+        elif event["event"] == "done":
+            answer = event["answer"]
+            expanded_queries = event["expanded_queries"]
+    
+    if return_expanded:
+        return answer, expanded_queries
+    else:
+        return answer
@@ -1,45 +1,423 @@
 import os
-from langchain_community.document_loaders import PyMuPDFLoader
+import hashlib
+from contextlib import ExitStack
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from .config import FAISS_INDEX_PATH
+from .config import FAISS_INDEX_PATH, PDF_PARSE_WORKERS, PDF_PAGES_PER_TASK, FAISS_INDEX_TYPE, ANN_MIN_VECTORS
+from .embeddings import get_embeddings, embed_in_batches
+from .manifest import load_manifest, save_manifest
+from .pdf_parsing import parse_pdfs, default_workers
+from . import vectorstore_cache
+from .answer_cache import answer_cache
+from .lexical import BM25Index, build_from_vectorstore, load_or_build
+from .ann import apply_index_type, to_flat
+from .docstore import load_vectorstore, save_vectorstore
+from .metrics import timed
+from .blobs import blob_store
+from .shards import shard_store, shard_key, is_sharded, SHARDED_LAYOUT
 
-def load_files(file_paths: list[str]) -> list:
-    docs = []
+def load_files(file_paths: list[str], max_workers: int = None) -> list:
+    """
+    Parse PDFs across a process pool; output order and metadata match a sequential load.
+    Parsed pages are kept per content hash, so a file seen before is not parsed again.
+    """
+    pdf_paths = []
     for file_path in file_paths:
         filename = os.path.basename(file_path)
         print(f"Loading: {filename}")  # Fixed: moved filename definition before usage
-        if not filename.lower().endswith(".pdf"):
+        if filename.lower().endswith(".pdf"):
+            pdf_paths.append(file_path)
+
+    hashes = {file_path: file_sha256(file_path) for file_path in pdf_paths if os.path.exists(file_path)}
+    parsed = {}
+    for file_path, content_hash in hashes.items():
+        pages = blob_store.load_pages(content_hash)
+        if pages is not None:
+            for _, metadata in pages:
+                metadata["source"] = metadata["file_path"] = file_path
+            parsed[file_path] = pages
+    to_parse = [file_path for file_path in pdf_paths if file_path not in parsed]
+    if parsed:
+        print(f"Reusing parsed pages for {len(parsed)} of {len(pdf_paths)} files")
+
+    if max_workers is None:
+        max_workers = PDF_PARSE_WORKERS or default_workers()
+    pages_per_file, errors = parse_pdfs(to_parse, max_workers, PDF_PAGES_PER_TASK)
+    for file_path, pages in zip(to_parse, pages_per_file):
+        if file_path not in errors:
+            try:
+                blob_store.save_pages(hashes[file_path], pages)
+            except OSError as e:
+                print(f"Could not save parsed pages for {os.path.basename(file_path)}: {e}")
+            parsed[file_path] = pages
+
+    docs = []
+    for file_path in pdf_paths:
+        filename = os.path.basename(file_path)
+        if file_path in errors:
+            print(f"Error loading {filename}: {errors[file_path]}")
             continue
-        try:
-            loader = PyMuPDFLoader(file_path)
-            loaded_docs = loader.load()
-            for doc in loaded_docs:
-                doc.metadata.update({
-                    "filename": filename
-                })
-            docs.extend(loaded_docs)
-        except Exception as e:
-            print(f"Error loading {filename}: {e}")
+        for text, metadata in parsed[file_path]:
+            metadata["filename"] = filename
+            docs.append(Document(page_content=text, metadata=metadata))
     return docs
 
 def chunk_documents(docs, chunk_size=800, chunk_overlap=150):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    # start_index lets the context packer stitch overlapping chunks back together
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
     return splitter.split_documents(docs)
 
-def embed_documents(chunks, save_path=FAISS_INDEX_PATH):
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+def add_chunks_in_batches(db, chunks, ids=None, progress_callback=None):
+    """Embed chunks through the batched pipeline, adding each batch to db as it finishes.
+
+    Creates the FAISS store from the first finished batch when db is None; returns the store.
+    """
+    embeddings = get_embeddings()
+    texts = [chunk.page_content for chunk in chunks]
+    for start, vectors in embed_in_batches(texts, embeddings, progress_callback=progress_callback):
+        end = start + len(vectors)
+        text_embeddings = list(zip(texts[start:end], vectors))
+        metadatas = [chunk.metadata for chunk in chunks[start:end]]
+        batch_ids = ids[start:end] if ids else None
+        if db is None:
+            db = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=batch_ids)
+        else:
+            db.add_embeddings(text_embeddings, metadatas=metadatas, ids=batch_ids)
+    return db
 
+def embed_documents(chunks, save_path=FAISS_INDEX_PATH, progress_callback=None, index_type=FAISS_INDEX_TYPE):
     try:
-        db = FAISS.from_documents(chunks, embedding=embeddings)
+        with timed("document_embedding"):
+            db = add_chunks_in_batches(None, chunks, progress_callback=progress_callback)
     except Exception as e:
         print("Embedding or FAISS error:", e)
         raise
 
-    db.save_local(save_path)
+    # A full build replaces whatever the directory held, documents included
+    manifest = load_manifest(save_path)
+    manifest["version"] += 1
+    manifest["documents"] = {}
+    with timed("index_save"):
+        db.lexical_index = build_from_vectorstore(db)
+        manifest["index"] = apply_index_type(db, index_type, save_path)
+        save_vectorstore(db, save_path)
+        db.lexical_index.save(save_path)
+        save_manifest(save_path, manifest)
+    vectorstore_cache.put(save_path, db)
+    answer_cache.invalidate(save_path)
     print(f"FAISS index saved to: {save_path}")
 
+def file_sha256(file_path) -> str:
+    """Content hash of a file, used to detect changed documents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _load_existing_index(index_path, embeddings):
+    if not os.path.exists(os.path.join(index_path, "index.faiss")):
+        return None
+    with timed("index_load"):
+        db = load_vectorstore(index_path, embeddings)
+        db.lexical_index = load_or_build(db, index_path)
+    return db
+
+def save_shard(key: str, chunks: list, vectors: list, embeddings, index_type: str):
+    """Write one document's chunks and vectors as a shard; chunk ids are positions ("0", "1", ...)"""
+    path = shard_store.path(key)
+    ids = [str(i) for i in range(len(chunks))]
+    texts = [chunk.page_content for chunk in chunks]
+    db = FAISS.from_embeddings(list(zip(texts, vectors)), embeddings,
+                               metadatas=[chunk.metadata for chunk in chunks], ids=ids)
+    db.lexical_index = BM25Index()
+    db.lexical_index.add(ids, texts)
+    content_hash, chunk_size, chunk_overlap = key.rsplit("-", 2)
+    manifest = {
+        "version": 1,
+        "content_hash": content_hash,
+        "chunk_size": int(chunk_size),
+        "chunk_overlap": int(chunk_overlap),
+        "chunks": len(chunks),
+        "index": apply_index_type(db, index_type, path),
+    }
+    save_vectorstore(db, path)
+    db.lexical_index.save(path)
+    # Written last: a shard counts as built once its manifest exists
+    save_manifest(path, manifest)
+    vectorstore_cache.put(path, db)
+
+def build_shards(sources: dict, chunk_size: int, chunk_overlap: int, index_type: str, update_progress) -> int:
+    """
+    Parse, chunk and embed documents into new shards; sources maps shard key -> file path.
+    The caller holds the shards' locks. Returns the number of chunks embedded.
+    """
+    key_for_path = {path: key for key, path in sources.items()}
+    update_progress("loading", 5, f"Loading {len(sources)} documents...")
+    with timed("document_loading"):
+        docs = load_files(list(sources.values()))
+    if not docs:
+        raise ValueError("No documents loaded from provided file paths.")
+
+    update_progress("chunking", 20, f"Chunking {len(docs)} pages...")
+    with timed("chunking"):
+        chunks = chunk_documents(docs, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if not chunks:
+        raise ValueError("Chunking resulted in zero chunks.")
+
+    def embedding_progress(stage, progress, message, details=None):
+        # Embedding spans 25-90% of the overall job
+        update_progress(stage, 25 + progress * 0.65, message, details)
+
+    # All new shards go through one batched embedding pass
+    embeddings = get_embeddings()
+    texts = [chunk.page_content for chunk in chunks]
+    vectors = [None] * len(texts)
+    try:
+        with timed("document_embedding"):
+            for start, batch in embed_in_batches(texts, embeddings, progress_callback=embedding_progress):
+                vectors[start:start + len(batch)] = batch
+    except Exception as e:
+        print("Embedding error:", e)
+        raise
+
+    update_progress("saving", 92, f"Saving {len(sources)} shards...")
+    per_shard = {}
+    for chunk, vector in zip(chunks, vectors):
+        chunk_list, vector_list = per_shard.setdefault(key_for_path[chunk.metadata["source"]], ([], []))
+        chunk_list.append(chunk)
+        vector_list.append(vector)
+    with timed("index_save"):
+        for key, (shard_chunks, shard_vectors) in per_shard.items():
+            save_shard(key, shard_chunks, shard_vectors, embeddings, index_type)
+    return len(chunks)
+
+def retype_shard(key: str, index_type: str, index_path) -> bool:
+    """
+    Rebuild a shard's FAISS index as index_type, if the index at index_path is the
+    only one referencing it. A shared shard keeps its type, so one session's request
+    never changes another session's index. Returns whether the shard has index_type.
+    """
+    path = shard_store.path(key)
+    with shard_store.lock(key):
+        manifest = load_manifest(path)
+        if manifest.get("index", {}).get("requested") == index_type:
+            return True
+        if shard_store.holders(key) != {os.path.abspath(index_path)}:
+            return False
+        db = _load_existing_index(path, get_embeddings())
+        to_flat(db, path)
+        manifest["index"] = apply_index_type(db, index_type, path)
+        manifest["version"] += 1
+        save_vectorstore(db, path)
+        save_manifest(path, manifest)
+    vectorstore_cache.put(path, db)
+    return True
+
+LEGACY_INDEX_FILES = ("index.faiss", "index.pkl", "docstore.sqlite", "docstore.sqlite-wal", "docstore.sqlite-shm",
+                      "bm25.json", "vectors.npy")
+
+def _remove_legacy_files(index_path):
+    for name in LEGACY_INDEX_FILES:
+        try:
+            os.remove(os.path.join(index_path, name))
+        except FileNotFoundError:
+            pass
+
+def update_index(
+    documents: dict,
+    save_path=FAISS_INDEX_PATH,
+    chunk_size=800,
+    chunk_overlap=150,
+    rebuild=False,
+    progress_callback=None,
+    index_type=None,
+    filenames=None
+):
+    """
+    Bring the session index at save_path in line with the given documents.
+
+    The index is a manifest of shared per-document shards (see shards.py). A document
+    whose content was already chunked and embedded with these settings, by this or
+    any other session, is attached without parsing or embedding anything; only new
+    content is embedded, into new shards.
+
+    Args:
+        documents: Mapping of doc_id -> file path to (re)index
+        save_path: Index directory holding the manifest
+        chunk_size: Chunk size used by the splitter
+        chunk_overlap: Chunk overlap used by the splitter
+        rebuild: Drop every document not in documents from the index
+        progress_callback: Optional callback(stage, progress, message, details)
+        index_type: flat, ivf_flat, ivf_pq or hnsw for the documents' shards; None keeps
+            the index's current type. Applies to new shards and to shards only this
+            index references; shards under ANN_MIN_VECTORS stay flat
+        filenames: Optional doc_id -> name shown in citations (defaults to the file name)
+
+    Returns:
+        Summary dict with the doc ids that were embedded, attached from existing shards
+        ("shared"), skipped (unchanged), removed and failed (no text could be extracted),
+        and the index type each given document's shard actually has ("index_types")
+    """
+    def update_progress(stage, progress, message, details=None):
+        if progress_callback:
+            progress_callback(stage, progress, message, details)
+
+    manifest = load_manifest(save_path)
+    filenames = filenames or {}
+    requested = index_type or manifest.get("index", {}).get("requested") or FAISS_INDEX_TYPE
+    # Indexes from before shards hold their own FAISS files; their documents are moved into shards
+    legacy = bool(manifest["documents"]) and not is_sharded(manifest)
+    if legacy and not rebuild:
+        kept = {doc_id: entry["path"] for doc_id, entry in manifest["documents"].items() if os.path.exists(entry["path"])}
+        documents = {**kept, **documents}
+    current = {} if legacy else manifest["documents"]
+    removed = [doc_id for doc_id in manifest["documents"] if doc_id not in documents] if rebuild or legacy else []
+    entries = {doc_id: entry for doc_id, entry in current.items() if doc_id not in removed}
+
+    attach = {}
+    skipped = []
+    for doc_id, path in documents.items():
+        content_hash = file_sha256(path)
+        key = shard_key(content_hash, chunk_size, chunk_overlap)
+        entry = entries.get(doc_id)
+        if entry and entry["shard"] == key:
+            skipped.append(doc_id)
+            continue
+        attach[doc_id] = {
+            "path": path,
+            "filename": filenames.get(doc_id) or os.path.basename(path),
+            "content_hash": content_hash,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "shard": key,
+        }
+
+    # References come first, so garbage collection never removes a shard being attached
+    new_refs = {doc_id: entry["shard"] for doc_id, entry in attach.items()}
+    shard_store.add_refs(save_path, new_refs)
+    try:
+        missing = {}
+        for entry in attach.values():
+            with shard_store.lock(entry["shard"]):
+                if not shard_store.exists(entry["shard"]):
+                    missing.setdefault(entry["shard"], entry["path"])
+        if missing:
+            with ExitStack() as locks:
+                for key in sorted(missing):
+                    locks.enter_context(shard_store.lock(key))
+                # Another session may have built some of them while we waited
+                missing = {key: path for key, path in missing.items() if not shard_store.exists(key)}
+                if missing:
+                    chunks = build_shards(missing, chunk_size, chunk_overlap, requested, update_progress)
+                    print(f"Embedded {chunks} chunks into {len(missing)} new shards")
+        if index_type:
+            shared_keys = [
+                key for key in sorted({entry["shard"] for entry in attach.values()}
+                                      | {entries[doc_id]["shard"] for doc_id in skipped})
+                if shard_store.exists(key) and not retype_shard(key, index_type, save_path)
+            ]
+            if shared_keys:
+                print(f"Keeping the index type of {len(shared_keys)} shards shared with other sessions")
+
+        failed = [doc_id for doc_id, entry in attach.items() if not shard_store.exists(entry["shard"])]
+        shard_store.release(save_path, {doc_id: new_refs[doc_id] for doc_id in failed})
+        for doc_id in failed:
+            print(f"No text extracted from {attach.pop(doc_id)['filename']}; not indexed")
+        embedded = [doc_id for doc_id, entry in attach.items() if entry["shard"] in missing]
+        shared = [doc_id for doc_id in attach if doc_id not in embedded]
+        if shared:
+            print(f"Attached {len(shared)} documents from existing shards")
+
+        saved = False
+        if attach or removed or legacy or requested != manifest.get("index", {}).get("requested"):
+            update_progress("saving", 95, "Saving index...")
+            released = {doc_id: current[doc_id]["shard"] for doc_id in [*removed, *attach] if doc_id in current}
+            entries.update(attach)
+            for entry in entries.values():
+                shard_manifest = load_manifest(shard_store.path(entry["shard"]))
+                entry["chunks"] = shard_manifest.get("chunks", 0)
+                entry["shard_bytes"] = shard_store.size(entry["shard"])
+                # The type the shard actually has: shared shards keep theirs whatever this index requested
+                entry["index_type"] = shard_manifest.get("index", {}).get("type", "flat")
+            manifest = {
+                "version": manifest["version"] + 1,
+                "layout": SHARDED_LAYOUT,
+                "index": {"requested": requested},
+                "documents": entries,
+            }
+            save_manifest(save_path, manifest)
+            saved = True
+    except BaseException:
+        # Until the manifest names them, the new references would keep their shards forever
+        shard_store.release(save_path, new_refs)
+        raise
+
+    if saved:
+        shard_store.release(save_path, released)
+        if legacy:
+            _remove_legacy_files(save_path)
+        # Composing the shards again is cheap, so the store is rebuilt on next use
+        vectorstore_cache.invalidate(save_path)
+        answer_cache.invalidate(save_path)
+        print(f"Index saved to: {save_path} (version {manifest['version']}, {len(entries)} documents)")
+
+    # ANN types apply per document shard, so say which documents actually got one
+    index_types = {doc_id: entries[doc_id].get("index_type", "flat") for doc_id in documents if doc_id in entries}
+    if index_type and index_type != "flat" and index_type not in index_types.values():
+        print(f"No document has the {index_type} index type: shards under ANN_MIN_VECTORS ({ANN_MIN_VECTORS}) "
+              f"vectors and shards shared with other sessions are searched as they are")
+
+    update_progress("completion", 100, "Indexing completed")
+    return {
+        "embedded": embedded,
+        "shared": shared,
+        "skipped": skipped,
+        "removed": removed,
+        "failed": failed,
+        "index_types": index_types,
+    }
+
+def remove_from_index(doc_ids: list[str], save_path=FAISS_INDEX_PATH) -> int:
+    """Delete the vectors of the given documents from the index. Returns chunks removed."""
+    manifest = load_manifest(save_path)
+    entries = {doc_id: manifest["documents"].pop(doc_id) for doc_id in doc_ids if doc_id in manifest["documents"]}
+    if not entries:
+        return 0
+
+    if is_sharded(manifest):
+        # The shards stay for other sessions until garbage collection finds them unused
+        manifest["version"] += 1
+        save_manifest(save_path, manifest)
+        shard_store.release(save_path, {doc_id: entry["shard"] for doc_id, entry in entries.items()})
+        vectorstore_cache.invalidate(save_path)
+        answer_cache.invalidate(save_path)
+        chunks = sum(entry.get("chunks", 0) for entry in entries.values())
+        print(f"Removed {len(entries)} documents ({chunks} chunks) from {save_path}")
+        return chunks
+
+    chunk_ids = [chunk_id for entry in entries.values() for chunk_id in entry["chunk_ids"]]
+    embeddings = get_embeddings()
+    db = _load_existing_index(save_path, embeddings)
+    if db is not None and chunk_ids:
+        to_flat(db, save_path)
+        db.delete(chunk_ids)
+        db.lexical_index.remove(chunk_ids)
+        manifest["index"] = apply_index_type(db, manifest.get("index", {}).get("requested", "flat"), save_path)
+        save_vectorstore(db, save_path)
+        db.lexical_index.save(save_path)
+
+    manifest["version"] += 1
+    save_manifest(save_path, manifest)
+    if db is not None:
+        vectorstore_cache.put(save_path, db)
+    else:
+        vectorstore_cache.invalidate(save_path)
+    answer_cache.invalidate(save_path)
+    print(f"Removed {len(chunk_ids)} chunks for {len(entries)} documents from {save_path}")
+    return len(chunk_ids)
+
 def index_documents(file_paths, chunk_size=800, chunk_overlap=150):
     print("Loading documents...")
     docs = load_files(file_paths)
@@ -57,4 +435,4 @@ def index_documents(file_paths, chunk_size=800, chunk_overlap=150):
 
     print("Embedding and indexing...")
     embed_documents(chunks)
-    print("Indexing complete.")
\ No newline at end of file
+    print("Indexing complete.")
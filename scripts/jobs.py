@@ -0,0 +1,210 @@
+"""Background indexing jobs: bounded worker pool, per-session serialization, cancellation"""
+import time
+import datetime
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from uuid import uuid4
+from .config import INDEX_JOB_WORKERS, INDEX_JOB_HISTORY
+
+TERMINAL_STATES = ("completed", "failed", "cancelled")
+
+# How often a running job publishes progress to the shared store and checks it for cancellation
+STORE_SYNC_INTERVAL = 1.0
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation has been requested"""
+
+class IndexJob:
+    def __init__(self, session_id: str, document_ids: list[str], run: Callable):
+        self.id = str(uuid4())
+        self.session_id = session_id
+        self.document_ids = document_ids
+        self.status = "queued"
+        self.stage = "queued"
+        self.progress = 0.0
+        self.message = "Waiting for a worker..."
+        self.chunks_embedded = 0
+        self.total_chunks = 0
+        self.chunks_per_sec = 0.0
+        self.error = None
+        self.result = None
+        self.created_at = datetime.datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self._run = run
+        self._cancel_event = threading.Event()
+        self._store = None
+        self._owner = None
+        self._last_sync = 0.0
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def sync(self, force: bool = False):
+        """Publish this job's state to the session store and pick up cancellations made by other workers"""
+        if self._store is None or (not force and time.monotonic() - self._last_sync < STORE_SYNC_INTERVAL):
+            return
+        self._last_sync = time.monotonic()
+        try:
+            self._store.save_job(self.to_dict(), self._owner)
+            if self.status not in TERMINAL_STATES and self._store.cancel_requested(self.id):
+                self._cancel_event.set()
+        except Exception as e:
+            print(f"Could not sync job {self.id} to the session store: {e}")
+
+    def progress_callback(self, stage, progress, message, details=None):
+        """
+        progress_callback for the indexing pipeline; also the cancellation point.
+        The pipeline reports the completion stage after its result is saved, so a
+        cancellation arriving then is ignored and the job completes.
+        """
+        self.sync()
+        if self.cancel_requested and stage != "completion":
+            raise JobCancelled(f"Job {self.id} cancelled")
+        self.stage = stage
+        self.progress = round(progress, 1)
+        self.message = message
+        if details:
+            self.chunks_embedded = details.get("chunks_embedded", self.chunks_embedded)
+            self.total_chunks = details.get("total_chunks", self.total_chunks)
+            self.chunks_per_sec = round(details.get("chunks_per_sec", self.chunks_per_sec), 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "document_ids": self.document_ids,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "message": self.message,
+            "chunks_embedded": self.chunks_embedded,
+            "total_chunks": self.total_chunks,
+            "chunks_per_sec": self.chunks_per_sec,
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class IndexJobManager:
+    """
+    Runs indexing jobs on a bounded thread pool.
+
+    Jobs for the same session run one at a time, in submission order, so two
+    jobs never write the same index_dir concurrently. A queued job waits in
+    its session's queue without holding a worker.
+
+    With a session store, job state is mirrored there so other worker processes
+    can report on and cancel jobs this process runs.
+    """
+
+    def __init__(self, max_workers: int = INDEX_JOB_WORKERS, history: int = INDEX_JOB_HISTORY,
+                 store=None, owner: Optional[str] = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="index-job")
+        self._lock = threading.Lock()
+        self._jobs = {}  # job_id -> IndexJob, in submission order
+        self._session_queues = {}  # session_id -> deque of queued jobs
+        self._active_sessions = set()
+        self._history = history
+        self._store = store
+        self._owner = owner
+
+    def submit(self, session_id: str, document_ids: list[str], run: Callable, on_finish: Optional[Callable] = None) -> IndexJob:
+        """
+        Queue run(job) for a session. run receives the job and should pass
+        job.progress_callback to the pipeline; its return value becomes job.result.
+        on_finish(job) is called once the job reaches a terminal state.
+        """
+        job = IndexJob(session_id, document_ids, run)
+        job._on_finish = on_finish
+        job._store = self._store
+        job._owner = self._owner
+        job.sync(force=True)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+            if session_id in self._active_sessions:
+                self._session_queues.setdefault(session_id, deque()).append(job)
+            else:
+                self._active_sessions.add(session_id)
+                self._executor.submit(self._execute, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IndexJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, session_id: str) -> list[IndexJob]:
+        return [job for job in list(self._jobs.values()) if job.session_id == session_id]
+
+    def cancel(self, job_id: str) -> Optional[IndexJob]:
+        """Cancel a queued job immediately, or ask a running job to stop at its next progress update"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in TERMINAL_STATES:
+                return job
+            job._cancel_event.set()
+            queue = self._session_queues.get(job.session_id)
+            if queue and job in queue:
+                queue.remove(job)
+                queued = True
+            else:
+                queued = False
+        if queued:
+            self._finish(job, "cancelled", error="Cancelled before start")
+        return job
+
+    def _execute(self, job: IndexJob):
+        try:
+            if job.cancel_requested:
+                raise JobCancelled(f"Job {job.id} cancelled")
+            job.status = "running"
+            job.started_at = datetime.datetime.now().isoformat()
+            job.message = "Starting..."
+            job.sync(force=True)
+            result = job._run(job)
+            job.result = result
+            self._finish(job, "completed")
+        except JobCancelled:
+            self._finish(job, "cancelled", error="Cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(job, "failed", error=str(e))
+        finally:
+            self._start_next(job.session_id)
+
+    def _finish(self, job: IndexJob, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.datetime.now().isoformat()
+        if status == "completed":
+            job.stage = "completion"
+            job.progress = 100.0
+            job.message = "Indexing completed successfully"
+        else:
+            job.message = error or status
+        job.sync(force=True)
+        if job._on_finish:
+            try:
+                job._on_finish(job)
+            except Exception as e:
+                print(f"Error in job callback for {job.id}: {e}")
+
+    def _start_next(self, session_id: str):
+        with self._lock:
+            queue = self._session_queues.get(session_id)
+            if queue:
+                self._executor.submit(self._execute, queue.popleft())
+            else:
+                self._session_queues.pop(session_id, None)
+                self._active_sessions.discard(session_id)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in TERMINAL_STATES]
+        for job_id in finished[:max(0, len(finished) - self._history)]:
+            del self._jobs[job_id]
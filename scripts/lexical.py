@@ -0,0 +1,141 @@
+"""BM25 inverted index built alongside the FAISS index, for lexical and hybrid retrieval"""
+import os
+import re
+import json
+import math
+from collections import Counter
+from .docstore import fetch_documents
+
+BM25_NAME = "bm25.json"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "which with what who how why when where do does did not".split()
+)
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word/number tokens (decimals like 0.05 kept whole), minus stopwords"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """Okapi BM25 over chunks, keyed by the same docstore ids as the FAISS index"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {docstore_id: term frequency}
+        self.doc_lengths = {}  # docstore_id -> token count
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, ids: list[str], texts: list[str]):
+        for docstore_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths[docstore_id] = sum(counts.values())
+            self.total_length += self.doc_lengths[docstore_id]
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[docstore_id] = tf
+
+    def remove(self, ids: list[str]):
+        ids = {docstore_id for docstore_id in ids if docstore_id in self.doc_lengths}
+        if not ids:
+            return
+        for docstore_id in ids:
+            self.total_length -= self.doc_lengths.pop(docstore_id)
+        for term in list(self.postings):
+            posting = self.postings[term]
+            for docstore_id in ids.intersection(posting):
+                del posting[docstore_id]
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """Top-k (docstore_id, score) for a query, best first"""
+        if not self.doc_lengths:
+            return []
+        n = len(self.doc_lengths)
+        avg_length = self.total_length / n
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for docstore_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docstore_id] / avg_length)
+                scores[docstore_id] = scores.get(docstore_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:k]
+
+    def estimate_bytes(self) -> int:
+        return sum(len(posting) for posting in self.postings.values()) * 100 + len(self.doc_lengths) * 100
+
+    def save(self, index_path):
+        path = os.path.join(index_path, BM25_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "doc_lengths": self.doc_lengths, "postings": self.postings}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, index_path):
+        """Load the BM25 index saved in index_path, or None if there is none"""
+        path = os.path.join(index_path, BM25_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = data["postings"]
+        index.total_length = sum(index.doc_lengths.values())
+        return index
+
+def search_combined(indexes: dict, query: str, k: int) -> list[tuple]:
+    """
+    Top-k over several BM25 indexes as if they were one corpus: document frequencies
+    and the average length are taken across all of them. indexes maps a name to its
+    BM25Index; returns (name, docstore_id, score), best first.
+    """
+    indexes = {name: index for name, index in indexes.items() if len(index)}
+    if not indexes:
+        return []
+    first = next(iter(indexes.values()))
+    k1, b = first.k1, first.b
+    n = sum(len(index) for index in indexes.values())
+    avg_length = sum(index.total_length for index in indexes.values()) / n
+    scores = {}
+    for term in set(tokenize(query)):
+        postings = [(name, index, index.postings[term]) for name, index in indexes.items() if term in index.postings]
+        df = sum(len(posting) for _, _, posting in postings)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for name, index, posting in postings:
+            for docstore_id, tf in posting.items():
+                norm = k1 * (1 - b + b * index.doc_lengths[docstore_id] / avg_length)
+                key = (name, docstore_id)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(name, docstore_id, score) for (name, docstore_id), score in ranked[:k]]
+
+def build_from_vectorstore(vectorstore) -> BM25Index:
+    """Build a BM25 index over every chunk already in a FAISS store"""
+    index = BM25Index()
+    ids = list(vectorstore.index_to_docstore_id.values())
+    index.add(ids, [doc.page_content for doc in fetch_documents(vectorstore.docstore, ids)])
+    return index
+
+def load_or_build(vectorstore, index_path) -> BM25Index:
+    """Load the saved BM25 index, building one for indexes created before it existed"""
+    index = BM25Index.load(index_path)
+    if index is None or len(index) != vectorstore.index.ntotal:
+        index = build_from_vectorstore(vectorstore)
+        try:
+            index.save(index_path)
+        except OSError as e:
+            print(f"Warning: could not save BM25 index to {index_path}: {e}")
+    return index
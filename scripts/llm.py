@@ -0,0 +1,54 @@
+"""Shared Gemini chat clients, reused across expansion and generation calls"""
+import asyncio
+import threading
+from .config import gemini_api_key, load_google_credentials, LLM_REQUESTS_PER_MINUTE
+from .metrics import LLM_TOKENS
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+
+_clients = {}  # (model, temperature) -> client
+_clients_lock = threading.Lock()
+_rate_limiter = None
+
+def get_llm(model_name: str = DEFAULT_MODEL, temperature: float = 0):
+    """Return the pooled ChatGoogleGenerativeAI client for (model, temperature), creating it on first use"""
+    key = (model_name, temperature)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # The Gemini SDK takes over a second to import, so it is loaded with the first client
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            load_google_credentials()
+            client = ChatGoogleGenerativeAI(
+                model=model_name,
+                google_api_key=gemini_api_key,
+                temperature=temperature
+            )
+            _clients[key] = client
+        return client
+
+def record_usage(call: str, prompt: str, completion: str, usage: dict = None):
+    """Count prompt and completion tokens, from the response's usage metadata when it has any"""
+    from .embeddings import estimate_tokens
+    if usage:
+        prompt_tokens, completion_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    else:
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(completion)
+    LLM_TOKENS.inc(prompt_tokens, call=call, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, call=call, kind="completion")
+
+def throttle():
+    """Wait until one more chat request fits LLM_REQUESTS_PER_MINUTE (no-op when it is 0)"""
+    global _rate_limiter
+    if not LLM_REQUESTS_PER_MINUTE:
+        return
+    from .embeddings import RateLimiter
+    with _clients_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE)
+    _rate_limiter.acquire()
+
+async def athrottle():
+    """Async variant of throttle; waits off the event loop"""
+    if LLM_REQUESTS_PER_MINUTE:
+        await asyncio.to_thread(throttle)
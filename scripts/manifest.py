@@ -0,0 +1,69 @@
+"""Per-index manifest: which documents an index holds and its version"""
+import os
+import json
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development only
+    fcntl = None
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".index.lock"
+
+def load_manifest(index_path) -> dict:
+    """Load the per-index manifest (doc_id -> content hash, chunk params, chunk ids)"""
+    manifest_path = os.path.join(index_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"version": 0, "documents": {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_manifest(index_path, manifest: dict):
+    """Atomically write the manifest next to the FAISS files"""
+    os.makedirs(index_path, exist_ok=True)
+    manifest_path = os.path.join(index_path, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+_version_memo = {}  # manifest path -> ((mtime_ns, size), version)
+
+def index_version(index_path) -> int:
+    """
+    Version of the index at index_path, bumped on every re-index or delete.
+
+    Only re-parses the manifest when its mtime/size changed. Indexes written
+    without a manifest fall back to the FAISS file's mtime.
+    """
+    manifest_path = os.path.join(index_path, MANIFEST_NAME)
+    try:
+        stat = os.stat(manifest_path)
+    except FileNotFoundError:
+        faiss_path = os.path.join(index_path, "index.faiss")
+        return os.stat(faiss_path).st_mtime_ns if os.path.exists(faiss_path) else 0
+
+    fingerprint = (stat.st_mtime_ns, stat.st_size)
+    memo = _version_memo.get(manifest_path)
+    if memo and memo[0] == fingerprint:
+        return memo[1]
+    version = load_manifest(index_path)["version"]
+    _version_memo[manifest_path] = (fingerprint, version)
+    return version
+
+@contextmanager
+def index_write_lock(index_path):
+    """
+    Exclusive lock on an index directory across processes, so indexing jobs for the
+    same session started by different server workers never write it concurrently.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    with open(os.path.join(index_path, LOCK_NAME), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,175 @@
+"""
+In-process metrics (counters, gauges, histograms) rendered in the Prometheus text
+format, plus per-request stage timings. Each server worker keeps its own values.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable
+
+# Seconds, from sub-millisecond index searches to multi-second generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+_collectors = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A metric family with fixed label names; values are kept per label combination"""
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list:
+        """(sample name, labels, value) triples"""
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+def register_collector(collector: Callable):
+    """
+    Add values computed at scrape time. collector() returns (name, type, help, samples)
+    families, where samples are (labels dict, value) pairs.
+    """
+    _collectors.append(collector)
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+
+    def family(name, metric_type, description, samples):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+
+    for metric in _metrics:
+        family(metric.name, metric.type, metric.description, metric.samples())
+    for collector in _collectors:
+        try:
+            families = collector()
+        except Exception as e:
+            print(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+            continue
+        for name, metric_type, description, samples in families:
+            family(name, metric_type, description, [(name, labels, value) for labels, value in samples])
+    return "\n".join(lines) + "\n"
+
+STAGE_SECONDS = Histogram(
+    "thynk_stage_duration_seconds",
+    "Time spent in each pipeline stage (query expansion, embedding, search, generation, index load, indexing)",
+    ("stage",),
+)
+LLM_TOKENS = Counter(
+    "thynk_llm_tokens_total",
+    "Prompt and completion tokens sent to and received from the LLM (estimated when not reported)",
+    ("call", "kind"),
+)
+RETRIEVED_DOCUMENTS = Counter(
+    "thynk_retrieved_documents_total",
+    "Chunks retrieved into answer prompts",
+    ("mode",),
+)
+
+_timings = contextvars.ContextVar("thynk_stage_timings", default=None)
+_timings_lock = threading.Lock()
+
+@contextmanager
+def record_timings():
+    """
+    Collect milliseconds per stage for the work run inside the block, including
+    tasks and threads started from it (asyncio.to_thread copies the context).
+    Concurrent stages overlap, so the values can add up to more than the wall time.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        with _timings_lock:
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+@contextmanager
+def timed(stage: str):
+    """Time the block into the stage histogram and the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
@@ -0,0 +1,147 @@
+"""Parallel PDF parsing across a process pool.
+
+Kept free of heavy imports so pool workers start quickly: workers only need
+PyMuPDF and return plain (text, metadata) tuples.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+def parse_pdf_pages(file_path: str, start: int = 0, end: int = None) -> list[tuple[str, dict]]:
+    """Extract (text, metadata) for pages [start, end) with the same metadata as PyMuPDFLoader"""
+    import fitz
+
+    with fitz.open(file_path) as pdf:
+        end = len(pdf) if end is None else min(end, len(pdf))
+        doc_metadata = {k: v for k, v in pdf.metadata.items() if type(v) in [str, int]}
+        pages = []
+        for number in range(start, end):
+            page = pdf[number]
+            metadata = dict(
+                {
+                    "source": file_path,
+                    "file_path": file_path,
+                    "page": page.number,
+                    "total_pages": len(pdf),
+                },
+                **doc_metadata
+            )
+            pages.append((page.get_text(), metadata))
+        return pages
+
+def page_count(file_path: str) -> int:
+    import fitz
+
+    with fitz.open(file_path) as pdf:
+        return len(pdf)
+
+def plan_tasks(file_paths: list[str], pages_per_task: int) -> tuple[list[tuple], dict]:
+    """
+    Split files into (file_index, file_path, start, end) tasks.
+
+    Large PDFs are split into page ranges of pages_per_task. Files that cannot be
+    opened are returned in the errors dict instead of failing the batch.
+    """
+    tasks = []
+    errors = {}
+    for file_index, file_path in enumerate(file_paths):
+        try:
+            total = page_count(file_path)
+        except Exception as e:
+            errors[file_path] = e
+            continue
+        if total <= pages_per_task:
+            tasks.append((file_index, file_path, 0, total))
+        else:
+            for start in range(0, total, pages_per_task):
+                tasks.append((file_index, file_path, start, min(start + pages_per_task, total)))
+    return tasks, errors
+
+_pool = None
+_pool_generation = 0  # bumped whenever a broken pool is replaced
+_pool_lock = threading.Lock()
+
+def _get_pool(max_workers: int) -> tuple[ProcessPoolExecutor, int]:
+    """
+    The shared pool and its generation. It is sized once and never resized, since
+    concurrent batches submit to it; workers are started as tasks arrive.
+    """
+    # Spawned (not forked) workers: the server process runs threads, which fork does not copy safely
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool, _pool_generation
+
+def _reset_pool(generation: int):
+    """Replace a broken pool, unless another batch already did. Other batches' futures are left alone."""
+    global _pool, _pool_generation
+    with _pool_lock:
+        if generation != _pool_generation:
+            return
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+        _pool_generation += 1
+
+def _run_isolated(task):
+    # One throwaway process per task, so a file that crashes its worker fails alone
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(parse_pdf_pages, *task[1:]).result()
+
+def parse_pdfs(file_paths: list[str], max_workers: int, pages_per_task: int) -> tuple[list[list[tuple]], dict]:
+    """
+    Parse PDFs in parallel.
+
+    Returns (pages_per_file, errors): pages_per_file[i] holds the (text, metadata) pages of
+    file_paths[i] in page order (empty if that file failed); errors maps failed paths to exceptions.
+    """
+    tasks, errors = plan_tasks(file_paths, pages_per_task)
+    results = [None] * len(tasks)
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        for i, task in enumerate(tasks):
+            try:
+                results[i] = parse_pdf_pages(*task[1:])
+            except Exception as e:
+                errors[task[1]] = e
+    else:
+        pool, generation = _get_pool(max_workers)
+        futures = []
+        for task in tasks:
+            try:
+                futures.append(pool.submit(parse_pdf_pages, *task[1:]))
+            except (BrokenProcessPool, RuntimeError):
+                # Broken by another batch's crashing file, or shut down while replacing it
+                futures.append(None)
+        broken = []
+        for i, (task, future) in enumerate(zip(tasks, futures)):
+            if future is None:
+                broken.append(i)
+                continue
+            try:
+                results[i] = future.result()
+            except BrokenProcessPool:
+                broken.append(i)
+            except Exception as e:
+                errors[task[1]] = e
+        if broken:
+            # Only the crashing file fails; the rest of its worker's tasks are retried alone
+            _reset_pool(generation)
+            for i in broken:
+                try:
+                    results[i] = _run_isolated(tasks[i])
+                except Exception as e:
+                    errors[tasks[i][1]] = e
+
+    # Reassemble in input order; a file with any failed range is dropped entirely
+    pages_per_file = [[] for _ in file_paths]
+    for task, pages in zip(tasks, results):
+        if pages is not None and task[1] not in errors:
+            pages_per_file[task[0]].extend(pages)
+    return pages_per_file, errors
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
@@ -1,26 +1,159 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from .config import gemini_api_key
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from .config import EXPANSION_CACHE_PATH, EXPANSION_CACHE_TTL, EXPANSION_CACHE_MAX_ENTRIES
+from .llm import get_llm, record_usage, throttle, athrottle, DEFAULT_MODEL
+from .metrics import timed
 
 
-def expand_query(original_query: str, model_name: str = "gemini-1.5-flash", num_queries: int = 5) -> list[str]:
-    
-    llm = ChatGoogleGenerativeAI(
-        model=model_name, 
-        temperature=0,
-        google_api_key=gemini_api_key
-    )
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different phrasings share a cache entry"""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+class ExpansionCache:
+    """
+    TTL + size-bounded LRU cache of query expansions in SQLite, shared by every
+    server worker. Each put writes one row; async callers go through a thread.
+    """
+
+    def __init__(self, path=EXPANSION_CACHE_PATH, ttl: float = EXPANSION_CACHE_TTL, max_entries: int = EXPANSION_CACHE_MAX_ENTRIES):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS expansions ("
+            "key TEXT PRIMARY KEY, variations TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_expansions_last_access ON expansions(last_access)")
+        self._conn.commit()
+        self._import_json(os.path.splitext(self.path)[0] + ".json")
+        self._size = self._conn.execute("SELECT COUNT(*) FROM expansions").fetchone()[0]
+
+    def _import_json(self, json_path):
+        """Move entries from the JSON file earlier versions kept into the table"""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path) as f:
+                stored = json.load(f)
+            now = time.time()
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO expansions (key, variations, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    [(key, json.dumps(variations), expires_at, now)
+                     for key, (expires_at, variations) in stored.items() if expires_at > now]
+                )
+            os.remove(json_path)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Ignoring unreadable expansion cache {json_path}: {e}")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT variations, expires_at FROM expansions WHERE key = ?", (key,)).fetchone()
+            if row and row[1] > now:
+                self._conn.execute("UPDATE expansions SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return json.loads(row[0])
+            if row:
+                self._conn.execute("DELETE FROM expansions WHERE key = ?", (key,))
+                self._conn.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key: str, variations: list[str]):
+        now = time.time()
+        with self._lock:
+            try:
+                existed = self._conn.execute("SELECT 1 FROM expansions WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO expansions (key, variations, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(variations), now + self.ttl, now)
+                )
+                if not existed:
+                    self._size += 1
+                overflow = self._size - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM expansions WHERE key IN "
+                        "(SELECT key FROM expansions ORDER BY last_access ASC LIMIT ?)",
+                        (overflow,)
+                    )
+                    self._size -= overflow
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                print(f"Could not persist expansion cache: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+        }
 
-    prompt = (
+expansion_cache = ExpansionCache()
+
+def _cache_key(original_query: str, model_name: str, num_queries: int) -> str:
+    return f"{model_name}:{num_queries}:{normalize_query(original_query)}"
+
+def _expansion_prompt(original_query: str, num_queries: int) -> str:
+    return (
         f"return the following user question in {num_queries} different ways without hinting any answer. "
         f"Each reformulation should aim to capture the same core intent but use different wording or focus:\n\n"
         f"Original question: {original_query}"
     )
 
-    response = llm.invoke(prompt)
+def _parse_variations(content: str, num_queries: int) -> list[str]:
     # Split into lines and clean up
     variations = [
         line.strip("-• ").strip()
-        for line in response.content.strip().split("\n")
+        for line in content.strip().split("\n")
         if line.strip()
     ]
-    return variations[:num_queries]  # Ensure we return exactly num_queries items
\ No newline at end of file
+    return variations[:num_queries]  # Ensure we return exactly num_queries items
+
+def expand_query(original_query: str, model_name: str = DEFAULT_MODEL, num_queries: int = 5) -> list[str]:
+    key = _cache_key(original_query, model_name, num_queries)
+    cached = expansion_cache.get(key)
+    if cached is not None:
+        return cached
+
+    prompt = _expansion_prompt(original_query, num_queries)
+    throttle()
+    with timed("expansion"):
+        response = get_llm(model_name).invoke(prompt)
+    record_usage("expansion", prompt, response.content, getattr(response, "usage_metadata", None))
+    variations = _parse_variations(response.content, num_queries)
+    expansion_cache.put(key, variations)
+    return variations
+
+async def aexpand_query(original_query: str, model_name: str = DEFAULT_MODEL, num_queries: int = 5) -> list[str]:
+    """Async variant of expand_query; does not block the event loop"""
+    key = _cache_key(original_query, model_name, num_queries)
+    cached = await asyncio.to_thread(expansion_cache.get, key)
+    if cached is not None:
+        return cached
+
+    prompt = _expansion_prompt(original_query, num_queries)
+    await athrottle()
+    with timed("expansion"):
+        response = await get_llm(model_name).ainvoke(prompt)
+    record_usage("expansion", prompt, response.content, getattr(response, "usage_metadata", None))
+    variations = _parse_variations(response.content, num_queries)
+    await asyncio.to_thread(expansion_cache.put, key, variations)
+    return variations
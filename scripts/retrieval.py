@@ -1,36 +1,307 @@
 import os
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
 from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from .config import gemini_api_key, FAISS_INDEX_PATH
+from .config import FAISS_INDEX_PATH, RRF_K, MMR_LAMBDA, SHARD_SEARCH_WORKERS
+from .embeddings import get_embeddings
+from . import vectorstore_cache
+from .lexical import load_or_build, search_combined
+from .ann import search_parameters
+from .docstore import fetch_documents, load_vectorstore
+from .manifest import load_manifest
+from .shards import shard_store, is_sharded
+from .metrics import timed
+import asyncio
+import contextvars
 import concurrent.futures
+import faiss
+import numpy as np
 
 # === Setup ===
 from dotenv import load_dotenv
 load_dotenv()
 
-def retrieve_multiple_queries(queries, retriever, max_workers=4):
-    """Retrieve relevant documents for multiple queries in parallel."""
-    def retrieve(q):
-        return retriever.get_relevant_documents(q) 
+# dense: FAISS only; lexical: BM25 only (no embedding call); hybrid: both, fused with RRF
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
 
-    all_docs = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = executor.map(retrieve, queries)
+def _unpack_retriever(retriever, k=None):
+    """Accept either a VectorStoreRetriever or a FAISS store; return (vectorstore, k)"""
+    vectorstore = getattr(retriever, "vectorstore", retriever)
+    if k is None:
+        k = getattr(retriever, "search_kwargs", {}).get("k", 4)
+    return vectorstore, k
 
-    for doc_list in results:
-        all_docs.extend(doc_list)
+def embed_queries(vectorstore, queries):
+    """Embed all queries in one batched call when the embeddings support it"""
+    embeddings = vectorstore.embeddings
+    with timed("embedding"):
+        if hasattr(embeddings, "embed_queries"):
+            return embeddings.embed_queries(queries)
+        return [embeddings.embed_query(q) for q in queries]
 
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_docs = []
-    for doc in all_docs:
-        # Create a simple hash based on content and metadata
-        doc_hash = hash(doc.page_content + str(doc.metadata))
-        if doc_hash not in seen:
-            seen.add(doc_hash)
-            unique_docs.append(doc)
+def search_by_vectors(vectorstore, vectors, k, search_params=None):
+    """
+    Run one FAISS search over a matrix of query vectors.
 
-    return unique_docs
+    search_params may set "nprobe" (IVF) or "ef_search" (HNSW) for this search only.
+    Returns one list of (docstore_id, distance, index_position) per query, best first.
+    """
+    if isinstance(vectorstore, ShardedVectorStore):
+        return vectorstore.search_by_vectors(vectors, k, search_params)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(matrix)
+    params = search_parameters(vectorstore.index, **(search_params or {}))
+    with timed("search"):
+        distances, indices = vectorstore.index.search(matrix, k, params=params)
+    return [
+        [
+            (vectorstore.index_to_docstore_id[i], float(d), int(i))
+            for i, d in zip(row_indices, row_distances) if i != -1
+        ]
+        for row_indices, row_distances in zip(indices, distances)
+    ]
+
+def docstore_positions(vectorstore) -> dict:
+    """docstore_id -> FAISS position, memoized on the (immutable once cached) store"""
+    positions = getattr(vectorstore, "_docstore_positions", None)
+    if positions is None or len(positions) != len(vectorstore.index_to_docstore_id):
+        positions = {docstore_id: i for i, docstore_id in vectorstore.index_to_docstore_id.items()}
+        vectorstore._docstore_positions = positions
+    return positions
+
+def search_lexical(vectorstore, queries, k):
+    """BM25 search per query; returns per-query (docstore_id, score, position) lists"""
+    if isinstance(vectorstore, ShardedVectorStore):
+        return vectorstore.search_lexical(queries, k)
+    lexical_index = getattr(vectorstore, "lexical_index", None)
+    if lexical_index is None:
+        return [[] for _ in queries]
+    positions = docstore_positions(vectorstore)
+    with timed("lexical_search"):
+        return [
+            [(docstore_id, score, positions[docstore_id]) for docstore_id, score in lexical_index.search(q, k)]
+            for q in queries
+        ]
+
+def retrieve_hits(queries, retriever, k=None, mode: str = "dense", search_params=None):
+    """
+    Per-query ranked hits as (docstore_id, score, position) lists.
+
+    Dense search embeds all queries in one call and runs one matrix search; lexical
+    search needs no network call. Hybrid returns the dense lists followed by the
+    lexical lists, for fusion by fuse_hits. search_params tune ANN indexes (see
+    search_by_vectors).
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    vectorstore, k = _unpack_retriever(retriever, k)
+    if not queries:
+        return []
+    hit_lists = []
+    if mode in ("dense", "hybrid"):
+        hit_lists.extend(search_by_vectors(vectorstore, embed_queries(vectorstore, queries), k, search_params))
+    if mode in ("lexical", "hybrid"):
+        hit_lists.extend(search_lexical(vectorstore, queries, k))
+    return hit_lists
+
+async def aretrieve_hits(queries, retriever, k=None, mode: str = "dense", search_params=None):
+    """Async variant of retrieve_hits; embedding and search run off the event loop"""
+    return await asyncio.to_thread(retrieve_hits, queries, retriever, k, mode, search_params)
+
+def reciprocal_rank_fusion(hit_lists, rrf_k: int = RRF_K):
+    """
+    Fuse per-query rankings: score(doc) = sum over queries of 1 / (rrf_k + rank).
+
+    Returns (docstore_id, fused_score, index_position) sorted by fused score;
+    ties keep first-seen order.
+    """
+    scores = {}
+    positions = {}
+    for hits in hit_lists:
+        for rank, (docstore_id, _, position) in enumerate(hits, start=1):
+            scores[docstore_id] = scores.get(docstore_id, 0.0) + 1.0 / (rrf_k + rank)
+            positions[docstore_id] = position
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [(docstore_id, scores[docstore_id], positions[docstore_id]) for docstore_id in ranked]
+
+def mmr_select(vectors: np.ndarray, relevance: np.ndarray, k: int, lambda_mult: float = MMR_LAMBDA) -> list[int]:
+    """
+    Greedy maximal marginal relevance over candidate vectors.
+
+    Balances relevance (scaled to [0, 1]) against cosine similarity to the
+    already selected candidates. Returns the selected row indices in pick order.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms == 0, 1, norms)
+    similarity = unit @ unit.T
+    relevance = relevance / relevance.max()
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_similarity = similarity[first].copy()
+    available = np.ones(len(relevance), dtype=bool)
+    available[first] = False
+    while len(selected) < k and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return selected
+
+def fuse_hits(retriever, hit_lists, k=None, lambda_mult: float = MMR_LAMBDA):
+    """
+    Combine per-query hits with reciprocal rank fusion, then pick a diverse top-k
+    with MMR over the stored FAISS vectors. Returns the documents in final order.
+    """
+    vectorstore, k = _unpack_retriever(retriever, k)
+    sharded = isinstance(vectorstore, ShardedVectorStore)
+    with timed("fusion"):
+        fused = reciprocal_rank_fusion(hit_lists)
+        if sharded:
+            # Look each candidate's shard up once, not once per vector and chunk
+            shards = vectorstore.resolve({doc_id for _, _, (doc_id, _) in fused})
+            reconstruct = lambda position: vectorstore.reconstruct(position, shards)
+        else:
+            reconstruct = vectorstore.index.reconstruct
+        if len(fused) > k:
+            try:
+                vectors = np.vstack([reconstruct(position) for _, _, position in fused])
+                order = mmr_select(vectors, np.array([score for _, score, _ in fused]), k, lambda_mult)
+                fused = [fused[i] for i in order]
+            except RuntimeError as e:
+                # Index types that cannot reconstruct vectors fall back to plain RRF order
+                print(f"MMR unavailable ({e}); using fused ranking")
+                fused = fused[:k]
+        ids = [docstore_id for docstore_id, _, _ in fused]
+        return vectorstore.fetch(ids, shards) if sharded else fetch_documents(vectorstore.docstore, ids)
+
+def retrieve_multiple_queries(queries, retriever, k=None, mode: str = "dense", search_params=None):
+    """Retrieve documents for multiple queries with one embedding call and one FAISS search, fused to top-k."""
+    return fuse_hits(retriever, retrieve_hits(queries, retriever, k, mode, search_params), k)
+
+async def aretrieve_multiple_queries(queries, retriever, k=None, mode: str = "dense", search_params=None):
+    """Async variant of retrieve_multiple_queries."""
+    hit_lists = await aretrieve_hits(queries, retriever, k, mode, search_params)
+    return await asyncio.to_thread(fuse_hits, retriever, hit_lists, k)
+
+# Shard searches and loads run here in parallel (FAISS releases the GIL while searching)
+_shard_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard")
+
+class ShardedVectorStore(VectorStore):
+    """
+    A session index composed of shared per-document shards (see shards.py).
+
+    Shards are loaded on first search and kept in the vector store cache, so a shard
+    used by many sessions is held in memory once. A query fans out to the shards in
+    parallel and the per-shard results are merged into one ranking. select() narrows
+    the store to some documents without touching the shards. Chunk ids are
+    "<doc_id>:<shard chunk id>" and hit positions (doc_id, shard position).
+    """
+
+    def __init__(self, embeddings, index_path, documents: dict):
+        self._embeddings = embeddings
+        self.index_path = index_path
+        self.documents = documents  # doc_id -> manifest entry with its shard key and filename
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def shard(self, doc_id: str) -> FAISS:
+        return vectorstore_cache.get(shard_store.path(self.documents[doc_id]["shard"]), load_faiss_index)
+
+    def resolve(self, doc_ids) -> dict:
+        """doc_id -> shard for the given documents, for callers reading many vectors or chunks"""
+        return {doc_id: self.shard(doc_id) for doc_id in doc_ids if doc_id in self.documents}
+
+    def select(self, document_ids) -> "ShardedVectorStore":
+        """A view over only the given documents (ids not in the index are ignored)"""
+        documents = {doc_id: self.documents[doc_id] for doc_id in document_ids if doc_id in self.documents}
+        return ShardedVectorStore(self._embeddings, self.index_path, documents)
+
+    def _fan_out(self, fn) -> list:
+        """fn(doc_id, shard) for every shard, run in parallel; loads shards not cached yet"""
+        def run(doc_id):
+            return fn(doc_id, self.shard(doc_id))
+        doc_ids = list(self.documents)
+        if len(doc_ids) <= 1:
+            return [run(doc_id) for doc_id in doc_ids]
+        # Each task runs in a copy of the caller's context so stage timings reach its request
+        futures = [_shard_executor.submit(contextvars.copy_context().run, run, doc_id) for doc_id in doc_ids]
+        return [future.result() for future in futures]
+
+    def shards(self) -> dict:
+        """doc_id -> loaded shard"""
+        return dict(self._fan_out(lambda doc_id, shard: (doc_id, shard)))
+
+    def search_by_vectors(self, vectors, k, search_params=None):
+        """search_by_vectors on every shard in parallel, merged into a global top-k per query"""
+        def search(doc_id, shard):
+            descending = shard.index.metric_type == faiss.METRIC_INNER_PRODUCT
+            return doc_id, descending, search_by_vectors(shard, vectors, k, search_params)
+
+        merged = [[] for _ in vectors]
+        descending = False
+        for doc_id, descending, shard_hit_lists in self._fan_out(search):
+            for hits, shard_hits in zip(merged, shard_hit_lists):
+                hits.extend((f"{doc_id}:{docstore_id}", distance, (doc_id, position))
+                            for docstore_id, distance, position in shard_hits)
+        return [sorted(hits, key=lambda hit: hit[1], reverse=descending)[:k] for hits in merged]
+
+    def search_lexical(self, queries, k):
+        """BM25 over the shards, scored as one corpus"""
+        shards = self.shards()
+        indexes = {doc_id: shard.lexical_index for doc_id, shard in shards.items()
+                   if getattr(shard, "lexical_index", None) is not None}
+        with timed("lexical_search"):
+            return [
+                [(f"{doc_id}:{docstore_id}", score, (doc_id, docstore_positions(shards[doc_id])[docstore_id]))
+                 for doc_id, docstore_id, score in search_combined(indexes, q, k)]
+                for q in queries
+            ]
+
+    def reconstruct(self, position, shards: dict = None) -> np.ndarray:
+        """The stored vector at a hit position; shards is an optional resolve() mapping"""
+        doc_id, shard_position = position
+        shard = shards[doc_id] if shards and doc_id in shards else self.shard(doc_id)
+        return shard.index.reconstruct(shard_position)
+
+    def fetch(self, ids: list[str], shards: dict = None) -> list[Document]:
+        """Chunks for ids in order, labelled with this session's document id and filename"""
+        by_doc = {}
+        for docstore_id in ids:
+            doc_id, shard_id = docstore_id.rsplit(":", 1)
+            if doc_id in self.documents:
+                by_doc.setdefault(doc_id, []).append(shard_id)
+        shards = {**self.resolve(doc_id for doc_id in by_doc if doc_id not in (shards or {})), **(shards or {})}
+        found = {}
+        for doc_id, shard_ids in by_doc.items():
+            entry = self.documents[doc_id]
+            for shard_id, doc in zip(shard_ids, fetch_documents(shards[doc_id].docstore, shard_ids)):
+                metadata = {**doc.metadata, "doc_id": doc_id, "source": entry["path"], "file_path": entry["path"]}
+                metadata["filename"] = entry.get("filename") or metadata.get("filename")
+                found[f"{doc_id}:{shard_id}"] = Document(page_content=doc.page_content, metadata=metadata)
+        return [found[docstore_id] for docstore_id in ids if docstore_id in found]
+
+    def estimate_bytes(self) -> int:
+        # The shards are cached, and counted, separately
+        return len(self.documents) * 200
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list[Document]:
+        with timed("embedding"):
+            vector = self.embeddings.embed_query(query)
+        hits = self.search_by_vectors([vector], k)[0]
+        return self.fetch([docstore_id for docstore_id, _, _ in hits])
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("Sharded indexes are built with indexing.update_index")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("Sharded indexes are built with indexing.update_index")
 
 # Load FAISS index from disk
 def load_faiss_index(index_path=None):
@@ -42,19 +313,40 @@ def load_faiss_index(index_path=None):
         raise FileNotFoundError(f"Index path not found: {index_path}. Please run indexing first.")
     
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=gemini_api_key
-        )
-        return FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        with timed("index_load"):
+            vectorstore = load_vectorstore(index_path, get_embeddings())
+            vectorstore.lexical_index = load_or_build(vectorstore, index_path)
+        return vectorstore
     except Exception as e:
         raise RuntimeError(f"Failed to load FAISS index: {str(e)}")
 
+def load_index(index_path):
+    """Load a session index: a ShardedVectorStore over its shards, or a single FAISS index"""
+    manifest = load_manifest(index_path)
+    if is_sharded(manifest):
+        return ShardedVectorStore(get_embeddings(), index_path, manifest["documents"])
+    return load_faiss_index(index_path)
+
+def get_vectorstore(index_path=None):
+    """Get the FAISS index from the shared cache, loading it from disk on a miss"""
+    if index_path is None:
+        index_path = FAISS_INDEX_PATH
+    return vectorstore_cache.get(index_path, load_index)
+
 # Get retriever object from FAISS index
-def get_retriever(index_path=None, k=5):
-    """Get a retriever object from the FAISS index."""
+def get_retriever(index_path=None, k=5, document_ids=None):
+    """Get a retriever object from the FAISS index.
+
+    Retrievers are cheap views over the cached vector store, so a new one
+    can be built per call when k or the document filter changes. document_ids
+    limits retrieval to those documents of a sharded index.
+    """
     try:
-        vectorstore = load_faiss_index(index_path)
+        vectorstore = get_vectorstore(index_path)
+        if document_ids is not None:
+            if not isinstance(vectorstore, ShardedVectorStore):
+                raise ValueError("Document filters need an index built with shards; re-index to enable them")
+            vectorstore = vectorstore.select(document_ids)
         return vectorstore.as_retriever(search_kwargs={"k": k})
     except Exception as e:
         raise RuntimeError(f"Failed to create retriever: {str(e)}")
@@ -63,7 +355,7 @@ def get_retriever(index_path=None, k=5):
 def retrieve_chunks(query: str, k: int = 5, index_path=None):
     """Retrieve chunks using similarity search"""
     try:
-        index = load_faiss_index(index_path)
+        index = get_vectorstore(index_path)
         docs = index.similarity_search(query, k=k)
         return docs
     except Exception as e:
@@ -1,27 +1,53 @@
+import time
+_import_started = time.perf_counter()  # import time is reported by /startup
+
 from fastapi import FastAPI, File, UploadFile, Request, HTTPException, Cookie
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from uuid import uuid4
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from uuid import UUID, uuid4
 from pathlib import Path
-import shutil
 import os
+import aiofiles
 import traceback
 import datetime
+import json
+import asyncio
+import hashlib
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Literal, Optional
 
 # Load environment variables
 load_dotenv()
 
-# Import your modules
+# Import your modules. LangChain, FAISS and the Gemini SDK take seconds to import, so
+# the pipeline modules are imported on first use (or at startup with FAST_STARTUP=0)
 try:
-    from scripts.config import gemini_api_key, google_api_key
-    from scripts.generation import generate_answer
-    from scripts.retrieval import get_retriever
-    from scripts.indexing import index_documents
-    from scripts.query_expansion import expand_query
+    from scripts import startup
+    generation = startup.lazy_import("scripts.generation")
+    retrieval = startup.lazy_import("scripts.retrieval")
+    indexing = startup.lazy_import("scripts.indexing")
+    batch = startup.lazy_import("scripts.batch")
+    embeddings = startup.lazy_import("scripts.embeddings")
+    # What the query endpoints use; handlers await startup.aload(*QUERY_MODULES) first
+    QUERY_MODULES = (generation, retrieval, embeddings, batch)
+    from scripts.llm import get_llm
+    from scripts.query_expansion import expansion_cache
+    from scripts import vectorstore_cache
+    from scripts.jobs import IndexJobManager
+    from scripts.answer_cache import answer_cache
+    from scripts.manifest import index_write_lock, load_manifest
+    from scripts.session_store import create_session_store, process_owner
+    from scripts.eviction import EvictionManager
+    from scripts import metrics
+    from scripts.blobs import blob_store
+    from scripts.shards import shard_store, is_sharded
+    from scripts.config import EVICTION_INTERVAL_SECONDS, DATA_DIR, UPLOAD_DIR, FAST_STARTUP, PREWARM_SESSIONS
+    from scripts.config import UPLOAD_MAX_BYTES, UPLOAD_MAX_CONCURRENT, BATCH_MAX_QUERIES, BATCH_MAX_CONCURRENCY
+    if not FAST_STARTUP:
+        startup.load_all()
 except ImportError as e:
     print(f"Import error: {e}")
     raise
@@ -30,10 +56,9 @@ app = FastAPI(title="PsyRAG", description="Psychology RAG System")
 
 # Setup directories
 BASE_DIR = Path(__file__).parent
-UPLOAD_DIR = BASE_DIR / "uploads"
 FRONTEND_DIR = BASE_DIR.parent / "frontend"
 
-UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 # Enable CORS
 app.add_middleware(
@@ -47,45 +72,130 @@ app.add_middleware(
 # Mount static files
 app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
 
-# Multi-user storage - organized by session
-USER_SESSIONS = {}  # session_id -> user data
+# Sessions, documents and history live in a store shared by every worker process,
+# so the app can run with uvicorn --workers and sessions survive restarts
+SESSION_STORE = create_session_store()
+
+# Background indexing jobs, serialized per session; state is mirrored to the store
+INDEX_JOBS = IndexJobManager(store=SESSION_STORE, owner=process_owner())
+
+# Keeps loaded indexes and session files within the RAM and disk budgets
+EVICTION = EvictionManager(SESSION_STORE, UPLOAD_DIR, DATA_DIR, blobs=blob_store, shards=shard_store)
+
+# Uploads written at once by this worker; further uploads wait for a slot
+UPLOAD_SLOTS = asyncio.Semaphore(UPLOAD_MAX_CONCURRENT)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+QUERY_SECONDS = metrics.Histogram(
+    "thynk_query_duration_seconds", "End-to-end /query latency by answer cache result", ("cached",)
+)
+
+def collect_server_metrics() -> list:
+    """Cache counters and per-session disk usage, read when /metrics is scraped"""
+    caches = {
+        "vectorstores": vectorstore_cache.stats(),
+        "expansions": expansion_cache.stats(),
+        "answers": answer_cache.stats(),
+    }
+    if embeddings.loaded:
+        # Scraping shouldn't be what pulls in the embedding client
+        caches["embeddings"] = embeddings.get_embeddings().cache.stats()
+    hits = {name: stats.get("hits", stats.get("exact_hits", 0) + stats.get("semantic_hits", 0))
+            for name, stats in caches.items()}
+    usage = EVICTION.usage()
+    return [
+        ("thynk_cache_hits_total", "counter", "Cache hits",
+         [({"cache": name}, count) for name, count in hits.items()]),
+        ("thynk_cache_misses_total", "counter", "Cache misses",
+         [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("thynk_cache_entries", "gauge", "Entries held by each cache",
+         [({"cache": name}, stats["entries"]) for name, stats in caches.items()]),
+        ("thynk_session_index_bytes", "gauge", "Index size on disk per session",
+         [({"session_id": session["session_id"]}, session["index_bytes"]) for session in usage]),
+        ("thynk_session_upload_bytes", "gauge", "Uploaded files on disk per session",
+         [({"session_id": session["session_id"]}, session["upload_bytes"]) for session in usage]),
+    ]
+
+metrics.register_collector(collect_server_metrics)
 
 class UserSession:
+    """A session's index directory plus accessors over SESSION_STORE"""
+
     def __init__(self, session_id: str):
         self.session_id = session_id
-        self.documents = {}
-        self.query_history = []
-        self.current_retriever = None
+        # Uploads live in the shared blob store; upload_dir only holds files from before it
         self.upload_dir = UPLOAD_DIR / session_id
-        self.index_dir = BASE_DIR / "data" / session_id / "faiss_index"
+        self.index_dir = DATA_DIR / session_id / "faiss_index"
         
         # Create user-specific directories
-        self.upload_dir.mkdir(parents=True, exist_ok=True)
         self.index_dir.mkdir(parents=True, exist_ok=True)
+    
+    @property
+    def documents(self) -> dict:
+        # Blocking; handlers on the event loop call the store through run_in_threadpool
+        return SESSION_STORE.get_documents(self.session_id)
 
 def get_session_id(request: Request) -> str:
-    """Get or create session ID from cookie"""
+    """
+    Get or create session ID from cookie. Session IDs name directories under
+    DATA_DIR and UPLOAD_DIR, so only UUIDs in the form the server issues are accepted.
+    """
     session_id = request.cookies.get("session_id")
-    if not session_id:
-        session_id = str(uuid4())
-    return session_id
+    try:
+        if session_id and str(UUID(session_id)) == session_id:
+            return session_id
+    except ValueError:
+        pass
+    return str(uuid4())
 
-def get_user_session(session_id: str) -> UserSession:
-    """Get or create user session"""
-    if session_id not in USER_SESSIONS:
-        USER_SESSIONS[session_id] = UserSession(session_id)
-    return USER_SESSIONS[session_id]
+async def get_user_session(session_id: str) -> UserSession:
+    """Get or create user session. Store calls can wait on another worker's write, so they run off the event loop."""
+    def open_session():
+        SESSION_STORE.touch_session(session_id)
+        return UserSession(session_id)
+    return await run_in_threadpool(open_session)
 
 # Schemas
 class IndexRequest(BaseModel):
     document_ids: list[str]
     chunk_size: int = 800
     chunk_overlap: int = 150
+    incremental: bool = True
+    # flat (exact), ivf_flat, ivf_pq or hnsw; None keeps the index's current type. Applies per
+    # document shard, and only to documents with ANN_MIN_VECTORS chunks: smaller ones stay flat.
+    # The job result's "index_types" gives each document's actual type.
+    index_type: Optional[Literal["flat", "ivf_flat", "ivf_pq", "hnsw"]] = None
 
-class QueryRequest(BaseModel):
-    query: str
+class QueryOptions(BaseModel):
+    """Settings shared by single and batch queries"""
     expand_query: bool = True
     k: int = 5
+    use_cache: bool = True
+    # "lexical" answers keyword lookups from the BM25 index without an embedding call
+    retrieval_mode: Literal["dense", "lexical", "hybrid"] = "hybrid"
+    # Per-query ANN settings: IVF lists to probe / HNSW candidate list size (flat shards ignore them)
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef_search: Optional[int] = Field(None, ge=1)
+    # Answer from these indexed documents only; switching the set needs no re-indexing
+    document_ids: Optional[list[str]] = None
+
+    def search_params(self) -> Optional[dict]:
+        params = {"nprobe": self.nprobe, "ef_search": self.ef_search}
+        return {key: value for key, value in params.items() if value is not None} or None
+
+class QueryRequest(QueryOptions):
+    query: str
+    # Add per-stage milliseconds (expansion, embedding, search, generation, ...) to the response
+    include_timings: bool = False
+
+class BatchQueryRequest(QueryOptions):
+    queries: list[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUERIES)
+    # Answers generated at once for this batch, capped at BATCH_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = Field(None, ge=1)
+
+    def query_requests(self) -> list[QueryRequest]:
+        options = self.model_dump(exclude={"queries", "max_concurrency"})
+        return [QueryRequest(query=query, **options) for query in self.queries]
 
 @app.get("/", response_class=HTMLResponse)
 async def serve_ui(request: Request):
@@ -102,38 +212,87 @@ async def serve_ui(request: Request):
 async def get_documents(request: Request):
     """Returns the list of uploaded documents for the current session"""
     session_id = get_session_id(request)
-    user_session = get_user_session(session_id)
-    return {"documents": list(user_session.documents.values())}
+    user_session = await get_user_session(session_id)
+    documents = await run_in_threadpool(SESSION_STORE.get_documents, session_id)
+    return {"documents": list(documents.values())}
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Refuse oversized uploads from their Content-Length, before the body is read"""
+    if request.url.path == "/upload":
+        length = request.headers.get("content-length")
+        # Allow for the multipart framing around the file
+        if length and length.isdigit() and int(length) > UPLOAD_MAX_BYTES + 64 * 1024:
+            return JSONResponse({"detail": f"File exceeds the {UPLOAD_MAX_BYTES} byte upload limit"}, status_code=413)
+    return await call_next(request)
+
+async def receive_upload(file: UploadFile) -> tuple[str, int, Path]:
+    """Stream an upload to a temporary file, hashing it as it is written. Returns (sha256, size, path)"""
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = blob_store.temp_path()
+    try:
+        async with aiofiles.open(temp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File exceeds the {UPLOAD_MAX_BYTES} byte upload limit")
+                digest.update(chunk)
+                await buffer.write(chunk)
+    except BaseException:
+        await run_in_threadpool(lambda: temp_path.unlink(missing_ok=True))
+        raise
+    return digest.hexdigest(), size, temp_path
 
 @app.post("/upload")
 async def upload_document(request: Request, file: UploadFile = File(...)):
-    """Uploads a new document for the current session"""
+    """
+    Uploads a new document for the current session. Files are stored once by
+    content: re-uploading a file the session already has returns that document,
+    and a file another session uploaded reuses its stored copy and parsed pages.
+    """
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
     session_id = get_session_id(request)
-    user_session = get_user_session(session_id)
-    
-    file_id = str(uuid4())
-    file_path = user_session.upload_dir / f"{file_id}.pdf"
+    user_session = await get_user_session(session_id)
     
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        async with UPLOAD_SLOTS:
+            content_hash, size, temp_path = await receive_upload(file)
+        blob_path, created = await run_in_threadpool(blob_store.commit, temp_path, content_hash)
         
-        user_session.documents[file_id] = {
-            "id": file_id,
-            "filename": file.filename,
-            "path": str(file_path),
-            "uploaded_at": datetime.datetime.now().isoformat(),
-            "indexed": False,
-            "status": "uploaded"
-        }
-        
-        response = JSONResponse({"id": file_id, "filename": file.filename, "message": "File uploaded successfully"})
+        existing = await run_in_threadpool(SESSION_STORE.find_document, session_id, content_hash)
+        if existing:
+            response = JSONResponse({
+                "id": existing["id"],
+                "filename": existing["filename"],
+                "duplicate": True,
+                "message": f"Already uploaded as {existing['filename']}"
+            })
+        else:
+            file_id = str(uuid4())
+            await run_in_threadpool(SESSION_STORE.put_document, session_id, {
+                "id": file_id,
+                "filename": file.filename,
+                "path": str(blob_path),
+                "uploaded_at": datetime.datetime.now().isoformat(),
+                "indexed": False,
+                "status": "uploaded",
+                "content_hash": content_hash,
+                "size": size
+            })
+            response = JSONResponse({
+                "id": file_id,
+                "filename": file.filename,
+                "duplicate": False,
+                "message": "File uploaded successfully" if created else "File uploaded (stored copy reused)"
+            })
         response.set_cookie("session_id", session_id, max_age=86400*30)
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
@@ -141,177 +300,488 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
 async def delete_document(request: Request, doc_id: str):
     """Deletes a document for the current session"""
     session_id = get_session_id(request)
-    user_session = get_user_session(session_id)
+    user_session = await get_user_session(session_id)
     
-    doc = user_session.documents.get(doc_id)
+    doc = await run_in_threadpool(SESSION_STORE.get_document, session_id, doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
 
+    # Stored blobs may be shared, so they are left to the eviction sweep's garbage collection
     try:
-        if os.path.exists(doc["path"]):
-            os.remove(doc["path"])
+        if not doc.get("content_hash") and os.path.exists(doc["path"]):
+            await run_in_threadpool(os.remove, doc["path"])
     except Exception as e:
         print(f"Error deleting file: {e}")
+
+    await run_in_threadpool(SESSION_STORE.delete_document, session_id, doc_id)
     
-    del user_session.documents[doc_id]
-    # Reset retriever since documents changed
-    user_session.current_retriever = None
-    return {"status": "deleted", "message": "Document deleted successfully"}
+    # Drop the document's vectors instead of rebuilding the index. This goes through
+    # the session's job queue so it never races an indexing job on the same index_dir.
+    job = None
+    if doc.get("indexed") or doc.get("status") in ("queued", "running"):
+        def run(job):
+            job.progress_callback("removal", 50, "Removing document vectors...")
+            with index_write_lock(user_session.index_dir):
+                removed = indexing.remove_from_index([doc_id], save_path=user_session.index_dir)
+            return {"removed_chunks": removed}
+        job = await run_in_threadpool(INDEX_JOBS.submit, session_id, [doc_id], run)
+    
+    return {
+        "status": "deleted",
+        "message": "Document deleted successfully",
+        "job_id": job.id if job else None
+    }
 
 @app.post("/index")
 async def start_indexing(request: Request, req: IndexRequest):
     """Index selected documents for the current session"""
     session_id = get_session_id(request)
-    user_session = get_user_session(session_id)
+    user_session = await get_user_session(session_id)
     
     if not req.document_ids:
         raise HTTPException(status_code=400, detail="No documents selected")
     
     # Validate document IDs
-    missing_docs = [doc_id for doc_id in req.document_ids if doc_id not in user_session.documents]
+    documents = await run_in_threadpool(SESSION_STORE.get_documents, session_id)
+    missing_docs = [doc_id for doc_id in req.document_ids if doc_id not in documents]
     if missing_docs:
         raise HTTPException(status_code=404, detail=f"Documents not found: {missing_docs}")
     
-    selected_docs = [user_session.documents[doc_id]["path"] for doc_id in req.document_ids]
-    print(f"📂 Files to index for session {session_id}: {selected_docs}")
-    print(f"🔧 Chunk size: {req.chunk_size}, Overlap: {req.chunk_overlap}")
+    print(f"📂 Queueing indexing for session {session_id}: {req.document_ids}")
+    print(f"🔧 Chunk size: {req.chunk_size}, Overlap: {req.chunk_overlap}, Incremental: {req.incremental}")
     
-    try:
-        # Use session-specific index directory
-        from scripts.indexing import load_files, chunk_documents, embed_documents
-        
-        # Load and process documents
-        docs = load_files(selected_docs)
-        if not docs:
-            raise ValueError("No documents loaded from provided file paths.")
-        
-        chunks = chunk_documents(docs, chunk_size=req.chunk_size, chunk_overlap=req.chunk_overlap)
-        if not chunks:
-            raise ValueError("Chunking resulted in zero chunks.")
-        
-        # Save to session-specific index
-        embed_documents(chunks, save_path=user_session.index_dir)
-        
-        # Update document status
-        for doc_id in req.document_ids:
-            user_session.documents[doc_id]["indexed"] = True
-            user_session.documents[doc_id]["status"] = "indexed"
-        
-        # Reset retriever to pick up new index
-        user_session.current_retriever = None
+    previous_status = {doc_id: documents[doc_id]["status"] for doc_id in req.document_ids}
+    await run_in_threadpool(SESSION_STORE.update_documents, session_id, req.document_ids, status="queued")
+    
+    def run(job):
+        # Documents deleted while the job was queued are skipped
+        documents = user_session.documents
+        selected_docs = {
+            doc_id: documents[doc_id]["path"]
+            for doc_id in req.document_ids if doc_id in documents
+        }
+        if not selected_docs:
+            raise ValueError("No documents left to index.")
+        SESSION_STORE.update_documents(session_id, list(selected_docs), status="running")
         
-        return {"message": "Indexing completed successfully"}
+        # Only content no session has embedded yet is embedded; the rest is attached from
+        # shared shards. The lock serializes this with jobs for the same session on other workers.
+        with index_write_lock(user_session.index_dir):
+            summary = indexing.update_index(
+                selected_docs,
+                save_path=user_session.index_dir,
+                chunk_size=req.chunk_size,
+                chunk_overlap=req.chunk_overlap,
+                rebuild=not req.incremental,
+                progress_callback=job.progress_callback,
+                index_type=req.index_type,
+                filenames={doc_id: doc["filename"] for doc_id, doc in documents.items()}
+            )
         
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        print(f"Indexing error: {e}")
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Indexing failed: {str(e)}")
+        # A full rebuild drops every document that was not selected
+        SESSION_STORE.update_documents(session_id, summary["removed"], indexed=False, status="uploaded")
+        SESSION_STORE.update_documents(session_id, summary["failed"], indexed=False, status="failed")
+        indexed = [doc_id for doc_id in selected_docs if doc_id not in summary["failed"]]
+        SESSION_STORE.update_documents(session_id, indexed, indexed=True, status="indexed")
+        return summary
+    
+    def on_finish(job):
+        if job.status == "completed":
+            return
+        # The index on disk is unchanged, so restore the previous status
+        for doc_id, status in previous_status.items():
+            SESSION_STORE.update_documents(session_id, [doc_id], status="failed" if job.status == "failed" else status)
+    
+    job = await run_in_threadpool(INDEX_JOBS.submit, session_id, req.document_ids, run, on_finish=on_finish)
+    return JSONResponse(
+        {"job_id": job.id, "status": job.status, "message": "Indexing job queued"},
+        status_code=202
+    )
+
+async def get_session_job(request: Request, job_id: str) -> dict:
+    """
+    Look up an indexing job belonging to the current session. Jobs run by this
+    worker are read live; jobs run by other workers come from the session store.
+    """
+    session_id = get_session_id(request)
+    job = INDEX_JOBS.get(job_id)
+    job = job.to_dict() if job is not None else await run_in_threadpool(SESSION_STORE.get_job, job_id)
+    if job is None or job["session_id"] != session_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/index/jobs")
+async def list_index_jobs(request: Request):
+    """List indexing jobs for the current session"""
+    session_id = get_session_id(request)
+    jobs = {job["id"]: job for job in await run_in_threadpool(SESSION_STORE.list_jobs, session_id)}
+    jobs.update((job.id, job.to_dict()) for job in INDEX_JOBS.list_jobs(session_id))
+    return {"jobs": list(jobs.values())}
+
+@app.get("/index/jobs/{job_id}")
+async def get_index_job(request: Request, job_id: str):
+    """Stage, progress, throughput and errors of an indexing job"""
+    return await get_session_job(request, job_id)
+
+@app.delete("/index/jobs/{job_id}")
+async def cancel_index_job(request: Request, job_id: str):
+    """Cancel a queued or running indexing job"""
+    job = await get_session_job(request, job_id)
+    if INDEX_JOBS.get(job_id) is not None:
+        # Cancelling a queued job records it and restores document statuses in the store
+        return (await run_in_threadpool(INDEX_JOBS.cancel, job_id)).to_dict()
+    # Running on another worker, which picks the request up at its next progress update
+    await run_in_threadpool(SESSION_STORE.request_cancel, job_id)
+    return job
+
+async def record_query(user_session: UserSession, req: QueryRequest, answer: str, expanded_queries: list):
+    """Append a finished query to the session's history"""
+    history_entry = {
+        "query": req.query,
+        "answer": answer,
+        "expanded_queries": expanded_queries,
+        "expand_used": req.expand_query,
+        "k_value": req.k,
+        "document_ids": req.document_ids,
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+    await run_in_threadpool(SESSION_STORE.append_history, user_session.session_id, history_entry)
+
+async def check_document_filter(user_session: UserSession, req: QueryOptions):
+    """Reject document filters naming documents the session hasn't indexed, or on a pre-shard index"""
+    if req.document_ids is None:
+        return
+    if not req.document_ids:
+        raise HTTPException(status_code=400, detail="document_ids must name at least one document")
+    documents = await run_in_threadpool(SESSION_STORE.get_documents, user_session.session_id)
+    missing = [doc_id for doc_id in req.document_ids if doc_id not in documents]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Documents not found: {missing}")
+    unindexed = [doc_id for doc_id in req.document_ids if not documents[doc_id]["indexed"]]
+    if unindexed:
+        raise HTTPException(status_code=400, detail=f"Documents not indexed: {unindexed}")
+    # Indexes from before shards keep every document in one FAISS index, which cannot be filtered
+    manifest = await run_in_threadpool(load_manifest, user_session.index_dir)
+    if manifest["documents"] and not is_sharded(manifest):
+        raise HTTPException(status_code=400, detail="Document filters need an index built with shards; re-index to enable them")
+
+def wants_query_vector(req: QueryOptions) -> bool:
+    """Whether cache lookups for req need a query embedding (semantic matching)"""
+    return req.use_cache and answer_cache.semantic_enabled and req.retrieval_mode != "lexical"
+
+def find_cached_answer(user_session: UserSession, req: QueryRequest, query_vector=None, count_miss: bool = True):
+    return answer_cache.lookup(user_session.index_dir, req.query, req.k, req.expand_query, query_vector,
+                               mode=req.retrieval_mode, search_params=req.search_params(),
+                               document_ids=req.document_ids, count_miss=count_miss)
+
+async def lookup_cached_answer(user_session: UserSession, req: QueryRequest):
+    """Check the answer cache. Returns (entry or None, query vector for semantic matching)"""
+    if not req.use_cache:
+        return None, None
+    query_vector = None
+    if wants_query_vector(req):
+        # Goes through the embedding cache, so retrieval reuses this vector on a miss
+        query_vector = (await run_in_threadpool(lambda: embeddings.get_embeddings().embed_queries([req.query])))[0]
+    return find_cached_answer(user_session, req, query_vector), query_vector
+
+def store_answer(user_session: UserSession, req: QueryRequest, answer: str, expanded_queries: list, query_vector):
+    if req.use_cache and not generation.is_error_answer(answer):
+        answer_cache.store(user_session.index_dir, req.query, req.k, req.expand_query, answer, expanded_queries,
+                           query_vector, mode=req.retrieval_mode, search_params=req.search_params(),
+                           document_ids=req.document_ids)
 
 @app.post("/query")
 async def handle_query(request: Request, req: QueryRequest):
     """Process a query for the current session"""
     session_id = get_session_id(request)
-    user_session = get_user_session(session_id)
+    user_session = await get_user_session(session_id)
+    await startup.aload(*QUERY_MODULES)
     
     if not req.query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
+    await check_document_filter(user_session, req)
+    
+    started = time.perf_counter()
+    
+    def respond(answer: str, expanded_queries: list, cached, timings: dict) -> dict:
+        elapsed = time.perf_counter() - started
+        QUERY_SECONDS.observe(elapsed, cached=cached or "none")
+        response = {
+            "query": req.query,
+            "answer": answer,
+            "expanded_queries": expanded_queries,
+            "cached": cached
+        }
+        if req.include_timings:
+            response["timings"] = {**{stage: round(ms, 2) for stage, ms in timings.items()},
+                                   "total": round(elapsed * 1000, 2)}
+        return response
     
     try:
-        # Get retriever with user's specific index
-        if user_session.current_retriever is None:
-            from scripts.retrieval import get_retriever
-            user_session.current_retriever = get_retriever(
+        with metrics.record_timings() as timings:
+            cached, query_vector = await lookup_cached_answer(user_session, req)
+            if cached:
+                print(f"Answer cache {cached['cache']} hit for session {session_id}: {req.query}")
+                await record_query(user_session, req, cached["answer"], cached["expanded_queries"])
+                return respond(cached["answer"], cached["expanded_queries"], cached["cache"], timings)
+            
+            # Retrievers are cheap views over this worker's vector store cache, which
+            # reloads an index when its version changes (e.g. re-indexed by another worker)
+            retriever = await run_in_threadpool(
+                retrieval.get_retriever,
                 index_path=user_session.index_dir, 
-                k=req.k
+                k=req.k,
+                document_ids=req.document_ids
+            )
+            
+            print(f"Query for session {session_id}: {req.query}")
+            print(f"Parameters: expand={req.expand_query}, k={req.k}")
+            
+            # Generate answer with user parameters
+            answer, expanded_queries = await generation.agenerate_answer(
+                req.query,
+                retriever=retriever,
+                expand=req.expand_query,
+                return_expanded=True,
+                k=req.k,
+                retrieval_mode=req.retrieval_mode,
+                search_params=req.search_params()
             )
-        else:
-            # Update the existing retriever's k value
-            user_session.current_retriever.search_kwargs = {"k": req.k}
-        
-        print(f"Query for session {session_id}: {req.query}")
-        print(f"Parameters: expand={req.expand_query}, k={req.k}")
-        
-        # Generate answer with user parameters
-        answer, expanded_queries = generate_answer(
-            req.query,
-            retriever=user_session.current_retriever,
-            expand=req.expand_query,
-            return_expanded=True,
-            k=req.k
-        )
         
         # Save to user's history
-        history_entry = {
-            "query": req.query,
-            "answer": answer,
-            "expanded_queries": expanded_queries,
-            "expand_used": req.expand_query,
-            "k_value": req.k,
-            "timestamp": datetime.datetime.now().isoformat()
-        }
-        user_session.query_history.append(history_entry)
+        await record_query(user_session, req, answer, expanded_queries)
+        store_answer(user_session, req, answer, expanded_queries, query_vector)
         
-        return {
-            "query": req.query,
-            "answer": answer,
-            "expanded_queries": expanded_queries
-        }
+        return respond(answer, expanded_queries, None, timings)
         
     except Exception as e:
         print(f"Query error for session {session_id}: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Query processing failed: {str(e)}")
 
+@app.post("/query/stream")
+async def stream_query(request: Request, req: QueryRequest):
+    """Process a query, streaming stage events, sources and answer tokens as Server-Sent Events"""
+    session_id = get_session_id(request)
+    user_session = await get_user_session(session_id)
+    await startup.aload(*QUERY_MODULES)
+    
+    if not req.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    await check_document_filter(user_session, req)
+    
+    def sse(event):
+        return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    
+    try:
+        cached, query_vector = await lookup_cached_answer(user_session, req)
+        retriever = None
+        if not cached:
+            retriever = await run_in_threadpool(
+                retrieval.get_retriever,
+                index_path=user_session.index_dir, 
+                k=req.k,
+                document_ids=req.document_ids
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query processing failed: {str(e)}")
+    
+    print(f"Streaming query for session {session_id}: {req.query}")
+    
+    async def event_stream():
+        if cached:
+            await record_query(user_session, req, cached["answer"], cached["expanded_queries"])
+            yield sse({"event": "expanded_queries", "expanded_queries": cached["expanded_queries"]})
+            yield sse({"event": "token", "text": cached["answer"]})
+            yield sse({"event": "done", "answer": cached["answer"], "expanded_queries": cached["expanded_queries"], "cached": cached["cache"]})
+            return
+        try:
+            async for event in generation.astream_answer(req.query, retriever=retriever, expand=req.expand_query, k=req.k,
+                                              retrieval_mode=req.retrieval_mode, search_params=req.search_params()):
+                if event["event"] == "done":
+                    await record_query(user_session, req, event["answer"], event["expanded_queries"])
+                    store_answer(user_session, req, event["answer"], event["expanded_queries"], query_vector)
+                    event["cached"] = None
+                yield sse(event)
+        except Exception as e:
+            print(f"Streaming query error for session {session_id}: {e}")
+            traceback.print_exc()
+            yield f"event: error\ndata: {json.dumps({'event': 'error', 'message': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/batch")
+async def batch_query(request: Request, req: BatchQueryRequest):
+    """
+    Answer many questions in one request. Results stream back as JSON lines in
+    completion order: {"index", "query", "answer", "expanded_queries", "sources", "cached"}.
+    Cached answers come first; the rest share expansion, embedding and retrieval and
+    are generated max_concurrency at a time (see batch.py). Batch answers are cached
+    but not added to the query history.
+    """
+    session_id = get_session_id(request)
+    user_session = await get_user_session(session_id)
+    await startup.aload(*QUERY_MODULES)
+    
+    if any(not query.strip() for query in req.queries):
+        raise HTTPException(status_code=400, detail="Queries cannot be empty")
+    await check_document_filter(user_session, req)
+    
+    requests = req.query_requests()
+    try:
+        cached, query_vectors = {}, {}
+        if req.use_cache:
+            semantic = wants_query_vector(req)
+            # Exact hits first; the other questions are embedded in one call for semantic matching
+            for i, query_req in enumerate(requests):
+                entry = find_cached_answer(user_session, query_req, count_miss=not semantic)
+                if entry:
+                    cached[i] = entry
+            unmatched = [i for i in range(len(requests)) if i not in cached]
+            if semantic and unmatched:
+                vectors = await run_in_threadpool(
+                    lambda: embeddings.get_embeddings().embed_queries([requests[i].query for i in unmatched])
+                )
+                for i, vector in zip(unmatched, vectors):
+                    query_vectors[i] = vector
+                    entry = find_cached_answer(user_session, requests[i], vector)
+                    if entry:
+                        cached[i] = entry
+        pending = [i for i in range(len(requests)) if i not in cached]
+        retriever = None
+        if pending:
+            retriever = await run_in_threadpool(
+                retrieval.get_retriever,
+                index_path=user_session.index_dir,
+                k=req.k,
+                document_ids=req.document_ids
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query processing failed: {str(e)}")
+    
+    concurrency = min(req.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    print(f"Batch of {len(requests)} queries for session {session_id}: "
+          f"{len(cached)} cached, {len(pending)} to answer, concurrency {concurrency}")
+    
+    def line(i, result, cache):
+        return json.dumps({"index": i, "query": requests[i].query, **result, "cached": cache}) + "\n"
+    
+    async def results():
+        for i, entry in cached.items():
+            yield line(i, {"answer": entry["answer"], "expanded_queries": entry["expanded_queries"], "sources": None},
+                       entry["cache"])
+        if not pending:
+            return
+        async for position, result in batch.abatch_answer(
+            [requests[i].query for i in pending], retriever, expand=req.expand_query, k=req.k,
+            retrieval_mode=req.retrieval_mode, search_params=req.search_params(), max_concurrency=concurrency
+        ):
+            i = pending[position]
+            store_answer(user_session, requests[i], result["answer"], result["expanded_queries"], query_vectors.get(i))
+            yield line(i, result, None)
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.get("/query/history")
 async def get_query_history(request: Request):
     """Retrieve the list of past queries for the current session"""
     session_id = get_session_id(request)
-    user_session = get_user_session(session_id)
-    return {"history": user_session.query_history}
+    user_session = await get_user_session(session_id)
+    return {"history": await run_in_threadpool(SESSION_STORE.get_history, session_id)}
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters for the server-side caches"""
+    embedding_stats = None
+    if embeddings.loaded:
+        await startup.aload(embeddings)
+        embedding_stats = embeddings.get_embeddings().cache.stats()
+    return {
+        "embeddings": embedding_stats,
+        "vectorstores": vectorstore_cache.stats(),
+        "expansions": expansion_cache.stats(),
+        "answers": answer_cache.stats()
+    }
+
+@app.get("/usage")
+async def get_usage():
+    """Per-session disk usage, loaded index memory and eviction counters for this worker"""
+    return await run_in_threadpool(EVICTION.stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Stage latencies, token counts, cache and session metrics in Prometheus text format (this worker)"""
+    return PlainTextResponse(await run_in_threadpool(metrics.render), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "PsyRAG is running"}
 
-# Clean up old sessions periodically (optional)
+@app.get("/startup")
+async def get_startup():
+    """Import and startup phase timings, and which pipeline modules are loaded yet"""
+    return {"fast_startup": FAST_STARTUP, **startup.report()}
+
+def prewarm_sessions():
+    """Import the pipeline, create the Gemini clients and load the most recently active sessions' indexes"""
+    startup.load_all()
+    with startup.phase("create clients"):
+        embeddings.get_embeddings()
+        get_llm()
+    sessions = sorted(SESSION_STORE.list_sessions(), key=lambda session: session["last_active"], reverse=True)
+    warmed = 0
+    for session in sessions:
+        if warmed >= PREWARM_SESSIONS:
+            break
+        index_dir = DATA_DIR / session["id"] / "faiss_index"
+        if not load_manifest(index_dir)["documents"]:
+            continue
+        try:
+            with startup.phase(f"load index of session {session['id']}"):
+                vectorstore = retrieval.get_vectorstore(index_dir)
+                if isinstance(vectorstore, retrieval.ShardedVectorStore):
+                    vectorstore.shards()
+            warmed += 1
+        except Exception as e:
+            print(f"Could not prewarm session {session['id']}: {e}")
+
+# Evict idle indexes and old or over-budget sessions periodically
 @app.on_event("startup")
-async def cleanup_old_sessions():
-    """Clean up old session data on startup"""
-    import asyncio
+async def start_eviction():
+    """Recover interrupted jobs, warm recent sessions in the background, then sweep sessions every EVICTION_INTERVAL_SECONDS"""
+    with startup.phase("recover interrupted jobs"):
+        recovered = await run_in_threadpool(SESSION_STORE.recover_interrupted_jobs)
+    if recovered:
+        print(f"Marked {recovered} indexing jobs interrupted by a restart as failed")
     
-    async def periodic_cleanup():
+    async def prewarm():
+        try:
+            with startup.phase("prewarm"):
+                await run_in_threadpool(prewarm_sessions)
+        except Exception as e:
+            print(f"Error during prewarm: {e}")
+            traceback.print_exc()
+    
+    # Runs after startup completes, so /health and the UI are served meanwhile
+    asyncio.create_task(prewarm())
+    
+    async def periodic_eviction():
         while True:
-            # Wait 24 hours between cleanups
-            await asyncio.sleep(86400)
-            
-            # Remove sessions older than 7 days
-            cutoff = datetime.datetime.now() - datetime.timedelta(days=7)
-            sessions_to_remove = []
-            
-            for session_id, session in USER_SESSIONS.items():
-                # Check if session has any recent activity
-                if (session.query_history and 
-                    datetime.datetime.fromisoformat(session.query_history[-1]["timestamp"]) < cutoff):
-                    sessions_to_remove.append(session_id)
-            
-            for session_id in sessions_to_remove:
-                try:
-                    session = USER_SESSIONS[session_id]
-                    # Clean up files
-                    if session.upload_dir.exists():
-                        shutil.rmtree(session.upload_dir)
-                    if session.index_dir.exists():
-                        shutil.rmtree(session.index_dir)
-                    del USER_SESSIONS[session_id]
-                    print(f"Cleaned up old session: {session_id}")
-                except Exception as e:
-                    print(f"Error cleaning up session {session_id}: {e}")
-    
-    # Start cleanup task
-    asyncio.create_task(periodic_cleanup())
+            await asyncio.sleep(EVICTION_INTERVAL_SECONDS)
+            try:
+                await run_in_threadpool(EVICTION.sweep)
+            except Exception as e:
+                print(f"Error during session eviction: {e}")
+                traceback.print_exc()
+    
+    asyncio.create_task(periodic_eviction())
+
+startup.record_phase("import scripts.server", time.perf_counter() - _import_started)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,284 @@
+"""Sessions, documents, query history and indexing job state shared by all server workers"""
+import os
+import json
+import socket
+import sqlite3
+import datetime
+import importlib
+import threading
+from typing import Optional
+from .config import SESSION_STORE_BACKEND, SESSION_STORE_PATH
+
+DOCUMENT_FIELDS = ("id", "filename", "path", "uploaded_at", "indexed", "status", "content_hash", "size")
+ACTIVE_JOB_STATES = ("queued", "running")
+
+def process_owner() -> str:
+    """Identifies this worker process in job records"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class SessionStore:
+    """
+    Interface for session storage. Every worker process talks to the same store,
+    so any worker can serve any request. Subclass it for another backend and point
+    SESSION_STORE_BACKEND at "module:Class".
+    """
+
+    def touch_session(self, session_id: str):
+        """Create the session if needed and mark it active"""
+        raise NotImplementedError
+
+    def list_sessions(self) -> list[dict]:
+        raise NotImplementedError
+
+    def delete_session(self, session_id: str):
+        raise NotImplementedError
+
+    def get_documents(self, session_id: str) -> dict:
+        """doc_id -> document dict, in upload order"""
+        raise NotImplementedError
+
+    def get_document(self, session_id: str, doc_id: str) -> Optional[dict]:
+        return self.get_documents(session_id).get(doc_id)
+
+    def find_document(self, session_id: str, content_hash: str) -> Optional[dict]:
+        """The session's document with this content, if it was uploaded before"""
+        for doc in self.get_documents(session_id).values():
+            if doc.get("content_hash") == content_hash:
+                return doc
+        return None
+
+    def content_hashes(self) -> set:
+        """Content hashes referenced by any session's documents"""
+        raise NotImplementedError
+
+    def put_document(self, session_id: str, doc: dict):
+        raise NotImplementedError
+
+    def update_documents(self, session_id: str, doc_ids: list[str], **fields):
+        """Set fields on the given documents; ids that no longer exist are ignored"""
+        raise NotImplementedError
+
+    def delete_document(self, session_id: str, doc_id: str):
+        raise NotImplementedError
+
+    def append_history(self, session_id: str, entry: dict):
+        raise NotImplementedError
+
+    def get_history(self, session_id: str) -> list[dict]:
+        raise NotImplementedError
+
+    def save_job(self, job: dict, owner: str):
+        """Insert or update an indexing job (IndexJob.to_dict()) run by owner"""
+        raise NotImplementedError
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def list_jobs(self, session_id: str) -> list[dict]:
+        raise NotImplementedError
+
+    def request_cancel(self, job_id: str):
+        """Ask whichever worker runs the job to stop it"""
+        raise NotImplementedError
+
+    def cancel_requested(self, job_id: str) -> bool:
+        raise NotImplementedError
+
+    def recover_interrupted_jobs(self) -> int:
+        """Fail jobs whose worker process died; returns how many were recovered"""
+        raise NotImplementedError
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite store on local disk, safe to share between worker processes on one machine"""
+
+    def __init__(self, path=SESSION_STORE_PATH):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "  id TEXT PRIMARY KEY, created_at TEXT NOT NULL, last_active TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "  session_id TEXT NOT NULL, id TEXT NOT NULL, filename TEXT, path TEXT, uploaded_at TEXT,"
+            "  indexed INTEGER NOT NULL DEFAULT 0, status TEXT, content_hash TEXT, size INTEGER,"
+            "  PRIMARY KEY (session_id, id));"
+            "CREATE TABLE IF NOT EXISTS history ("
+            "  seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, entry TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_history_session ON history(session_id);"
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "  id TEXT PRIMARY KEY, session_id TEXT NOT NULL, status TEXT NOT NULL, owner TEXT NOT NULL,"
+            "  data TEXT NOT NULL, cancel_requested INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs(session_id);"
+        )
+        # Stores created before uploads were content-addressed lack these columns
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        for column, column_type in (("content_hash", "TEXT"), ("size", "INTEGER")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE documents ADD COLUMN {column} {column_type}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(content_hash)")
+        self._conn.commit()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def touch_session(self, session_id: str):
+        now = datetime.datetime.now()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO sessions (id, created_at, last_active) VALUES (?, ?, ?)",
+                (session_id, now.isoformat(), now.isoformat())
+            )
+            # Activity is tracked to the minute, so most requests don't write
+            self._conn.execute(
+                "UPDATE sessions SET last_active = ? WHERE id = ? AND last_active < ?",
+                (now.isoformat(), session_id, (now - datetime.timedelta(minutes=1)).isoformat())
+            )
+
+    def list_sessions(self) -> list[dict]:
+        rows = self._query("SELECT id, created_at, last_active FROM sessions")
+        return [{"id": r[0], "created_at": r[1], "last_active": r[2]} for r in rows]
+
+    def delete_session(self, session_id: str):
+        with self._lock, self._conn:
+            for table in ("documents", "history", "jobs"):
+                self._conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def get_documents(self, session_id: str) -> dict:
+        rows = self._query(
+            f"SELECT {', '.join(DOCUMENT_FIELDS)} FROM documents WHERE session_id = ? ORDER BY rowid",
+            (session_id,)
+        )
+        documents = {}
+        for row in rows:
+            doc = dict(zip(DOCUMENT_FIELDS, row))
+            doc["indexed"] = bool(doc["indexed"])
+            documents[doc["id"]] = doc
+        return documents
+
+    def get_document(self, session_id: str, doc_id: str) -> Optional[dict]:
+        rows = self._query(
+            f"SELECT {', '.join(DOCUMENT_FIELDS)} FROM documents WHERE session_id = ? AND id = ?",
+            (session_id, doc_id)
+        )
+        if not rows:
+            return None
+        doc = dict(zip(DOCUMENT_FIELDS, rows[0]))
+        doc["indexed"] = bool(doc["indexed"])
+        return doc
+
+    def find_document(self, session_id: str, content_hash: str) -> Optional[dict]:
+        rows = self._query(
+            f"SELECT {', '.join(DOCUMENT_FIELDS)} FROM documents WHERE session_id = ? AND content_hash = ? LIMIT 1",
+            (session_id, content_hash)
+        )
+        if not rows:
+            return None
+        doc = dict(zip(DOCUMENT_FIELDS, rows[0]))
+        doc["indexed"] = bool(doc["indexed"])
+        return doc
+
+    def content_hashes(self) -> set:
+        rows = self._query("SELECT DISTINCT content_hash FROM documents WHERE content_hash IS NOT NULL")
+        return {content_hash for (content_hash,) in rows}
+
+    def put_document(self, session_id: str, doc: dict):
+        placeholders = ", ".join("?" * (len(DOCUMENT_FIELDS) + 1))
+        self._execute(
+            f"INSERT OR REPLACE INTO documents (session_id, {', '.join(DOCUMENT_FIELDS)}) VALUES ({placeholders})",
+            (session_id, *(doc.get(field) for field in DOCUMENT_FIELDS))
+        )
+
+    def update_documents(self, session_id: str, doc_ids: list[str], **fields):
+        unknown = set(fields) - set(DOCUMENT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown document fields: {sorted(unknown)}")
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"UPDATE documents SET {assignments} WHERE session_id = ? AND id = ?",
+                [(*fields.values(), session_id, doc_id) for doc_id in doc_ids]
+            )
+
+    def delete_document(self, session_id: str, doc_id: str):
+        self._execute("DELETE FROM documents WHERE session_id = ? AND id = ?", (session_id, doc_id))
+
+    def append_history(self, session_id: str, entry: dict):
+        self._execute("INSERT INTO history (session_id, entry) VALUES (?, ?)", (session_id, json.dumps(entry)))
+
+    def get_history(self, session_id: str) -> list[dict]:
+        rows = self._query("SELECT entry FROM history WHERE session_id = ? ORDER BY seq", (session_id,))
+        return [json.loads(entry) for (entry,) in rows]
+
+    def save_job(self, job: dict, owner: str):
+        self._execute(
+            "INSERT INTO jobs (id, session_id, status, owner, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET status = excluded.status, owner = excluded.owner, data = excluded.data",
+            (job["id"], job["session_id"], job["status"], owner, json.dumps(job))
+        )
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        rows = self._query("SELECT data FROM jobs WHERE id = ?", (job_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def list_jobs(self, session_id: str) -> list[dict]:
+        rows = self._query("SELECT data FROM jobs WHERE session_id = ? ORDER BY rowid", (session_id,))
+        return [json.loads(data) for (data,) in rows]
+
+    def request_cancel(self, job_id: str):
+        self._execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+
+    def cancel_requested(self, job_id: str) -> bool:
+        rows = self._query("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,))
+        return bool(rows and rows[0][0])
+
+    def recover_interrupted_jobs(self) -> int:
+        """
+        Jobs left queued/running by a dead worker on this host are marked failed and
+        their documents go back to their last settled status.
+        """
+        placeholders = ",".join("?" * len(ACTIVE_JOB_STATES))
+        rows = self._query(f"SELECT data, owner FROM jobs WHERE status IN ({placeholders})", ACTIVE_JOB_STATES)
+        host = socket.gethostname()
+        recovered = 0
+        for data, owner in rows:
+            owner_host, _, pid = owner.rpartition(":")
+            if owner_host != host or _pid_alive(int(pid)):
+                continue
+            job = json.loads(data)
+            job.update(status="failed", error="Interrupted by a server restart",
+                       message="Interrupted by a server restart",
+                       finished_at=datetime.datetime.now().isoformat())
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, data = ? WHERE id = ?", (job["status"], json.dumps(job), job["id"])
+                )
+                self._conn.execute(
+                    "UPDATE documents SET status = CASE WHEN indexed THEN 'indexed' ELSE 'uploaded' END "
+                    f"WHERE session_id = ? AND status IN ({placeholders})",
+                    (job["session_id"], *ACTIVE_JOB_STATES)
+                )
+            recovered += 1
+        return recovered
+
+def create_session_store() -> SessionStore:
+    """The store named by SESSION_STORE_BACKEND: "sqlite" or a "module:Class" path"""
+    if SESSION_STORE_BACKEND == "sqlite":
+        return SQLiteSessionStore()
+    module_name, _, class_name = SESSION_STORE_BACKEND.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
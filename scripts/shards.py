@@ -0,0 +1,168 @@
+"""
+Per-document index shards shared by every session: one document's chunks, vectors
+and BM25 postings under one chunking, stored once and reference counted. A session
+index is a manifest naming the shards it is composed of.
+"""
+import os
+import time
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from .config import SHARD_DIR
+from .manifest import MANIFEST_NAME, index_write_lock
+
+# manifest["layout"] of session indexes composed of shards
+SHARDED_LAYOUT = "shards"
+REFS_NAME = "refs.sqlite"
+
+def shard_key(content_hash: str, chunk_size: int, chunk_overlap: int) -> str:
+    """Shards are identified by content and chunking, never by who uploaded the file"""
+    return f"{content_hash}-{chunk_size}-{chunk_overlap}"
+
+def is_sharded(manifest: dict) -> bool:
+    return manifest.get("layout") == SHARDED_LAYOUT
+
+class ShardStore:
+    """
+    Shards stored as <root>/<key[:2]>/<key>/ in the usual index layout (FAISS index,
+    SQLite docstore, BM25 index, manifest). Each (session index, doc_id) holding a
+    shard is a reference; shards without references are removed by collect_garbage().
+    """
+
+    def __init__(self, root=SHARD_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use, so importing the store creates no files
+        if self._conn is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.root / REFS_NAME), check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS refs ("
+                "index_path TEXT NOT NULL, doc_id TEXT NOT NULL, shard TEXT NOT NULL, "
+                "PRIMARY KEY (index_path, doc_id, shard))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_refs_shard ON refs(shard)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def exists(self, key: str) -> bool:
+        """Whether the shard is complete (its manifest is written last)"""
+        return (self.path(key) / MANIFEST_NAME).exists()
+
+    def lock(self, key: str):
+        """Exclusive lock on one shard across processes, held while building or removing it"""
+        return index_write_lock(self.path(key))
+
+    def size(self, key: str) -> int:
+        total = 0
+        for root, _, files in os.walk(self.path(key)):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass  # removed while walking
+        return total
+
+    def add_refs(self, index_path, refs: dict):
+        """Record that the index at index_path uses shard refs[doc_id] for each doc_id"""
+        index_path = os.path.abspath(index_path)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO refs (index_path, doc_id, shard) VALUES (?, ?, ?)",
+                    [(index_path, doc_id, key) for doc_id, key in refs.items()]
+                )
+
+    def release(self, index_path, refs: dict):
+        """Drop references taken by add_refs"""
+        index_path = os.path.abspath(index_path)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "DELETE FROM refs WHERE index_path = ? AND doc_id = ? AND shard = ?",
+                    [(index_path, doc_id, key) for doc_id, key in refs.items()]
+                )
+        self._touch(set(refs.values()))
+
+    def release_index(self, index_path):
+        """Drop every reference held by an index (the session was removed)"""
+        index_path = os.path.abspath(index_path)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                keys = {key for (key,) in conn.execute("SELECT shard FROM refs WHERE index_path = ?", (index_path,))}
+                conn.execute("DELETE FROM refs WHERE index_path = ?", (index_path,))
+        self._touch(keys)
+
+    def _touch(self, keys):
+        # Released shards get a grace period before garbage collection (see collect_garbage)
+        for key in keys:
+            try:
+                os.utime(self.path(key))
+            except OSError:
+                pass
+
+    def holders(self, key: str) -> set:
+        """Paths of the indexes referencing a shard"""
+        with self._lock:
+            rows = self._connection().execute("SELECT DISTINCT index_path FROM refs WHERE shard = ?", (key,)).fetchall()
+        return {index_path for (index_path,) in rows}
+
+    def ref_counts(self) -> dict:
+        """shard key -> number of references"""
+        with self._lock:
+            rows = self._connection().execute("SELECT shard, COUNT(*) FROM refs GROUP BY shard").fetchall()
+        return dict(rows)
+
+    def stored(self) -> dict:
+        """shard key -> bytes on disk"""
+        sizes = {}
+        if not self.root.exists():
+            return sizes
+        for prefix in self.root.iterdir():
+            if prefix.is_dir():
+                for shard in prefix.iterdir():
+                    sizes[shard.name] = self.size(shard.name)
+        return sizes
+
+    def collect_garbage(self, min_age_seconds: float, on_remove=None) -> tuple[int, int]:
+        """
+        Remove shards no index references, unless released or built within
+        min_age_seconds. on_remove(path) runs for each removed shard (e.g. to drop
+        it from caches). Returns (shards removed, bytes freed).
+        """
+        cutoff = time.time() - min_age_seconds
+        counts = self.ref_counts()
+        removed = freed = 0
+        for key, nbytes in self.stored().items():
+            if counts.get(key):
+                continue
+            path = self.path(key)
+            try:
+                if path.stat().st_mtime > cutoff:
+                    continue
+            except OSError:
+                continue
+            with self.lock(key):
+                # An index may have taken a reference since the counts were read
+                if self.ref_counts().get(key):
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            if on_remove is not None:
+                on_remove(path)
+            removed += 1
+            freed += nbytes
+        return removed, freed
+
+shard_store = ShardStore()
@@ -0,0 +1,85 @@
+"""Cold-start support: pipeline modules imported on first use, and startup phase timings"""
+import sys
+import time
+import asyncio
+import datetime
+import importlib
+import threading
+from contextlib import contextmanager
+
+_phases = []  # {"name", "seconds", "finished_at"} in completion order
+_phases_lock = threading.Lock()
+# One import at a time: two threads importing overlapping module graphs can deadlock
+_import_lock = threading.RLock()
+
+def record_phase(name: str, seconds: float):
+    """Add a timed startup step to report()"""
+    with _phases_lock:
+        _phases.append({
+            "name": name,
+            "seconds": round(seconds, 4),
+            "finished_at": datetime.datetime.now().isoformat(),
+        })
+    print(f"Startup: {name} took {seconds:.2f}s")
+
+@contextmanager
+def phase(name: str):
+    """Time the block as a startup step"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+class LazyModule:
+    """Stands in for a module and imports it the first time an attribute is used"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the module was imported, through this proxy or directly by another module"""
+        return self._module is not None or self._name in sys.modules
+
+    def load(self):
+        if self._module is None:
+            with _import_lock:
+                if self._module is None:
+                    with phase(f"import {self._name}"):
+                        self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+_lazy_modules = []
+
+def lazy_import(name: str) -> LazyModule:
+    module = LazyModule(name)
+    _lazy_modules.append(module)
+    return module
+
+async def aload(*modules: LazyModule):
+    """
+    Import lazily imported modules in a worker thread. Coroutines await this before
+    using the modules, so a cold import (or waiting for one in progress) never
+    blocks the event loop.
+    """
+    pending = [module for module in modules if module._module is None]
+    if pending:
+        await asyncio.to_thread(lambda: [module.load() for module in pending])
+
+def load_all():
+    """Import every lazily imported module now"""
+    for module in _lazy_modules:
+        module.load()
+
+def report() -> dict:
+    with _phases_lock:
+        phases = list(_phases)
+    return {
+        "phases": phases,
+        "modules": {module._name: module.loaded for module in _lazy_modules},
+    }
@@ -0,0 +1,150 @@
+"""Process-wide LRU cache of loaded vector stores, bounded by a memory budget"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable
+from .config import VECTORSTORE_CACHE_MAX_BYTES
+from .manifest import index_version
+
+def estimate_vectorstore_bytes(vectorstore) -> int:
+    """Approximate resident size: FAISS index, in-memory chunk text and the BM25 index"""
+    # Imported here so the server can start without loading FAISS and LangChain
+    from .ann import estimate_index_bytes
+    from .docstore import SQLiteDocstore
+    if hasattr(vectorstore, "estimate_bytes"):
+        return vectorstore.estimate_bytes()
+    nbytes = estimate_index_bytes(vectorstore.index)
+    docstore = vectorstore.docstore
+    if isinstance(docstore, SQLiteDocstore):
+        # Chunk text stays on disk; only the id map and unsaved chunks are resident
+        nbytes += len(vectorstore.index_to_docstore_id) * 100 + docstore.pending_bytes()
+    else:
+        documents = getattr(docstore, "_dict", {})
+        nbytes += sum(len(doc.page_content) + 200 for doc in documents.values())
+    lexical_index = getattr(vectorstore, "lexical_index", None)
+    if lexical_index is not None:
+        nbytes += lexical_index.estimate_bytes()
+    return nbytes
+
+class VectorStoreCache:
+    """Caches loaded vector stores keyed by (index path, index version)"""
+
+    def __init__(self, max_bytes: int = VECTORSTORE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> (version, vectorstore, nbytes), least recently used first
+        self._last_used = {}  # path -> time.monotonic() of the last hit or load
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, index_path, loader: Callable):
+        """Return the store for index_path, loading it with loader(index_path) on a miss"""
+        key = os.path.abspath(index_path)
+        version = index_version(index_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                self._last_used[key] = time.monotonic()
+                self.hits += 1
+                return entry[1]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given index; the others wait and reuse its result
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] == version:
+                    self._entries.move_to_end(key)
+                    self._last_used[key] = time.monotonic()
+                    self.hits += 1
+                    return entry[1]
+                self.misses += 1
+            vectorstore = loader(index_path)
+            self._store(key, version, vectorstore)
+            return vectorstore
+
+    def put(self, index_path, vectorstore):
+        """Insert a store that was just built and saved, replacing any older version"""
+        key = os.path.abspath(index_path)
+        self._store(key, index_version(index_path), vectorstore)
+
+    def _store(self, key, version, vectorstore):
+        nbytes = estimate_vectorstore_bytes(vectorstore)
+        with self._lock:
+            self._entries[key] = (version, vectorstore, nbytes)
+            self._entries.move_to_end(key)
+            self._last_used[key] = time.monotonic()
+            self._evict()
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the budget
+        while len(self._entries) > 1 and self.total_bytes() > self.max_bytes:
+            key, _ = self._entries.popitem(last=False)
+            self._last_used.pop(key, None)
+            self.evictions += 1
+            print(f"Evicted vector store from cache: {key}")
+
+    def evict_idle(self, max_idle_seconds: float) -> int:
+        """Drop stores not used for max_idle_seconds; returns how many were dropped"""
+        cutoff = time.monotonic() - max_idle_seconds
+        with self._lock:
+            idle = [key for key in self._entries if self._last_used.get(key, 0) < cutoff]
+            for key in idle:
+                del self._entries[key]
+                self._last_used.pop(key, None)
+            self.evictions += len(idle)
+        return len(idle)
+
+    def invalidate(self, index_path):
+        key = os.path.abspath(index_path)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._last_used.pop(key, None)
+
+    def entries(self) -> list[dict]:
+        """Loaded stores, least recently used first"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {"path": key, "version": version, "bytes": nbytes,
+                 "idle_seconds": round(now - self._last_used.get(key, now), 1)}
+                for key, (version, _, nbytes) in self._entries.items()
+            ]
+
+    def total_bytes(self) -> int:
+        return sum(nbytes for _, _, nbytes in self._entries.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes(),
+                "max_bytes": self.max_bytes,
+            }
+
+_cache = VectorStoreCache()
+
+def get(index_path, loader: Callable):
+    return _cache.get(index_path, loader)
+
+def put(index_path, vectorstore):
+    _cache.put(index_path, vectorstore)
+
+def invalidate(index_path):
+    _cache.invalidate(index_path)
+
+def evict_idle(max_idle_seconds: float) -> int:
+    return _cache.evict_idle(max_idle_seconds)
+
+def entries() -> list[dict]:
+    return _cache.entries()
+
+def stats() -> dict:
+    return _cache.stats()